@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import queue
+import sys
+import time
+
+from booking import (BASE, HEADERS, BookingEngine, compile_plan, cookie_header_from_list, describe_plan,
+                     load_seat_map, read_seat_preferences, run_plan, validate_booking, verify_login)
+from clock_sync import ClockSync
+from cookie_store import CookieStore
+from job_store import JOB_DB_PATH, read_cookies
+from metrics import Trace
+from rate_limit import BACKGROUND, BOOKING, run_as
+from scheduler import Scheduler
+from seat_cache import CACHE_SNAPSHOT_PATH, read_snapshot
+from seat_index import SEAT_INDEX, SEAT_RE, normalize_seatno
+from seat_map import SEAT_MAPS
+from session_pool import new_session
+
+# 命令行批量预约：不依赖 Flask 与网页，适合 cron / systemd 定时运行。
+#   python batch.py jobs.jsonl -o results.jsonl --at 07:00
+# 任务文件每行一个 JSON 任务（空行与 # 开头的行忽略），字段与网页的预约请求一致：
+#   {"id": "a", "client_id": "...", "seatno": "Z301037", "datetime": [480, 1320], "content": "current", "at": "07:00"}
+# Cookie 依次取任务中的 cookie（Cookie 头）或 cookies（列表）、网页为该 client_id 保存的 Cookie、全局 cookies.json。
+# at 为服务器时间：HH:MM[:SS] 表示下一次到达该时刻，也可写完整的日期时间（已过 1 分钟以上的不执行）；不写时用 --at，都没有则立即执行。
+# seatdate 不写时为触发当天。每个任务完成后向结果文件写一行 JSON。
+# 座位号与偏好座位按网页的规则校验，并且必须能在座位图中找到：座位图先取网页保存的缓存快照，缺的再向上游取。
+PREWARM_SECONDS = float(os.environ.get('HUNNU_PREWARM_SECONDS', '30'))
+LATE_GRACE_SECONDS = 60
+
+
+def read_jobs(path):
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError
+            except ValueError:
+                yield n, None
+                continue
+            yield n, job
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def parse_target(at, now):
+    # 返回服务器时间的触发时刻；None 表示立即执行
+    if not at:
+        return None
+    try:
+        t = datetime.time.fromisoformat(at)
+    except ValueError:
+        target = datetime.datetime.fromisoformat(at)
+        # 完整日期时间只容忍同样的启动延迟，更早的任务不执行（否则会立即触发并预约过去的日期）
+        if (now - target).total_seconds() > LATE_GRACE_SECONDS:
+            raise ValueError(f'触发时刻 {at} 已过')
+        return target
+    target = datetime.datetime.combine(now.date(), t)
+    # 启动稍晚（如 cron 在 07:00 整点才拉起）时立即执行，而不是顺延到明天
+    if (now - target).total_seconds() > LATE_GRACE_SECONDS:
+        target += datetime.timedelta(days=1)
+    return target
+
+
+def parse_range(dt):
+    if isinstance(dt, str):
+        dt = dt.split(',')
+    start, end = (int(x) for x in dt)
+    if start >= end:
+        raise ValueError
+    return start, end
+
+
+class BatchRunner:
+    def __init__(self, engine, clock, cookies, out, prewarm_seconds=PREWARM_SECONDS):
+        self.engine = engine
+        self.clock = clock
+        self.cookies = cookies
+        self.out = out
+        self.prewarm_seconds = prewarm_seconds
+        self.scheduler = Scheduler()
+        self.done = queue.Queue()
+        self.jobs = []
+        self.failed = 0
+
+    def headers(self, job):
+        headers = dict(HEADERS)
+        if job.get('cookie'):
+            headers['Cookie'] = job['cookie']
+        elif job.get('cookies'):
+            headers['Cookie'] = cookie_header_from_list(job['cookies'])
+        else:
+            headers['Cookie'] = self.cookies.header(job.get('client_id'))
+        return headers
+
+    def load_seat_maps(self, jobs, snapshot=CACHE_SNAPSHOT_PATH):
+        # 校验要求座位在座位图中：先载入网页保存的缓存快照，缺的阅览室再用引用它的任务的 Cookie 各取一次
+        for key, value in read_snapshot(snapshot):
+            SEAT_INDEX.on_cache_put(key, value)
+            SEAT_MAPS.on_cache_put(key, value)
+        need = {}
+        for _, job in jobs:
+            if not job:
+                continue
+            codes = [job.get('seatno') or '']
+            if job.get('content') == 'prefs':
+                try:
+                    codes += list(job['prefs']) if job.get('prefs') is not None else read_seat_preferences()
+                except Exception:
+                    pass
+            for code in codes:
+                code = normalize_seatno(code) if isinstance(code, str) else ''
+                if SEAT_RE.match(code):
+                    info = SEAT_INDEX.lookup(code)
+                    if not info['room_known']:
+                        need.setdefault(info['room'], job)
+        if need:
+            try:
+                self.engine.run(self._fetch_seat_maps(need), timeout=60)
+            except Exception:
+                # 没取到的阅览室在校验时报错
+                pass
+
+    async def _fetch_seat_maps(self, need):
+        await asyncio.gather(*(run_as(job.get('client_id'), BACKGROUND,
+                                      load_seat_map(self.engine, self.headers(job), room))
+                               for room, job in need.items()))
+
+    def add(self, n, job, default_at):
+        # 与网页相同的校验后编译预约计划；不合格的任务直接写出失败结果
+        job_id = str(job.get('id', n)) if job else str(n)
+        rec = {'id': job_id, 'line': n}
+        try:
+            if job is None:
+                raise ValueError('任务不是 JSON 对象')
+            rec['client_id'] = job.get('client_id')
+            content = job.get('content', 'current')
+            if content not in ('current', 'prefs'):
+                raise ValueError('content 应为 current 或 prefs')
+            prefs = job.get('prefs')
+            if prefs is not None and not isinstance(prefs, list):
+                raise ValueError('prefs 应为座位号列表')
+            if content != 'prefs' and not job.get('seatno'):
+                raise ValueError('座位号为空')
+            checked, err = validate_booking(job.get('seatno', ''), content, prefs, strict=True)
+            if err:
+                rec['result'] = err
+                self.write(rec)
+                return None
+            seatno = checked['seatno']
+            dt = parse_range(job.get('datetime', [0, 0]))
+            target = parse_target(job.get('at', default_at), self.clock.server_now())
+            seatdate = job.get('seatdate') or (target or self.clock.server_now()).date().isoformat()
+            plan = compile_plan(self.headers(job), seatno, seatdate, dt, content, job.get('strategy', 'sequential'),
+                                checked.get('prefs'))
+        except (TypeError, ValueError) as e:
+            rec['result'] = {'code': -1, 'msg': f'任务格式错误：{e}'}
+            self.write(rec)
+            return None
+        rec.update({'seatno': seatno, 'seatdate': seatdate, 'target': target.isoformat() if target else None})
+        if checked.get('invalid_prefs'):
+            rec['invalid_prefs'] = checked['invalid_prefs']
+        self.jobs.append((rec, plan, target))
+        return rec
+
+    def write(self, rec):
+        if (rec.get('result') or {}).get('code') != 0:
+            self.failed += 1
+        self.out.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        self.out.flush()
+
+    def describe(self):
+        for rec, plan, _ in self.jobs:
+            self.write(dict(rec, plan=describe_plan(plan), result={'code': 0, 'msg': '仅检查，未执行'}))
+
+    def arm(self):
+        # 同一触发时刻、同一 Cookie 只预热一次；预热完成后共用引擎中的长连接
+        warmed = set()
+        for i, (rec, plan, target) in enumerate(self.jobs):
+            if target is not None:
+                key = (target, plan.cookie)
+                if key not in warmed and self.prewarm_seconds > 0 and self.clock.seconds_until(target) > self.prewarm_seconds:
+                    warmed.add(key)
+                    self.scheduler.add(f'{i}:prewarm', lambda t=target: self.clock.seconds_until(t) - self.prewarm_seconds,
+                                       lambda _ms, r=rec, p=plan: self.prewarm(r, p), background=True)
+            delay = (lambda t=target: self.clock.seconds_until(t)) if target is not None else (lambda: 0.0)
+            self.scheduler.add(str(i), delay, lambda ms, r=rec, p=plan, t=target: self.fire(r, p, t, ms))
+
+    def prewarm(self, rec, plan):
+        try:
+            v = self.engine.run(run_as(rec.get('client_id'), BACKGROUND, self._prewarm(plan)), timeout=30)
+            rec['prewarm'] = {'ok': v.get('ok', False), 'via': v.get('via', v.get('reason', ''))}
+        except Exception as e:
+            rec['prewarm'] = {'ok': False, 'error': str(e)}
+
+    async def _prewarm(self, plan):
+        v = await verify_login(self.engine, plan.headers)
+        if plan.content == 'current' and plan.seatno:
+            # 推荐回退按距离排序需要座位坐标；校验时没取到的阅览室再取一次
+            room = SEAT_INDEX.lookup(plan.seatno)['room']
+            if room and SEAT_MAPS.room(room) is None:
+                await load_seat_map(self.engine, plan.headers, room)
+        return v
+
+    def fire(self, rec, plan, target, latency_ms):
+        trace = Trace()
+        trace.add('fire_lateness', latency_ms)
+        rec['fire'] = {
+            'planned': target.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] if target else None,
+            'actual': self.clock.server_now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            'latency_ms': round(latency_ms, 3),
+        }
+        t0 = time.perf_counter()
+        fut = self.engine.submit(run_as(rec.get('client_id'), BOOKING, run_plan(self.engine, plan, trace)))
+
+        def finish(f):
+            rec['booking_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+            try:
+                rec['result'] = f.result()
+            except Exception as e:
+                rec['result'] = {'code': -1, 'msg': '预约执行异常', 'error': str(e)}
+            self.done.put(rec)
+
+        fut.add_done_callback(finish)
+
+    def wait(self):
+        # 结果由主线程按完成顺序写出
+        for _ in range(len(self.jobs)):
+            self.write(self.done.get())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='批量定时预约（不启动网页服务）')
+    ap.add_argument('jobs', help='任务文件，每行一个 JSON 任务；- 表示标准输入')
+    ap.add_argument('-o', '--out', default='-', help='结果文件（JSON Lines，追加写入）；默认标准输出')
+    ap.add_argument('--at', default=None, help='任务未写 at 时的触发时刻（服务器时间），如 07:00')
+    ap.add_argument('--prewarm', type=float, default=PREWARM_SECONDS, help='提前多少秒预热连接与登录态')
+    ap.add_argument('--cookies-db', default=JOB_DB_PATH, help='网页保存的各用户 Cookie 所在的数据库')
+    ap.add_argument('--check', action='store_true', help='只校验任务并输出预约计划，不执行')
+    ap.add_argument('--seat-cache', default=CACHE_SNAPSHOT_PATH, help='网页保存的阅览室与座位图缓存快照')
+    args = ap.parse_args(argv)
+
+    cookies = CookieStore()
+    cookies.update(read_cookies(args.cookies_db))
+    session = new_session(1)
+
+    def fetch_server_date():
+        return session.get(f'{BASE}/apim/basic/BasicHandler.ashx', headers=HEADERS, timeout=5).headers.get('Date')
+
+    clock = ClockSync(fetch_server_date)
+    out = sys.stdout if args.out == '-' else open(args.out, 'a', encoding='utf-8')
+    runner = BatchRunner(BookingEngine(clock), clock, cookies, out, args.prewarm)
+    try:
+        jobs = list(read_jobs(args.jobs))
+        if any((job or {}).get('at', args.at) for _, job in jobs):
+            # 有定时任务时先对时，之后每 HUNNU_CLOCK_REFRESH_SECONDS 秒重新对时
+            clock.sync()
+            clock.ensure_running()
+        runner.load_seat_maps(jobs, args.seat_cache)
+        for n, job in jobs:
+            runner.add(n, job, args.at)
+        if args.check:
+            runner.describe()
+        else:
+            runner.arm()
+            runner.wait()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if runner.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import email.utils
+import json
+import random
+import threading
+import time
+import zlib
+
+from aiohttp import web
+
+# 本地模拟 libwx.hunnu.edu.cn：可配置延迟、抢座竞争与“未到 07:00”的时钟偏差
+DEFAULT_ROOMS = {
+    'Z101': ('HUNNU_ELB', '总馆101', 120),
+    'Z301': ('HUNNU_ELB', '总馆301', 160),
+    'Z41N': ('HUNNU_ELB', '总馆401南', 80),
+    'X602Z': ('HUNNU_XYH', '咸嘉湖602西区', 60),
+    'THP101': ('HUNNU_THP', '桃花坪101', 60),
+    'NY01': ('HUNNU_NY', '南院综合阅览室', 40),
+}
+NOT_OPEN_MSG = '预约时间未到，请于07:00后再试'
+OCCUPIED_MSG = '该座位已被预约'
+EXPIRED_HTML = '<html><body>页面停留时间过长，请重新进入</body></html>'
+
+
+class MockState:
+    def __init__(self, latency_ms=30.0, jitter_ms=10.0, contention=0.0, skew=0.0, open_at=None, cols=12, seed=None,
+                 hot_fraction=0.0, hot_contention=0.0, tail_fraction=0.0, tail_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.contention = contention
+        # 热门座位（按座位号散列选出 hot_fraction 比例）被他人抢先的概率为 hot_contention
+        self.hot_fraction = hot_fraction
+        self.hot_contention = hot_contention
+        # 长尾：tail_fraction 比例的请求在上游处理完后再多等 tail_ms 才返回
+        self.tail_fraction = tail_fraction
+        self.tail_ms = tail_ms
+        self.skew = skew
+        self.open_at = open_at
+        self.cols = cols
+        self.rng = random.Random(seed)
+        self.rooms = DEFAULT_ROOMS
+        self.reset()
+
+    def reset(self):
+        self.bookings = {}
+        self.requests = 0
+        self.tails = 0
+        self.by_endpoint = {}
+
+    def configure(self, cfg):
+        for k in ('latency_ms', 'jitter_ms', 'contention', 'skew', 'open_at', 'hot_fraction', 'hot_contention',
+                  'tail_fraction', 'tail_ms'):
+            if k in cfg:
+                setattr(self, k, cfg[k])
+
+    def now(self):
+        return time.time() + self.skew
+
+    def is_hot(self, code):
+        return zlib.crc32(code.encode()) % 1000 < self.hot_fraction * 1000
+
+    def seat_codes(self, room):
+        return [f'{room}{i:03d}' for i in range(1, self.rooms[room][2] + 1)]
+
+    def points(self, room):
+        out = []
+        for i, code in enumerate(self.seat_codes(room)):
+            out.append({'SeatNo': code[len(room):], 'Code': code, 'X': (i % self.cols) * 40, 'Y': (i // self.cols) * 40})
+        return out
+
+    def room_of(self, code):
+        best = ''
+        for room in self.rooms:
+            if code.startswith(room) and len(room) > len(best):
+                best = room
+        return best
+
+
+def _data(obj):
+    # 与真实接口一致：data 字段为再次编码的 JSON 字符串
+    return {'code': 0, 'msg': '', 'data': json.dumps(obj, ensure_ascii=False)}
+
+
+def make_app(state):
+    @web.middleware
+    async def simulate(request, handler):
+        state.requests += 1
+        name = request.path.rsplit('/', 1)[-1]
+        state.by_endpoint[name] = state.by_endpoint.get(name, 0) + 1
+        if not request.path.startswith('/__mock'):
+            delay = max(0.0, state.latency_ms + state.rng.uniform(-state.jitter_ms, state.jitter_ms))
+            await asyncio.sleep(delay / 1000)
+        resp = await handler(request)
+        if not request.path.startswith('/__mock') and state.rng.random() < state.tail_fraction:
+            state.tails += 1
+            await asyncio.sleep(state.tail_ms / 1000)
+        resp.headers['Date'] = email.utils.formatdate(state.now(), usegmt=True)
+        return resp
+
+    def expired(request):
+        return 'expired' in request.headers.get('Cookie', '')
+
+    async def seat_date(request):
+        q = request.query
+        code = q.get('seatno', '')
+        if expired(request):
+            return web.Response(text=EXPIRED_HTML, content_type='text/html')
+        if q.get('data_type') == 'cancelSeatDate':
+            key = (code, q.get('seatdate', ''))
+            if state.bookings.pop(key, None) is None:
+                return web.json_response({'code': 1, 'msg': '没有可取消的预约'})
+            return web.json_response({'code': 0, 'msg': '取消成功'})
+        if state.open_at is not None and state.now() < state.open_at:
+            return web.json_response({'code': 1, 'msg': NOT_OPEN_MSG})
+        room = state.room_of(code)
+        if not room or code not in set(state.seat_codes(room)):
+            return web.json_response({'code': 1, 'msg': '座位不存在'})
+        key = (code, q.get('seatdate', ''))
+        p = state.hot_contention if state.is_hot(code) else state.contention
+        if key in state.bookings or state.rng.random() < p:
+            state.bookings.setdefault(key, 'other')
+            return web.json_response({'code': 1, 'msg': OCCUPIED_MSG})
+        state.bookings[key] = request.headers.get('Cookie', '')
+        return web.json_response({'code': 0, 'msg': '预约成功'})
+
+    async def seat_info(request):
+        form = dict(request.query)
+        if request.method == 'POST':
+            form.update(await request.post())
+        if form.get('data_type') == 'getMapPointInit':
+            room = form.get('mapid', '')
+            if room not in state.rooms:
+                return web.json_response({'code': 1, 'msg': '阅览室不存在'})
+            return web.json_response(_data(state.points(room)))
+        if form.get('data_type') == 'GetTuiJianSeat':
+            room = form.get('addresscode', '')
+            seatdate = form.get('seatdate', '')
+            seats = []
+            for code in state.seat_codes(room) if room in state.rooms else []:
+                busy = (code, seatdate) in state.bookings
+                seats.append({'Code': code, 'ShowDataTime': '07:00-22:30' if busy else '暂无预约'})
+            state.rng.shuffle(seats)
+            return web.json_response(_data(seats[:20]))
+        return web.json_response({'code': 1, 'msg': '未知操作'})
+
+    async def rooms(request):
+        return web.json_response(_data([
+            {'AddressCode': code, 'AreaCode': area, 'AddressName': name, 'SeatCount': n}
+            for code, (area, name, n) in state.rooms.items()]))
+
+    async def user(request):
+        if expired(request):
+            return web.Response(text=EXPIRED_HTML, content_type='text/html')
+        return web.json_response(_data({'user_name': '202400000000', 'real_name': '测试用户'}))
+
+    async def basic(request):
+        if expired(request):
+            return web.Response(text=EXPIRED_HTML, content_type='text/html')
+        return web.json_response({'code': 0, 'msg': ''})
+
+    async def mock_reset(request):
+        state.reset()
+        return web.json_response({'code': 0})
+
+    async def mock_config(request):
+        state.configure(await request.json())
+        return web.json_response({'code': 0})
+
+    async def mock_stats(request):
+        return web.json_response({'requests': state.requests, 'by_endpoint': state.by_endpoint,
+                                  'bookings': len(state.bookings), 'tails': state.tails})
+
+    app = web.Application(middlewares=[simulate])
+    app.router.add_get('/apim/seat/SeatDateHandler.ashx', seat_date)
+    app.router.add_route('*', '/apim/seat/SeatInfoHandler.ashx', seat_info)
+    app.router.add_get('/apim/seat/SeatAddressHandler.ashx', rooms)
+    app.router.add_get('/apim/user/UserHandler.ashx', user)
+    app.router.add_post('/mobile/ajax/user/UserHandler.ashx', user)
+    app.router.add_get('/apim/basic/BasicHandler.ashx', basic)
+    app.router.add_get('/apim/nav/NavHandler.ashx', basic)
+    app.router.add_post('/__mock/reset', mock_reset)
+    app.router.add_post('/__mock/config', mock_config)
+    app.router.add_get('/__mock/stats', mock_stats)
+    return app
+
+
+def start_in_thread(state, host='127.0.0.1', port=0):
+    # 在后台线程启动模拟服务器，返回 (base_url, loop)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    box = {}
+
+    async def boot():
+        runner = web.AppRunner(make_app(state), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        box['port'] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(boot())
+        loop.run_forever()
+
+    threading.Thread(target=run, name='mock-libwx', daemon=True).start()
+    ready.wait(10)
+    return f'http://{host}:{box["port"]}', loop
+
+
+def main():
+    ap = argparse.ArgumentParser(description='libwx.hunnu.edu.cn 本地模拟服务器')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8899)
+    ap.add_argument('--latency-ms', type=float, default=30.0)
+    ap.add_argument('--jitter-ms', type=float, default=10.0)
+    ap.add_argument('--contention', type=float, default=0.0, help='每次预约被他人抢先的概率')
+    ap.add_argument('--tail-fraction', type=float, default=0.0, help='响应慢于常态的请求比例')
+    ap.add_argument('--tail-ms', type=float, default=0.0, help='长尾请求额外的延迟（毫秒）')
+    ap.add_argument('--skew', type=float, default=0.0, help='服务器时钟相对本机的偏差（秒）')
+    ap.add_argument('--open-in', type=float, default=None, help='多少秒后开放预约（模拟未到 07:00）')
+    args = ap.parse_args()
+    state = MockState(args.latency_ms, args.jitter_ms, args.contention, args.skew,
+                      time.time() + args.skew + args.open_in if args.open_in is not None else None,
+                      tail_fraction=args.tail_fraction, tail_ms=args.tail_ms)
+    web.run_app(make_app(state), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.mock_server import MockState, start_in_thread
+
+# 基准测试：在本地模拟服务器上跑 web_app 的完整预约链路，结果写成 JSON 便于跨版本对比
+# 用法（仓库根目录）：python -m bench.run [--clients 50] [--compare bench/results/xxx.json]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SEATDATE = (datetime.date.today() + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+DT = [480, 720]
+
+
+def pct(values, q):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+def dist(values):
+    return {
+        'n': len(values),
+        'mean': round(statistics.fmean(values), 3) if values else 0.0,
+        'p50': round(pct(values, 0.5), 3),
+        'p95': round(pct(values, 0.95), 3),
+        'p99': round(pct(values, 0.99), 3),
+        'max': round(max(values), 3) if values else 0.0,
+    }
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return ''
+
+
+class Bench:
+    def __init__(self, web_app, state):
+        self.web_app = web_app
+        self.state = state
+        self.clients = {}
+
+    def client_id(self, i):
+        cid = self.clients.get(i)
+        if cid is None:
+            cid = self.clients[i] = f'bench-{i:04d}'
+            c = self.web_app.app.test_client()
+            c.post('/api/cookies', json={'ASP.NET_SessionId': f'sess{i:04d}', 'cookie_come_sno': f'2024{i:08d}'},
+                   headers={'X-Client-Id': cid})
+        return cid
+
+    def book(self, i, seatno, content='current', strategy='sequential'):
+        c = self.web_app.app.test_client()
+        payload = {'seatno': seatno, 'seatdate': SEATDATE, 'datetime': DT, 'mode': 'now',
+                   'content': content, 'strategy': strategy}
+        t0 = time.perf_counter()
+        r = c.post('/api/book', json=payload, headers={'X-Client-Id': self.client_id(i)})
+        ms = (time.perf_counter() - t0) * 1000
+        return ms, r.get_json() or {}
+
+    def book_concurrent(self, n, seat_of, **kw):
+        for i in range(n):
+            self.client_id(i)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n) as ex:
+            out = list(ex.map(lambda i: self.book(i, seat_of(i), **kw), range(n)))
+        return (time.perf_counter() - t0) * 1000, out
+
+    def reset(self, **cfg):
+        self.state.reset()
+        self.state.configure(dict({'contention': 0.0, 'skew': 0.0, 'open_at': None, 'hot_fraction': 0.0,
+                                   'hot_contention': 0.0}, **cfg))
+
+    def latency(self, requests):
+        # 单用户串行预约空闲座位：端到端耗时与服务端分阶段耗时
+        self.reset()
+        e2e, server = [], []
+        for k in range(requests):
+            ms, j = self.book(0, f'Z101{k % 120 + 1:03d}')
+            e2e.append(ms)
+            server.append(j.get('timing', {}).get('total_ms', 0.0))
+            self.state.bookings.clear()
+        return {'e2e_ms': dist(e2e), 'server_ms': dist(server),
+                'rtt_floor_ms': self.state.latency_ms - self.state.jitter_ms}
+
+    def throughput(self, clients):
+        # N 个用户同时预约各自不同的座位
+        self.reset()
+        wall, out = self.book_concurrent(clients, lambda i: f'Z301{i % 160 + 1:03d}')
+        ok = sum(1 for _, j in out if j.get('code') == 0)
+        return {'clients': clients, 'wall_ms': round(wall, 3), 'bookings_per_s': round(clients / wall * 1000, 2),
+                'ok': ok, 'e2e_ms': dist([ms for ms, _ in out])}
+
+    def fallback(self, clients, strategy, contention):
+        # 所有用户抢同一个座位，落败者走推荐座位回退；contention 模拟其他人同时抢走候选座位
+        self.reset(contention=contention)
+        wall, out = self.book_concurrent(clients, lambda i: 'Z41N001', content='current', strategy=strategy)
+        ok = [j for _, j in out if j.get('code') == 0]
+        fell_back = [j for j in ok if j.get('seatno')]
+        attempts = [len(j.get('attempts', [])) for _, j in out if 'attempts' in j]
+        released = sum(1 for _, j in out for a in j.get('attempts', []) if a.get('released'))
+        return {'clients': clients, 'strategy': strategy, 'contention': contention,
+                'success_rate': round(len(ok) / clients, 4), 'fallback_successes': len(fell_back),
+                'mean_attempts': round(statistics.fmean(attempts), 3) if attempts else 0.0,
+                'released': released, 'wall_ms': round(wall, 3), 'e2e_ms': dist([ms for ms, _ in out])}
+
+    def ranking(self, clients, rounds):
+        # 部分座位长期是热门：对比不排序与按成功率排序时，成功前浪费的请求数与成功耗时
+        from seat_ranking import SeatRanker
+        out = {}
+        prev = self.web_app.ENGINE.ranker
+        for name, ranker in (('unranked', None), ('ranked', SeatRanker())):
+            self.web_app.ENGINE.ranker = ranker
+            self.reset(contention=0.05, hot_fraction=0.4, hot_contention=0.9)
+            wasted, tts, ok, n = [], [], 0, 0
+            per_round = []
+            for _ in range(rounds):
+                self.state.bookings.clear()
+                _, res = self.book_concurrent(clients, lambda i: 'Z41N001', content='current')
+                w = [j.get('wasted_attempts', 0) for _, j in res]
+                per_round.append(round(statistics.fmean(w), 3))
+                wasted += w
+                tts += [j['time_to_success_ms'] for _, j in res if 'time_to_success_ms' in j]
+                ok += sum(1 for _, j in res if j.get('code') == 0)
+                n += len(res)
+            out[name] = {'mean_wasted_attempts': round(statistics.fmean(wasted), 3), 'wasted_by_round': per_round,
+                         'success_rate': round(ok / n, 4), 'time_to_success_ms': dist(tts)}
+        self.web_app.ENGINE.ranker = prev
+        return dict(out, clients=clients, rounds=rounds)
+
+    def open_skew(self, clients, lead):
+        # 服务器时钟比本机快/慢：把模拟服务器时间拨到 06:59:50，校时后在服务器 07:00 前 lead 秒发出预约，
+        # 统计首次被“未到 07:00”拒绝后的重试与开放后多久预约成功
+        now = datetime.datetime.now()
+        opening = (now + datetime.timedelta(days=1)).replace(hour=7, minute=0, second=0, microsecond=0)
+        open_at = opening.timestamp()
+        self.reset(skew=open_at - 10 - time.time(), open_at=open_at)
+        clock = self.web_app.CLOCK
+        est = clock.sync()
+        wait = clock.seconds_until(opening) - lead
+        if wait > 0:
+            time.sleep(wait)
+        retries0 = self._counter('hunnu_open_wait_retries_total')
+        wall, out = self.book_concurrent(clients, lambda i: f'Z301{i % 160 + 1:03d}')
+        done = time.time() + self.state.skew
+        ok = sum(1 for _, j in out if j.get('code') == 0)
+        return {'clients': clients, 'lead_s': lead, 'skew_s': round(self.state.skew, 3),
+                'clock_error_ms': round(est['error'] * 1000, 3) if est else None,
+                'ok': ok, 'retries': self._counter('hunnu_open_wait_retries_total') - retries0,
+                'finished_after_open_ms': round((done - open_at) * 1000, 3), 'e2e_ms': dist([ms for ms, _ in out])}
+
+    def _counter(self, name):
+        for line in self.web_app.METRICS.render().splitlines():
+            if line.startswith(name + ' '):
+                return int(float(line.split()[1]))
+        return 0
+
+
+def compare(cur, prev_path):
+    # 打印关键指标与上一次结果的差异
+    with open(prev_path, 'r', encoding='utf-8') as f:
+        prev = json.load(f)
+    keys = [
+        ('latency', 'e2e_ms', 'p50'), ('latency', 'e2e_ms', 'p95'), ('latency', 'server_ms', 'p50'),
+        ('throughput', 'bookings_per_s'), ('throughput', 'wall_ms'),
+        ('fallback_sequential', 'success_rate'), ('fallback_sequential', 'wall_ms'),
+        ('fallback_race', 'success_rate'), ('fallback_race', 'wall_ms'),
+        ('ranking', 'ranked', 'mean_wasted_attempts'), ('ranking', 'unranked', 'mean_wasted_attempts'),
+        ('open_skew', 'finished_after_open_ms'),
+    ]
+    for path in keys:
+        a, b = prev.get('scenarios', {}), cur.get('scenarios', {})
+        for k in path:
+            a = a.get(k, {}) if isinstance(a, dict) else {}
+            b = b.get(k, {}) if isinstance(b, dict) else {}
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            delta = (b - a) / a * 100 if a else 0.0
+            print(f'{".".join(path):45s} {a:>12.3f} -> {b:>12.3f}  ({delta:+.1f}%)')
+
+
+def main():
+    ap = argparse.ArgumentParser(description='预约链路基准测试（本地模拟服务器）')
+    ap.add_argument('--requests', type=int, default=50, help='串行延迟测试的预约次数')
+    ap.add_argument('--clients', type=int, default=50, help='并发用户数')
+    ap.add_argument('--latency-ms', type=float, default=30.0)
+    ap.add_argument('--jitter-ms', type=float, default=10.0)
+    ap.add_argument('--contention', type=float, default=0.3, help='回退测试中候选座位被他人抢走的概率')
+    ap.add_argument('--rounds', type=int, default=10, help='排序测试的轮数')
+    ap.add_argument('--lead', type=float, default=1.0, help='比服务器 07:00 提前多少秒发出预约')
+    ap.add_argument('--skip', default='', help='跳过的场景，逗号分隔：latency,throughput,fallback,ranking,open_skew')
+    ap.add_argument('--out', default='', help='结果文件路径，默认 bench/results/<时间>.json')
+    ap.add_argument('--compare', default='', help='与之前的结果文件对比')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    state = MockState(args.latency_ms, args.jitter_ms, seed=args.seed)
+    base, _ = start_in_thread(state)
+    workdir = tempfile.mkdtemp(prefix='hunnu-bench-')
+    # web_app 在导入时读取这些配置，必须先于导入设置
+    os.environ['HUNNU_BASE'] = base
+    os.environ['HUNNU_JOB_DB'] = os.path.join(workdir, 'jobs.db')
+    os.environ['HUNNU_CACHE_SNAPSHOT'] = ''
+    os.environ.setdefault('HUNNU_CLOCK_PROBES', '5')
+    # 模拟服务器实现了取消接口，fallback_race 场景需要开启并发抢座
+    os.environ.setdefault('HUNNU_RACE_ENABLED', '1')
+    import web_app
+
+    bench = Bench(web_app, state)
+    c = web_app.app.test_client()
+    c.get('/api/rooms')
+    for room in state.rooms:
+        c.get('/api/seats', query_string={'room_id': room})
+
+    skip = {s.strip() for s in args.skip.split(',') if s.strip()}
+    scenarios = {}
+    if 'latency' not in skip:
+        scenarios['latency'] = bench.latency(args.requests)
+    if 'throughput' not in skip:
+        scenarios['throughput'] = bench.throughput(args.clients)
+    if 'fallback' not in skip:
+        scenarios['fallback_sequential'] = bench.fallback(args.clients, 'sequential', args.contention)
+        scenarios['fallback_race'] = bench.fallback(args.clients, 'race', args.contention)
+    if 'ranking' not in skip:
+        scenarios['ranking'] = bench.ranking(min(args.clients, 20), args.rounds)
+    if 'open_skew' not in skip:
+        scenarios['open_skew'] = bench.open_skew(args.clients, args.lead)
+
+    result = {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git': git_rev(),
+        'python': sys.version.split()[0],
+        'config': vars(args),
+        'scenarios': scenarios,
+        'phases': web_app.METRICS.summary('hunnu_phase_ms'),
+        'upstream': web_app.METRICS.summary('hunnu_upstream_ms'),
+        'mock': {'requests': state.requests, 'by_endpoint': state.by_endpoint},
+    }
+    out = args.out or os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(scenarios, ensure_ascii=False, indent=2))
+    print('结果已保存：' + out)
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    main()
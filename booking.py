@@ -0,0 +1,662 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+import aiohttp
+from yarl import URL
+
+from metrics import METRICS, Trace
+from occupancy import free_windows
+from rate_limit import OUTBOUND, current as current_outbound
+from request_policy import POLICY, BudgetExceeded, end_budget, exhausted, remaining, start_budget, suspend_budget
+from seat_index import SEAT_INDEX
+from seat_map import SEAT_MAPS
+from single_flight import SINGLE_FLIGHT
+
+ENGINE_LIMIT = int(os.environ.get('HUNNU_ENGINE_LIMIT', '100'))
+ENGINE_KEEPALIVE_SECONDS = float(os.environ.get('HUNNU_ENGINE_KEEPALIVE_SECONDS', '60'))
+# 距服务器 07:00 不超过这么多秒时才等待开放后重试，更早的预约直接返回服务器的“未到 07:00”
+OPEN_WAIT_MAX_SECONDS = 5.0
+# 并发抢座依赖取消接口释放多抢到的座位，该接口尚未在真实服务器上验证，默认关闭（race 按逐个尝试执行）
+RACE_ENABLED = int(os.environ.get('HUNNU_RACE_ENABLED', '0')) > 0
+RACE_TOP_K = int(os.environ.get('HUNNU_RACE_TOP_K', '3'))
+RACE_CONCURRENCY = int(os.environ.get('HUNNU_RACE_CONCURRENCY', '2'))
+# 有座位坐标时，推荐回退先试离所选座位最近的几个空闲座位
+NEAREST_K = int(os.environ.get('HUNNU_NEAREST_K', '8'))
+# 取消预约接口的 data_type，与 seatDate 使用同一个 Handler
+CANCEL_DATA_TYPE = 'cancelSeatDate'
+
+BUDGET_EXCEEDED = {'code':-1,'msg':'预约超出时间预算'}
+
+PreparedRequest = namedtuple('PreparedRequest', 'method url headers data seatno')
+BookingPlan = namedtuple('BookingPlan', 'seatno seatdate dt content strategy headers cookie primary candidates recommend')
+
+BASE = os.environ.get('HUNNU_BASE', 'https://libwx.hunnu.edu.cn')
+HEADERS = {
+    'Host': 'libwx.hunnu.edu.cn',
+    'Origin': 'https://libwx.hunnu.edu.cn',
+    'Referer': 'https://libwx.hunnu.edu.cn/mobile/wxindex.aspx',
+    'User-Agent': '7.0.5 WindowsWechat',
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'X-Requested-With': 'XMLHttpRequest'
+}
+
+def cookie_header_from_list(arr):
+    best_idx = {}
+    for i, c in enumerate(arr or []):
+        name = (c.get('name') or '').strip()
+        value = (c.get('value') or '').strip()
+        if not name or not value:
+            continue
+        domain = (c.get('domain') or '').strip().lower()
+        score = 0
+        if domain == 'libwx.hunnu.edu.cn':
+            score = 2
+        elif domain == '.libwx.hunnu.edu.cn':
+            score = 1
+        prev = best_idx.get(name)
+        if prev is None or score > prev[0] or (score == prev[0] and i > prev[1]):
+            best_idx[name] = (score, i, value)
+    out = []
+    seen = set()
+    for i, c in enumerate(arr or []):
+        name = (c.get('name') or '').strip()
+        if not name or name in seen:
+            continue
+        chosen = best_idx.get(name)
+        if chosen and chosen[1] == i:
+            out.append(f"{name}={chosen[2]}")
+            seen.add(name)
+    for name, (_, i, value) in best_idx.items():
+        if name not in seen:
+            out.append(f"{name}={value}")
+            seen.add(name)
+    return '; '.join(out)
+
+def is_occupied_msg(msg):
+    m = (msg or '')
+    return ('被预约' in m) or ('已有预约' in m) or ('已被预约' in m)
+
+def infer_recommend_params(seatno, seatdate):
+    # 区域与阅览室代码从座位索引中 O(1) 查得，分区房间（Z41N、X602Z 等）走前缀树
+    info = SEAT_INDEX.lookup(seatno)
+    return {'data_type':'GetTuiJianSeat','areacode':info['area'],'addresscode':info['room'],'seatdate':seatdate}
+
+def read_seat_preferences():
+    prefs = []
+    with open('seat_preferences.txt','r',encoding='utf-8') as f:
+        txt = f.read()
+        for token in txt.replace(',', ' ').split():
+            t = token.strip()
+            if t:
+                prefs.append(t)
+    return prefs
+
+def validate_booking(seatno, content, prefs=None, strict=False):
+    # 预约前校验并规范化座位号与偏好列表，避免 7 点整才从服务器得知座位不存在；返回 (结果, 错误)
+    # prefs 未提供时读偏好文件；strict 时座位图未缓存的阅览室也算错误
+    if seatno:
+        seatno, err = SEAT_INDEX.validate(seatno, strict)
+        if err:
+            return None, {'code':-1,'msg':err,'seatno':seatno}
+    out = {'seatno': seatno}
+    if content == 'prefs':
+        try:
+            raw = read_seat_preferences() if prefs is None else list(prefs)
+        except Exception:
+            return None, {'code':-1,'msg':'读取偏好文件失败'}
+        codes = []
+        invalid = []
+        for p in raw:
+            code, err = SEAT_INDEX.validate(p, strict)
+            if err:
+                invalid.append({'seatno':code,'msg':err})
+            elif code not in codes:
+                codes.append(code)
+        if not codes and not seatno:
+            msg = '偏好文件中没有可用座位' if prefs is None else '偏好座位中没有可用座位'
+            return None, {'code':-1,'msg':msg,'invalid_prefs':invalid}
+        out['prefs'] = codes
+        if invalid:
+            out['invalid_prefs'] = invalid
+    return out, None
+
+def open_wait_seconds(clock):
+    # 根据服务器时钟估计计算距服务器 07:00 还需等待多久，请求到达时刚好过 07:00；离开放还远时返回 None（不等待）
+    est = clock.estimate() if clock else None
+    if not est:
+        return 0.5
+    now = clock.server_now()
+    opening = now.replace(hour=7, minute=0, second=0, microsecond=0)
+    wait = (opening - now).total_seconds() - est['rtt'] / 2 + est['error']
+    if wait <= 0:
+        # 估计已过 07:00 但服务器仍拒绝，说明估计有偏差，短暂退避并在后台重新校时
+        threading.Thread(target=clock.sync, daemon=True).start()
+        return min(0.5, max(0.05, est['error']))
+    return wait if wait <= OPEN_WAIT_MAX_SECONDS else None
+
+class BookingEngine:
+    # 预约引擎：后台线程里跑一个事件循环，所有客户端共用一个 aiohttp 连接池，
+    # 7 点整多个用户的预约在同一个循环里并发发出，而不是在线程里排队
+    def __init__(self, clock=None, limit=ENGINE_LIMIT, keepalive_seconds=ENGINE_KEEPALIVE_SECONDS):
+        self.clock = clock
+        self.limit = limit
+        self.keepalive_seconds = keepalive_seconds
+        self._lock = threading.Lock()
+        self._loop = None
+        self._http = None
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        # on_seats(推荐接口参数, 座位列表)：推荐结果的旁路观察者（如占用采集）
+        self.on_seats = None
+        # on_seat_map(阅览室, 座位图)：回退时取到的座位图交给调用方缓存；未设置时直接更新座位索引
+        self.on_seat_map = None
+        # ranker：按触发时仍空闲的估计概率重排候选座位（见 seat_ranking.py）
+        self.ranker = None
+
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='booking-engine', daemon=True).start()
+            return self._loop
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def _client(self):
+        if self._http is None or self._http.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request)
+            trace.on_connection_create_end.append(self._on_connect)
+            trace.on_connection_reuseconn.append(self._on_reuse)
+            trace.on_dns_resolvehost_start.append(self._on_phase_start)
+            trace.on_dns_resolvehost_end.append(self._on_dns_end)
+            trace.on_connection_create_start.append(self._on_phase_start)
+            connector = aiohttp.TCPConnector(limit=self.limit, ssl=False, keepalive_timeout=self.keepalive_seconds)
+            self._http = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                               trace_configs=[trace], trust_env=False)
+        return self._http
+
+    async def _on_request(self, session, ctx, params):
+        self.requests += 1
+
+    async def _on_phase_start(self, session, ctx, params):
+        ctx.phase_t0 = time.perf_counter()
+
+    async def _on_dns_end(self, session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx.add('dns', (time.perf_counter() - ctx.phase_t0) * 1000)
+
+    async def _on_connect(self, session, ctx, params):
+        self.new_connections += 1
+        # TCP 建连 + TLS 握手（含 DNS）
+        t0 = getattr(ctx, 'phase_t0', None)
+        if t0 is not None and ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx.add('connect', (time.perf_counter() - t0) * 1000)
+
+    async def _on_reuse(self, session, ctx, params):
+        self.reused_connections += 1
+
+    async def _fetch_once(self, endpoint, method, url, headers, params, data, timeout, trace):
+        t0 = time.perf_counter()
+        try:
+            async with self._client().request(method, url, headers=headers, params=params, data=data,
+                                              timeout=aiohttp.ClientTimeout(total=timeout),
+                                              trace_request_ctx=trace) as r:
+                return r.status, await r.text(errors='replace')
+        except asyncio.CancelledError:
+            # 对冲落败被取消的请求不计入延迟分布
+            t0 = None
+            raise
+        finally:
+            if t0 is not None:
+                METRICS.observe('hunnu_upstream_ms', (time.perf_counter() - t0) * 1000, (('endpoint', endpoint),))
+
+    async def fetch(self, method, url, headers, params=None, data=None, timeout=None, trace=None):
+        # timeout 未指定时按接口策略由观测到的延迟分位数决定；处于预约预算内时不超过剩余预算
+        path = url.path if isinstance(url, URL) else URL(url).path
+        endpoint = path.rsplit('/', 1)[-1]
+        pol = POLICY.get(endpoint)
+        if timeout is None:
+            timeout = POLICY.timeout(endpoint, pol)
+        await self._acquire()
+        rem = remaining()
+        if rem is not None:
+            if rem <= 0:
+                POLICY.budget_exceeded += 1
+                raise BudgetExceeded('预约超出时间预算')
+            timeout = min(timeout, rem)
+        delay = POLICY.hedge_delay(endpoint, pol)
+        once = lambda: self._fetch_once(endpoint, method, url, headers, params, data, timeout, trace)
+        if delay is None or delay >= timeout:
+            return await once()
+        return await self._hedged(once, delay, pol['idempotent'])
+
+    async def _acquire(self):
+        # 按当前协程的用户与优先级排队领取上游请求令牌；处于预约预算内时最多等到预算用完
+        client_id, priority = current_outbound()
+        rem = remaining()
+        if rem is not None and rem <= 0:
+            POLICY.budget_exceeded += 1
+            raise BudgetExceeded('预约超出时间预算')
+        await OUTBOUND.acquire_async(client_id, priority, rem)
+
+    async def _queued(self, once):
+        await self._acquire()
+        return await once()
+
+    async def _hedged(self, once, delay, idempotent):
+        # 超过 p95 仍未返回时再发一份，先到的可用结果为准，另一份取消。
+        # 非幂等接口只有成功才能提前结束：两份请求到达上游后，后处理的那份会因“已预约”失败，
+        # 先到的失败可能正是这种重复，要等另一份的结果
+        tasks = [asyncio.ensure_future(once())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            POLICY.hedges += 1
+            METRICS.inc('hunnu_hedged_requests_total')
+            tasks.append(asyncio.ensure_future(self._queued(once)))
+            pending = set(tasks)
+            fallback = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in sorted(done, key=tasks.index):
+                    if t.exception() is None and (idempotent or _succeeded(t.result())):
+                        if t is tasks[1]:
+                            POLICY.hedge_wins += 1
+                            METRICS.inc('hunnu_hedge_wins_total')
+                        return t.result()
+                    if fallback is None or fallback.exception() is not None:
+                        fallback = t
+            return fallback.result()
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+                elif not t.cancelled():
+                    t.exception()
+
+    async def send(self, req, timeout=None, trace=None):
+        return await self.fetch(req.method, req.url, req.headers, data=req.data, timeout=timeout, trace=trace)
+
+    async def get_json(self, url, headers, params=None, timeout=None):
+        _, txt = await self.fetch('GET', url, headers, params=params, timeout=timeout)
+        return json.loads(txt)
+
+    async def post_json(self, url, headers, data=None, timeout=None):
+        _, txt = await self.fetch('POST', url, headers, data=data, timeout=timeout)
+        return json.loads(txt)
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'keepalive_seconds': self.keepalive_seconds,
+            'requests': self.requests,
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+        }
+
+def _succeeded(res):
+    try:
+        return json.loads(res[1]).get('code') == 0
+    except Exception:
+        return False
+
+async def verify_login(engine, headers, trace=None):
+    # 尝试基础接口以判断登录态
+    url1 = f'{BASE}/apim/basic/BasicHandler.ashx'
+    status1, raw1 = await engine.fetch('GET', url1, headers, trace=trace)
+    try:
+        _ = json.loads(raw1)
+        return {'ok': True, 'via': 'basic'}
+    except Exception:
+        url2 = f'{BASE}/apim/nav/NavHandler.ashx'
+        _, raw2 = await engine.fetch('GET', url2, headers)
+        try:
+            _ = json.loads(raw2)
+            return {'ok': True, 'via': 'nav'}
+        except Exception:
+            raw1 = raw1[:300]
+            reason = 'session_expired' if '页面停留时间过长' in (raw1 or '') else 'unknown'
+            return {'ok': False, 'status': status1, 'raw': raw1, 'reason': reason}
+
+def prepare_seat_date(headers, seatno, seatdate, dt):
+    query = urlencode({'data_type':'seatDate','seatno':seatno,'seatdate':seatdate,'datetime':f"{dt[0]},{dt[1]}"})
+    return PreparedRequest('GET', URL(f'{BASE}/apim/seat/SeatDateHandler.ashx?{query}', encoded=True), headers, None, seatno)
+
+def prepare_recommend(headers, seatno, seatdate):
+    return PreparedRequest('POST', URL(f'{BASE}/apim/seat/SeatInfoHandler.ashx', encoded=True), headers,
+                           infer_recommend_params(seatno, seatdate), seatno)
+
+def compile_plan(headers, seatno, seatdate, dt, content, strategy='sequential', prefs=None):
+    # 预约计划在排期时一次性生成：候选顺序、编码好的 URL 与请求头全部就绪，触发时只需依次发送
+    headers = dict(headers)
+    dt = (int(dt[0]), int(dt[1]))
+    if strategy == 'race' and not RACE_ENABLED:
+        strategy = 'sequential'
+    candidates = ()
+    if content == 'prefs':
+        try:
+            if prefs is None:
+                prefs = read_seat_preferences()
+            seen = {seatno} if seatno else set()
+            codes = []
+            for code in prefs:
+                if code in seen:
+                    continue
+                seen.add(code)
+                codes.append(code)
+            candidates = tuple(prepare_seat_date(headers, code, seatdate, dt) for code in codes)
+        except Exception:
+            # 偏好文件读取失败，执行时按原逻辑返回失败信息
+            candidates = None
+    primary = prepare_seat_date(headers, seatno, seatdate, dt) if (seatno or content != 'prefs') else None
+    recommend = prepare_recommend(headers, seatno, seatdate) if content == 'current' else None
+    return BookingPlan(seatno, seatdate, dt, content, strategy, headers, headers.get('Cookie', ''), primary, candidates, recommend)
+
+def describe_plan(plan):
+    cookie_names = [x.split('=', 1)[0].strip() for x in plan.cookie.split(';') if x.strip()]
+    out = {
+        'seatno': plan.seatno,
+        'content': plan.content,
+        'strategy': plan.strategy,
+        'cookie_names': cookie_names,
+        'primary': str(plan.primary.url) if plan.primary else None,
+        'candidates': [r.seatno for r in plan.candidates] if plan.candidates is not None else None,
+        'recommend': dict(plan.recommend.data) if plan.recommend else None,
+    }
+    return out
+
+async def send_seat_date(engine, req, trace=None):
+    # 增加自动重试机制：应对本地时间快于服务器时间导致"未到7点"被拒的情况
+    trace = trace or Trace()
+    status = 0
+    for i in range(6):
+        try:
+            with trace.span('seat_date'):
+                status, txt = await engine.send(req, trace=trace)
+            j = json.loads(txt)
+            msg = j.get('msg', '') or ''
+            # 如果是"时间未到"类错误，且不是最后一次尝试，则按服务器时钟等到 07:00 后重试
+            if j.get('code') != 0 and '07:00' in msg and i < 5:
+                wait = open_wait_seconds(engine.clock)
+                if wait is None:
+                    return j
+                METRICS.inc('hunnu_open_wait_retries_total')
+                with trace.span('open_wait'):
+                    if not await _budget_sleep(wait):
+                        return dict(BUDGET_EXCEEDED)
+                continue
+            return j
+        except BudgetExceeded:
+            return dict(BUDGET_EXCEEDED)
+        except Exception as e:
+            if i < 5:
+                if not await _budget_sleep(0.5):
+                    return dict(BUDGET_EXCEEDED)
+                continue
+            return {'code':-1,'msg':'接口返回异常','status':status, 'raw': str(e)}
+    return {'code':-1,'msg':'重试多次失败'}
+
+async def _budget_sleep(seconds):
+    # 等待不超过剩余预算；预算不够等完时返回 False
+    rem = remaining()
+    if rem is not None and rem <= seconds:
+        POLICY.budget_exceeded += 1
+        return False
+    await asyncio.sleep(seconds)
+    return True
+
+async def seat_date_request(engine, headers, seatno, seatdate, dt, trace=None):
+    return await send_seat_date(engine, prepare_seat_date(headers, seatno, seatdate, dt), trace)
+
+def _attempt(code, j, t0):
+    return {'seatno': code, 'ms': round((time.perf_counter() - t0) * 1000, 1), 'code': j.get('code'), 'msg': j.get('msg', '')}
+
+async def release_booking(engine, headers, seatno, seatdate, dt):
+    # 并发抢座多抢到的座位通过取消接口释放
+    url = f'{BASE}/apim/seat/SeatDateHandler.ashx'
+    params = {'data_type':CANCEL_DATA_TYPE,'seatno':seatno,'seatdate':seatdate,'datetime':f"{dt[0]},{dt[1]}"}
+    # 释放不受预约时间预算限制
+    token = suspend_budget()
+    try:
+        j = await engine.get_json(url, headers, params=params)
+        return j.get('code') == 0
+    except Exception:
+        return False
+    finally:
+        end_budget(token)
+
+async def race_candidates(engine, plan, reqs, stop_on_error=True, trace=None, k=RACE_TOP_K, concurrency=RACE_CONCURRENCY):
+    # 每轮取前 k 个候选并发提交（同时在途不超过 concurrency），保留第一个成功的，其余成功的释放
+    attempts = []
+    sem = asyncio.Semaphore(max(1, concurrency))
+    won = []
+
+    async def attempt(req):
+        async with sem:
+            if won or exhausted():
+                return None
+            t0 = time.perf_counter()
+            j = await send_seat_date(engine, req, trace)
+            rec = _attempt(req.seatno, j, t0)
+            attempts.append(rec)
+            if j.get('code') == 0 and not won:
+                won.append((req.seatno, j))
+                return None
+            return req.seatno, j, rec
+
+    for w in range(0, len(reqs), max(1, k)):
+        err = None
+        extras = []
+        for r in await asyncio.gather(*(attempt(req) for req in reqs[w:w + max(1, k)])):
+            if r is None:
+                continue
+            code, j, rec = r
+            if j.get('code') == 0:
+                extras.append((code, rec))
+            elif stop_on_error and err is None and not is_occupied_msg(j.get('msg', '')):
+                err = j
+        for code, rec in extras:
+            rec['released'] = await release_booking(engine, plan.headers, code, plan.seatdate, plan.dt)
+        if won:
+            return won[0][0], won[0][1], attempts, None
+        if err is not None:
+            return None, None, attempts, err
+        if exhausted():
+            return None, None, attempts, dict(BUDGET_EXCEEDED)
+    return None, None, attempts, None
+
+def rank_candidates(engine, plan, reqs, distance=None):
+    # distance 为离所选座位最近的几个空闲座位的距离：它们始终排在最前，
+    # 排序只在“近处座位”与“其余座位”两组内部分别稳定重排，不打乱组间顺序
+    ranker = engine.ranker
+    if ranker is None or len(reqs) < 2:
+        return reqs
+    groups = [reqs]
+    if distance:
+        groups = [[r for r in reqs if r.seatno in distance], [r for r in reqs if r.seatno not in distance]]
+    out = []
+    for group in groups:
+        if len(group) < 2:
+            out.extend(group)
+            continue
+        order, _ = ranker.rank([r.seatno for r in group], plan.dt)
+        pos = {code: i for i, code in enumerate(order)}
+        out.extend(sorted(group, key=lambda r: pos[r.seatno]))
+    return out
+
+async def try_candidates(engine, plan, reqs, stop_on_error=True, trace=None, distance=None):
+    reqs = rank_candidates(engine, plan, reqs, distance)
+    if plan.strategy == 'race':
+        return await race_candidates(engine, plan, reqs, stop_on_error, trace)
+    attempts = []
+    for req in reqs:
+        if exhausted():
+            return None, None, attempts, dict(BUDGET_EXCEEDED)
+        t0 = time.perf_counter()
+        j2 = await send_seat_date(engine, req, trace)
+        attempts.append(_attempt(req.seatno, j2, t0))
+        if j2.get('code') == 0:
+            return req.seatno, j2, attempts, None
+        if stop_on_error and not is_occupied_msg(j2.get('msg','')):
+            return None, None, attempts, j2
+    return None, None, attempts, None
+
+async def fetch_recommend(engine, req, trace=None):
+    # 推荐结果与用户无关：同一阅览室、日期的并发查询合并为一次请求，解析后的座位列表分给所有等待者；
+    # 返回 None 表示上游失败（如发起者登录态失效），等待者会各自再请求一次
+    async def load():
+        _, txt = await engine.send(req, trace=trace)
+        j = json.loads(txt)
+        if j.get('code') != 0:
+            return None
+        seats = json.loads(j.get('data','[]'))
+        if engine.on_seats is not None:
+            try:
+                engine.on_seats(req.data, seats)
+            except Exception:
+                pass
+        return seats
+
+    key = ('recommend', req.data.get('addresscode', ''), req.data.get('areacode', ''), req.data.get('seatdate', ''))
+    return await SINGLE_FLIGHT.do_async(key, load, accept=lambda seats: seats is not None)
+
+async def load_seat_map(engine, headers, room):
+    # 取一次阅览室座位图（带坐标），交给 on_seat_map；失败返回 None，不影响预约
+    async def load():
+        j = await engine.get_json(f'{BASE}/apim/seat/SeatInfoHandler.ashx', headers,
+                                  params={'data_type':'getMapPointInit','mapid':room})
+        return json.loads(j['data']) if j.get('code') == 0 else None
+
+    try:
+        seats = await SINGLE_FLIGHT.do_async(('seats', room), load, accept=lambda seats: seats is not None)
+    except Exception:
+        return None
+    if seats:
+        if engine.on_seat_map is not None:
+            engine.on_seat_map(room, seats)
+        else:
+            SEAT_INDEX.on_cache_put('seats:' + room, seats)
+            SEAT_MAPS.on_cache_put('seats:' + room, seats)
+    return seats
+
+async def run_plan(engine, plan, trace=None):
+    # 返回结果附带分阶段耗时 timing
+    trace = trace or Trace()
+    token = start_budget()
+    try:
+        res = await _run_plan(engine, plan, trace)
+    finally:
+        end_budget(token)
+    if isinstance(res, dict):
+        res = dict(res)
+        res['timing'] = trace.export()
+        attempts = res.get('attempts') or []
+        # 成功前白白浪费的请求数（首选座位被抢也算一次），用于衡量候选排序的效果
+        primary_lost = bool(plan.seatno) and bool(res.get('seatno') or attempts)
+        wasted = sum(1 for a in attempts if a.get('code') != 0) + (1 if primary_lost else 0)
+        res['wasted_attempts'] = wasted
+        # 并发抢座多抢到但释放失败的座位仍在该用户名下，需要提醒用户手动取消
+        unreleased = [a['seatno'] for a in attempts if a.get('released') is False]
+        if unreleased:
+            res['unreleased'] = unreleased
+            res['warning'] = f"多抢到的座位 {'、'.join(unreleased)} 释放失败，请手动取消"
+            METRICS.inc('hunnu_race_release_failed_total', len(unreleased))
+        if res.get('code') == 0:
+            res['time_to_success_ms'] = res['timing']['total_ms']
+        METRICS.observe('hunnu_wasted_attempts', wasted)
+        if engine.ranker is not None:
+            res['ranked'] = True
+            try:
+                engine.ranker.learn(plan.seatno, res)
+            except Exception:
+                pass
+    return res
+
+async def _run_plan(engine, plan, trace):
+    if plan.content == 'prefs' and not plan.seatno:
+        try:
+            if plan.candidates is None:
+                return {'code':-1,'msg':'读取偏好文件失败'}
+            if not plan.candidates:
+                return {'code':-1,'msg':'偏好文件为空'}
+            code, j2, attempts, err = await try_candidates(engine, plan, plan.candidates, trace=trace)
+            if code:
+                return {'code':0,'msg':'已使用偏好座位预约成功','seatno':code,'data':j2,'attempts':attempts}
+            if err is not None:
+                return dict(err, attempts=attempts)
+            return {'code':-1,'msg':'偏好座位均不可用','attempts':attempts}
+        except Exception:
+            return {'code':-1,'msg':'读取偏好文件失败'}
+    j = await send_seat_date(engine, plan.primary, trace)
+    if plan.content == 'current':
+        if j.get('code') == 0 or not is_occupied_msg(j.get('msg','')):
+            return j
+        try:
+            with trace.span('recommend'):
+                # 按距离排序需要座位坐标：座位图未缓存时与推荐查询并发取，不在主请求前多一次往返
+                room = SEAT_INDEX.lookup(plan.seatno)['room'] if plan.seatno else ''
+                if room and SEAT_MAPS.room(room) is None:
+                    seats, _ = await asyncio.gather(fetch_recommend(engine, plan.recommend, trace),
+                                                    load_seat_map(engine, plan.headers, room))
+                else:
+                    seats = await fetch_recommend(engine, plan.recommend, trace)
+                seats = seats or []
+            # 整间阅览室一次过滤，按包含所选时段的连续空闲时长排序
+            free, busy = free_windows(seats, plan.dt[0], plan.dt[1])
+            codes = [code for code, _ in free]
+            # 有座位坐标时先试离所选座位最近的 K 个空闲座位（按距离），其余随后
+            near = SEAT_MAPS.nearest(plan.seatno, codes, NEAREST_K)
+            distance = dict(near) if near else None
+            if distance:
+                codes = [c for c, _ in near] + [c for c in codes if c not in distance]
+            reqs = [prepare_seat_date(plan.headers, code, plan.seatdate, plan.dt) for code in codes]
+            if busy and engine.ranker is not None:
+                engine.ranker.note_conflicts(busy)
+            code, j2, attempts, err = await try_candidates(engine, plan, reqs, stop_on_error=False, trace=trace,
+                                                           distance=distance)
+            if code:
+                res = {'code':0,'msg':'已使用推荐座位预约成功','seatno':code,'data':j2,'attempts':attempts}
+                if distance and code in distance:
+                    res['distance'] = round(distance[code], 1)
+                return res
+            if err is not None:
+                return dict(err, attempts=attempts)
+            return {'code':-1,'msg':'推荐座位尝试失败','attempts':attempts}
+        except Exception:
+            return j
+    if plan.content == 'prefs':
+        if j.get('code') == 0 or not is_occupied_msg(j.get('msg','')):
+            return j
+        try:
+            if plan.candidates is None:
+                return {'code':-1,'msg':'读取偏好文件失败'}
+            if not plan.candidates:
+                return {'code':-1,'msg':'偏好文件为空'}
+            code, j2, attempts, err = await try_candidates(engine, plan, plan.candidates, trace=trace)
+            if code:
+                return {'code':0,'msg':'已使用偏好座位预约成功','seatno':code,'data':j2,'attempts':attempts}
+            if err is not None:
+                return dict(err, attempts=attempts)
+            return {'code':-1,'msg':'偏好座位均不可用','attempts':attempts}
+        except Exception:
+            return {'code':-1,'msg':'读取偏好文件失败'}
+    return j
+
+async def book(engine, headers, seatno, seatdate, dt, content, strategy='sequential', prefs=None):
+    # prefs 为预约时已校验过的偏好列表；未提供时才读偏好文件
+    return await run_plan(engine, compile_plan(headers, seatno, seatdate, dt, content, strategy, prefs))
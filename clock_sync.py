@@ -0,0 +1,111 @@
+import datetime
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+CLOCK_PROBES = int(os.environ.get('HUNNU_CLOCK_PROBES', '8'))
+CLOCK_REFRESH_SECONDS = float(os.environ.get('HUNNU_CLOCK_REFRESH_SECONDS', '900'))
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+
+class ClockSync:
+    # 用 HTTP Date 头估计服务器时钟偏差（offset = 服务器时间 - 本地时间）。
+    # Date 只有秒级精度：每次探测得到 offset 的一个区间 [D - t1, D + 1 - t0)，
+    # 多次探测取交集，并把下一次探测对准估计的整秒边界，类似 NTP 的做法逐步收窄误差。
+    def __init__(self, fetch_date, probes=CLOCK_PROBES, refresh_seconds=CLOCK_REFRESH_SECONDS):
+        self.fetch_date = fetch_date
+        self.probes = probes
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._estimate = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def sync(self):
+        with self._sync_lock:
+            lo, hi = float('-inf'), float('inf')
+            best = None
+            rtts = []
+            for i in range(self.probes):
+                if i and lo > float('-inf') and hi < float('inf'):
+                    # 让请求到达服务器的时刻落在估计的整秒边界上，区间收窄最快
+                    mid = (lo + hi) / 2
+                    half_rtt = (min(rtts) if rtts else 0) / 2
+                    arrive = time.time() + half_rtt + mid
+                    wait = (int(arrive) + 1 - arrive) % 1.0
+                    if wait > 0.005:
+                        time.sleep(wait)
+                t0 = time.time()
+                try:
+                    d = parse_http_date(self.fetch_date())
+                except Exception:
+                    d = None
+                t1 = time.time()
+                if d is None:
+                    continue
+                rtt = t1 - t0
+                rtts.append(rtt)
+                if best is None or rtt < best[0]:
+                    best = (rtt, d + 0.5 - (t0 + t1) / 2)
+                nlo, nhi = max(lo, d - t1), min(hi, d + 1 - t0)
+                if nlo <= nhi:
+                    lo, hi = nlo, nhi
+            if best is None:
+                return self.estimate()
+            if lo > float('-inf') and hi < float('inf'):
+                offset = (lo + hi) / 2
+                err = (hi - lo) / 2
+            else:
+                offset = best[1]
+                err = 0.5 + best[0] / 2
+            est = {
+                'offset': offset,
+                'error': err,
+                'rtt': min(rtts),
+                'samples': len(rtts),
+                'updated_at': time.time(),
+            }
+            with self._lock:
+                self._estimate = est
+            return dict(est)
+
+    def estimate(self):
+        with self._lock:
+            return dict(self._estimate) if self._estimate else None
+
+    def offset(self):
+        est = self.estimate()
+        return est['offset'] if est else 0.0
+
+    def server_now(self):
+        return datetime.datetime.now() + datetime.timedelta(seconds=self.offset())
+
+    def seconds_until(self, server_target):
+        return (server_target - self.server_now()).total_seconds()
+
+    def ensure_running(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='clock-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception:
+                pass
+            self._stop.wait(self.refresh_seconds)
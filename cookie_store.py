@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+
+from booking import cookie_header_from_list
+
+COOKIES_FILE = os.environ.get('HUNNU_COOKIES_FILE', 'cookies.json')
+# 全局 Cookie 文件最多每隔这么久检查一次 mtime，热路径上不做磁盘操作
+COOKIES_CHECK_SECONDS = float(os.environ.get('HUNNU_COOKIES_CHECK_SECONDS', '2'))
+FIXED_COOKIES = ('cookie_unit_name', 'cookie_come_app')
+
+
+class CookieStore:
+    # 按 clientId 保存 Cookie 列表与预先拼好的 Cookie 头；全局 cookies.json 只在 mtime 变化时重新读取
+    def __init__(self, path=COOKIES_FILE, check_seconds=COOKIES_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._file = ([], '')
+        self._mtime = None
+        self._checked_at = float('-inf')
+        self.reloads = 0
+
+    def __contains__(self, client_id):
+        return client_id in self._clients
+
+    def set(self, client_id, arr):
+        ent = (list(arr or []), cookie_header_from_list(arr))
+        with self._lock:
+            self._clients[client_id] = ent
+
+    def update(self, mapping):
+        for cid, arr in mapping.items():
+            self.set(cid, arr)
+
+    def get(self, client_id=None):
+        # 返回 (Cookie 列表, Cookie 头)；未保存该用户时回退到全局文件
+        ent = self._clients.get(client_id) if client_id else None
+        return ent if ent is not None else self._global()
+
+    def header(self, client_id=None):
+        return self.get(client_id)[1]
+
+    def cookies(self, client_id=None):
+        return self.get(client_id)[0]
+
+    def fixed(self):
+        # 不提供输入框的固定 Cookie，从全局文件中保留
+        return [c for c in self._global()[0] if c.get('name') in FIXED_COOKIES]
+
+    def save_file(self, arr):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(arr, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+        with self._lock:
+            self._file = (list(arr), cookie_header_from_list(arr))
+            self._mtime = self._stat()
+            self._checked_at = time.monotonic()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _global(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_seconds:
+            return self._file
+        with self._lock:
+            if now - self._checked_at < self.check_seconds:
+                return self._file
+            self._checked_at = now
+            mtime = self._stat()
+            if mtime != self._mtime:
+                arr = []
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        arr = json.load(f)
+                except Exception:
+                    pass
+                if not isinstance(arr, list):
+                    arr = []
+                self._file = (arr, cookie_header_from_list(arr))
+                self._mtime = mtime
+                self.reloads += 1
+            return self._file
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'file': self.path, 'file_cookies': len(self._file[0]),
+                    'file_reloads': self.reloads}
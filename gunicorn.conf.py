@@ -0,0 +1,22 @@
+import os
+import sys
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+# 各 worker 共用 HUNNU_JOB_DB，只有持有调度租约的一个 worker 触发定时任务
+bind = os.environ.get('HUNNU_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('HUNNU_WORKERS', '2'))
+# SSE 长连接会占住一个线程，用 gthread 并留足线程数
+worker_class = 'gthread'
+threads = int(os.environ.get('HUNNU_THREADS', '16'))
+timeout = int(os.environ.get('HUNNU_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('HUNNU_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('HUNNU_HTTP_KEEPALIVE', '5'))
+# 每个 worker 自己导入应用并启动后台线程（事件循环、调度器等），不能在 master 里预加载后 fork
+preload_app = False
+
+
+def worker_exit(server, worker):
+    # worker 退出前把任务库写入队列落盘（重启、缩容时不丢最后几条状态）
+    app = sys.modules.get('web_app')
+    if app is not None:
+        app.STORE.flush()
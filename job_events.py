@@ -0,0 +1,77 @@
+import bisect
+import heapq
+import os
+import queue
+import threading
+
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('HUNNU_SSE_HEARTBEAT_SECONDS', '15'))
+SSE_QUEUE_SIZE = int(os.environ.get('HUNNU_SSE_QUEUE_SIZE', '64'))
+
+
+class JobEvents:
+    # 按 clientId 索引的任务列表（按执行时间有序）与任务状态变化的推送订阅
+    def __init__(self, queue_size=SSE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._by_client = {}
+        self._subs = {}
+        self.published = 0
+        self.dropped = 0
+
+    def add(self, client_id, job_id, scheduled_for):
+        with self._lock:
+            ids = self._by_client.setdefault(client_id, [])
+            item = (scheduled_for or '', job_id)
+            i = bisect.bisect_left(ids, item)
+            if i == len(ids) or ids[i] != item:
+                ids.insert(i, item)
+
+    def job_ids(self, client_id=None):
+        # 指定 clientId 时只取该用户的任务；未指定时合并所有用户（与原来的全量列表一致）
+        with self._lock:
+            if client_id:
+                return [job_id for _, job_id in self._by_client.get(client_id, ())]
+            lists = [list(ids) for ids in self._by_client.values()]
+        return [job_id for _, job_id in heapq.merge(*lists)]
+
+    def subscribe(self, client_id=None):
+        q = queue.Queue(self.queue_size)
+        with self._lock:
+            self._subs.setdefault(client_id or None, set()).add(q)
+        return q
+
+    def unsubscribe(self, client_id, q):
+        with self._lock:
+            subs = self._subs.get(client_id or None)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[client_id or None]
+
+    def publish(self, client_id, event, item):
+        # 推送给该用户的订阅者以及未指定 clientId 的订阅者；订阅者消费过慢时丢弃最旧的事件
+        with self._lock:
+            targets = list(self._subs.get(client_id, ())) if client_id else []
+            targets += list(self._subs.get(None, ()))
+            self.published += 1
+        for q in targets:
+            while True:
+                try:
+                    q.put_nowait((event, item))
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._by_client),
+                'jobs': sum(len(v) for v in self._by_client.values()),
+                'subscribers': sum(len(v) for v in self._subs.values()),
+                'published': self.published,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,336 @@
+import json
+import logging
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+
+JOB_DB_PATH = os.environ.get('HUNNU_JOB_DB', 'jobs.db')
+# 旧数据库补充多 worker 共享所需的列
+MIGRATIONS = (
+    'ALTER TABLE events ADD COLUMN worker TEXT',
+    'ALTER TABLE schedules ADD COLUMN worker TEXT',
+    'ALTER TABLE schedules ADD COLUMN rev INTEGER DEFAULT 0',
+)
+JOB_RETENTION_DAYS = float(os.environ.get('HUNNU_JOB_RETENTION_DAYS', '7'))
+FLUSH_INTERVAL = 0.2
+COMPACT_INTERVAL = 3600.0
+# 一批写入失败（如数据库被其他进程长时间锁住）后的重试次数
+WRITE_RETRIES = 5
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    client_id TEXT,
+    status TEXT,
+    job TEXT,
+    result TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, updated_at);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT,
+    event TEXT,
+    at REAL
+);
+CREATE INDEX IF NOT EXISTS events_job ON events(job_id);
+CREATE TABLE IF NOT EXISTS schedules (
+    schedule_id TEXT PRIMARY KEY,
+    client_id TEXT,
+    schedule TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS cookies (
+    client_id TEXT PRIMARY KEY,
+    cookies TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    expires_at REAL
+);
+"""
+
+
+def read_cookies(path=JOB_DB_PATH):
+    # 只读打开数据库读取各用户保存的 Cookie，不建表也不启动写入线程（命令行批量预约用）
+    if not os.path.exists(path):
+        return {}
+    try:
+        db = sqlite3.connect(pathlib.Path(path).absolute().as_uri() + '?mode=ro', uri=True, timeout=10)
+    except sqlite3.Error:
+        return {}
+    try:
+        rows = db.execute('SELECT client_id, cookies FROM cookies').fetchall()
+    except sqlite3.Error:
+        rows = []
+    finally:
+        db.close()
+    out = {}
+    for cid, txt in rows:
+        try:
+            out[cid] = json.loads(txt)
+        except Exception:
+            continue
+    return out
+
+
+class JobStore:
+    # SQLite(WAL) 持久化：调用方只把快照放进队列，由后台线程批量写入，不给预约热路径增加延迟
+    # 同一数据库文件可由多个 worker 进程共用：worker 标记每条写入的来源，changes() 只返回其他进程写入的任务事件
+    def __init__(self, path=JOB_DB_PATH, retention_days=JOB_RETENTION_DAYS, worker=None):
+        self.path = path
+        self.retention_seconds = retention_days * 86400
+        self.worker = worker
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        for sql in MIGRATIONS:
+            try:
+                self._db.execute(sql)
+            except sqlite3.OperationalError:
+                pass
+        self._seen = self._db.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        # 已入队但尚未写入的条数；归零时才置 _idle，flush 不会在新入队的写入落盘前返回
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self.write_errors = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._writer, name='job-store', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        with self._pending_lock:
+            self._pending += 1
+            self._idle.clear()
+        self._queue.put(item)
+
+    def record(self, job, event=None, result=None):
+        self._put(('job', dict(job), event, result, time.time()))
+
+    def save_cookies(self, client_id, cookies):
+        self._put(('cookies', client_id, list(cookies), None, time.time()))
+
+    def save_schedule(self, schedule):
+        self._put(('schedule', dict(schedule), None, None, time.time()))
+
+    def flush(self, timeout=5.0):
+        self._queue.put(None)
+        return self._idle.wait(timeout)
+
+    def load_jobs(self):
+        with self._lock:
+            rows = self._db.execute('SELECT job, result FROM jobs ORDER BY updated_at').fetchall()
+        out = []
+        for job_txt, result_txt in rows:
+            try:
+                job = json.loads(job_txt)
+                result = json.loads(result_txt) if result_txt else None
+            except Exception:
+                continue
+            out.append((job, result))
+        return out
+
+    def load_cookies(self, since=None):
+        with self._lock:
+            rows = self._db.execute('SELECT client_id, cookies FROM cookies WHERE updated_at >= ?',
+                                    (since or 0,)).fetchall()
+        out = {}
+        for cid, txt in rows:
+            try:
+                out[cid] = json.loads(txt)
+            except Exception:
+                continue
+        return out
+
+    def load_schedules(self, since=None, others=False):
+        # since 只取该时刻之后更新的计划；others 只取其他 worker 写入的（含删除标记）
+        sql = 'SELECT schedule FROM schedules WHERE updated_at >= ?'
+        args = [since or 0]
+        if others:
+            sql += ' AND COALESCE(worker, \'\') != ?'
+            args.append(self.worker or '')
+        with self._lock:
+            rows = self._db.execute(sql + ' ORDER BY updated_at', args).fetchall()
+        out = []
+        for (txt,) in rows:
+            try:
+                sched = json.loads(txt)
+            except Exception:
+                continue
+            if since is None and sched.get('deleted'):
+                continue
+            out.append(sched)
+        return out
+
+    def changes(self, limit=500):
+        # 其他 worker 写入的任务事件（按写入顺序），附带任务的最新快照与结果
+        with self._lock:
+            # 同一个读事务内取事件与最大 id，期间其他进程的提交不会被跳过
+            self._db.execute('BEGIN')
+            try:
+                rows = self._db.execute(
+                    'SELECT e.id, e.event, j.job, j.result FROM events e JOIN jobs j ON j.job_id = e.job_id '
+                    'WHERE e.id > ? AND COALESCE(e.worker, \'\') != ? ORDER BY e.id LIMIT ?',
+                    (self._seen, self.worker or '', limit)).fetchall()
+                last = self._db.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            finally:
+                self._db.execute('COMMIT')
+        out = []
+        for _, event, job_txt, result_txt in rows:
+            try:
+                out.append((event, json.loads(job_txt), json.loads(result_txt) if result_txt else None))
+            except Exception:
+                continue
+        self._seen = rows[-1][0] if len(rows) == limit else max(self._seen, last)
+        return out
+
+    def acquire_lease(self, name, owner, ttl):
+        # 租约未过期时只有持有者能续期；返回是否持有
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO leases(name, owner, expires_at) VALUES (?,?,?) '
+                'ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at '
+                'WHERE leases.owner = excluded.owner OR leases.expires_at < ?',
+                (name, owner, now + ttl, now))
+            row = self._db.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()
+        return bool(row) and row[0] == owner
+
+    def claim_job(self, job, lease, owner):
+        # 触发前同步地把任务从 pending 改为 running，并要求 owner 此刻仍持有租约 lease，两者在同一个事务里判断；
+        # 卡住的旧 leader 在租约被接管后醒来，或任务已被别的进程触发，都会返回 False
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                held = self._db.execute('SELECT 1 FROM leases WHERE name = ? AND owner = ? AND expires_at > ?',
+                                        (lease, owner, now)).fetchone()
+                claimed = False
+                if held:
+                    claimed = self._db.execute(
+                        'INSERT INTO jobs(job_id, client_id, status, job, updated_at) VALUES (?,?,?,?,?) '
+                        'ON CONFLICT(job_id) DO UPDATE SET status=excluded.status, job=excluded.job, '
+                        "updated_at=excluded.updated_at WHERE jobs.status = 'pending'",
+                        (job.get('job_id'), job.get('client_id'), 'running',
+                         json.dumps(dict(job, status='running'), ensure_ascii=False, default=str), now)).rowcount == 1
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return claimed
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            self._db.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def compact(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute(
+                "DELETE FROM events WHERE job_id IN (SELECT job_id FROM jobs WHERE status IN ('done','failed','cancelled') AND updated_at < ?)",
+                (cutoff,))
+            n = self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done','failed','cancelled') AND updated_at < ?", (cutoff,)).rowcount
+            self._db.execute("DELETE FROM schedules WHERE schedule LIKE '%\"deleted\": true%' AND updated_at < ?",
+                             (time.time() - 86400,))
+            self._db.execute('COMMIT')
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return n
+
+    def _writer(self):
+        last_compact = 0.0
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL * 10)
+            except queue.Empty:
+                item = None
+            batch = [item] if item is not None else []
+            # 攒一小批再写，一个事务提交
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while batch and time.monotonic() < deadline:
+                try:
+                    nxt = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    break
+                batch.append(nxt)
+            if batch:
+                self._commit(batch)
+                with self._pending_lock:
+                    self._pending -= len(batch)
+                    if self._pending == 0:
+                        self._idle.set()
+            if time.monotonic() - last_compact > COMPACT_INTERVAL:
+                last_compact = time.monotonic()
+                try:
+                    self.compact()
+                except Exception:
+                    pass
+
+    def _commit(self, batch):
+        # 失败时退避后重试整批（保持写入顺序）；仍失败则逐条写入，只丢弃写不进去的那几条并记录日志
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self._write(batch)
+                return
+            except Exception:
+                self.write_errors += 1
+                log.warning('写入任务数据库失败（第 %d 次），%d 条待重试', attempt + 1, len(batch), exc_info=True)
+                time.sleep(min(0.2 * 2 ** attempt, 5.0))
+        for item in batch:
+            try:
+                self._write([item])
+            except Exception:
+                self.dropped += 1
+                key = (item[1].get('job_id') or item[1].get('schedule_id')) if isinstance(item[1], dict) else item[1]
+                log.error('任务数据库写入失败，已丢弃：%s %s', item[0], key, exc_info=True)
+
+    def _write(self, batch):
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for kind, a, b, c, at in batch:
+                    if kind == 'job':
+                        job, event, result = a, b, c
+                        self._db.execute(
+                            'INSERT INTO jobs(job_id, client_id, status, job, result, updated_at) VALUES (?,?,?,?,?,?) '
+                            'ON CONFLICT(job_id) DO UPDATE SET status=excluded.status, job=excluded.job, '
+                            'result=COALESCE(excluded.result, jobs.result), updated_at=excluded.updated_at',
+                            (job.get('job_id'), job.get('client_id'), job.get('status'),
+                             json.dumps(job, ensure_ascii=False, default=str),
+                             json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                             at))
+                        if event:
+                            self._db.execute('INSERT INTO events(job_id, event, at, worker) VALUES (?,?,?,?)',
+                                             (job.get('job_id'), event, at, self.worker))
+                    elif kind == 'cookies':
+                        self._db.execute(
+                            'INSERT INTO cookies(client_id, cookies, updated_at) VALUES (?,?,?) '
+                            'ON CONFLICT(client_id) DO UPDATE SET cookies=excluded.cookies, updated_at=excluded.updated_at',
+                            (a, json.dumps(b, ensure_ascii=False), at))
+                    elif kind == 'schedule':
+                        # 版本号较旧的写入（其他 worker 已修改过）直接丢弃
+                        self._db.execute(
+                            'INSERT INTO schedules(schedule_id, client_id, schedule, updated_at, worker, rev) VALUES (?,?,?,?,?,?) '
+                            'ON CONFLICT(schedule_id) DO UPDATE SET schedule=excluded.schedule, updated_at=excluded.updated_at, '
+                            'worker=excluded.worker, rev=excluded.rev WHERE excluded.rev >= COALESCE(schedules.rev, 0)',
+                            (a.get('schedule_id'), a.get('client_id'), json.dumps(a, ensure_ascii=False, default=str), at,
+                             self.worker, a.get('rev', 0)))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
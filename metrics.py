@@ -0,0 +1,159 @@
+import bisect
+import threading
+import time
+
+# 毫秒分桶，覆盖从本地处理到 10 秒超时的范围
+BUCKETS_MS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # 桶内线性插值估计分位数
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                lo = BUCKETS_MS[i - 1] if i > 0 else 0.0
+                hi = BUCKETS_MS[i] if i < len(BUCKETS_MS) else BUCKETS_MS[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return BUCKETS_MS[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hists = {}
+        self._counters = {}
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = Histogram()
+            h.observe(value)
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def quantile(self, name, q, labels=()):
+        # 返回 (分位数估计, 样本数)
+        with self._lock:
+            h = self._hists.get((name, labels))
+            return (h.quantile(q), h.count) if h is not None else (0.0, 0)
+
+    def summary(self, name):
+        with self._lock:
+            items = [(labels, h) for (n, labels), h in self._hists.items() if n == name]
+            return {
+                ','.join(f'{k}={v}' for k, v in labels) or '_': {
+                    'count': h.count,
+                    'p50': round(h.quantile(0.5), 3),
+                    'p95': round(h.quantile(0.95), 3),
+                    'p99': round(h.quantile(0.99), 3),
+                } for labels, h in items
+            }
+
+    def render(self):
+        # Prometheus 文本格式：直方图 + 分位数估计
+        lines = []
+        with self._lock:
+            hists = sorted(self._hists.items())
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (name, labels), h in hists:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            acc = 0
+            for i, b in enumerate(BUCKETS_MS):
+                acc += h.counts[i]
+                lines.append(f'{name}_bucket{_fmt(labels + (("le", _num(b)),))} {acc}')
+            lines.append(f'{name}_bucket{_fmt(labels + (("le", "+Inf"),))} {h.count}')
+            lines.append(f'{name}_sum{_fmt(labels)} {_num(h.sum)}')
+            lines.append(f'{name}_count{_fmt(labels)} {h.count}')
+        for (name, labels), h in hists:
+            qname = name + '_quantile'
+            if qname not in typed:
+                typed.add(qname)
+                lines.append(f'# TYPE {qname} gauge')
+            for q in QUANTILES:
+                lines.append(f'{qname}{_fmt(labels + (("quantile", _num(q)),))} {_num(h.quantile(q))}')
+        for (name, labels), v in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_fmt(labels)} {_num(v)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _num(v):
+    return repr(round(v, 6)) if isinstance(v, float) else str(v)
+
+
+def _fmt(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+
+METRICS = Registry()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 't0')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, (time.perf_counter() - self.t0) * 1000)
+        return False
+
+
+class Trace:
+    # 一次预约的分阶段耗时记录；每个阶段同时计入全局直方图 hunnu_phase_ms
+    def __init__(self, registry=METRICS):
+        self.registry = registry
+        self.t0 = time.perf_counter()
+        self.spans = []
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def add(self, name, ms):
+        self.spans.append((name, ms))
+        self.registry.observe('hunnu_phase_ms', ms, (('phase', name),))
+
+    def export(self):
+        totals = {}
+        for name, ms in self.spans:
+            totals[name] = round(totals.get(name, 0.0) + ms, 3)
+        return {
+            'total_ms': round((time.perf_counter() - self.t0) * 1000, 3),
+            'spans': [{'name': n, 'ms': round(ms, 3)} for n, ms in self.spans],
+            'by_phase': totals,
+        }
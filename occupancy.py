@@ -0,0 +1,354 @@
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+# 半小时时间格：07:00 起共 31 格，覆盖到 22:30
+SLOT_START = 7 * 60
+SLOT_MINUTES = 30
+SLOT_COUNT = 31
+RANGE_RE = re.compile(r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})')
+
+OCCUPANCY_DB_PATH = os.environ.get('HUNNU_OCCUPANCY_DB', 'occupancy.db')
+OCCUPANCY_RETENTION_DAYS = int(os.environ.get('HUNNU_OCCUPANCY_RETENTION_DAYS', '365'))
+# 采集默认关闭；设置采集周期（秒）后开启
+COLLECT_SECONDS = float(os.environ.get('HUNNU_COLLECT_SECONDS', '0'))
+COLLECT_RATE = float(os.environ.get('HUNNU_COLLECT_RATE', '0.5'))
+COLLECT_ROOMS = [r.strip().upper() for r in os.environ.get('HUNNU_COLLECT_ROOMS', '').split(',') if r.strip()]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS occ_rooms (
+    room TEXT PRIMARY KEY,
+    seats TEXT
+);
+CREATE TABLE IF NOT EXISTS occ_days (
+    room TEXT,
+    day INTEGER,
+    stride INTEGER,
+    bits BLOB,
+    PRIMARY KEY (room, day)
+);
+"""
+
+
+def parse_ranges(show):
+    # ShowDataTime -> [(开始分钟, 结束分钟), ...]；空或“暂无预约”为 []，无法解析时返回 None
+    t = (show or '').strip()
+    if not t or t == '暂无预约':
+        return []
+    out = [(int(a) * 60 + int(b), int(c) * 60 + int(d)) for a, b, c, d in RANGE_RE.findall(t)]
+    return out or None
+
+
+def slot_mask(start, end):
+    # [start, end) 分钟区间覆盖的时间格
+    mask = 0
+    for i in range(SLOT_COUNT):
+        s = SLOT_START + i * SLOT_MINUTES
+        if start < s + SLOT_MINUTES and end > s:
+            mask |= 1 << i
+    return mask
+
+
+def busy_mask(show):
+    ranges = parse_ranges(show)
+    if ranges is None:
+        return None
+    mask = 0
+    for s, e in ranges:
+        mask |= slot_mask(s, e)
+    return mask
+
+
+def free_windows(seats, start, end):
+    # 整间阅览室一次转成按时间格的座位位图（rows[i] 为第 i 格被占用的座位），
+    # 所选时段内的占用 = 对应几行按位或，一次按位与非得到全部空闲座位。
+    # ShowDataTime 无法解析的座位不算冲突，连续空闲记 0 排在最后，交给服务器判断。
+    # 返回 ([(座位号, 包含所选时段的连续空闲格数), ...] 按连续空闲时长从大到小, 冲突座位列表)
+    codes = []
+    rows = [0] * SLOT_COUNT
+    busy = 0
+    unknown = 0
+    for it in seats or []:
+        code = it.get('Code', '') if isinstance(it, dict) else ''
+        if not code:
+            continue
+        bit = 1 << len(codes)
+        codes.append(code)
+        mask = busy_mask(it.get('ShowDataTime', ''))
+        if mask is None:
+            unknown |= bit
+            continue
+        row = 0
+        while mask:
+            if mask & 1:
+                rows[row] |= bit
+            mask >>= 1
+            row += 1
+    req = [i for i in range(SLOT_COUNT) if slot_mask(start, end) >> i & 1]
+    for i in req:
+        busy |= rows[i]
+    free = ((1 << len(codes)) - 1) & ~busy & ~unknown
+    if not free or not req:
+        return [(c, 0) for i, c in enumerate(codes) if (free | unknown) >> i & 1], [c for i, c in enumerate(codes) if busy >> i & 1]
+    # 向两侧逐格扩展，alive 记录每一步仍连续空闲的座位
+    ext = []
+    alive = free
+    for j in range(req[0] - 1, -1, -1):
+        alive &= ~rows[j]
+        if not alive:
+            break
+        ext.append(alive)
+    alive = free
+    for j in range(req[-1] + 1, SLOT_COUNT):
+        alive &= ~rows[j]
+        if not alive:
+            break
+        ext.append(alive)
+    out = []
+    for i, code in enumerate(codes):
+        if free >> i & 1:
+            out.append((code, len(req) + sum(1 for a in ext if a >> i & 1)))
+    out.sort(key=lambda x: -x[1])
+    out.extend((c, 0) for i, c in enumerate(codes) if unknown >> i & 1)
+    return out, [c for i, c in enumerate(codes) if busy >> i & 1]
+
+
+def slot_of(minutes):
+    i = (int(minutes) - SLOT_START) // SLOT_MINUTES
+    return i if 0 <= i < SLOT_COUNT else None
+
+
+def _popcount(buf, off, stride):
+    return int.from_bytes(buf[off:off + stride], 'little').bit_count()
+
+
+class _Room:
+    __slots__ = ('seats', 'index', 'days')
+
+    def __init__(self, seats=()):
+        self.seats = list(seats)
+        self.index = {code: i for i, code in enumerate(self.seats)}
+        self.days = {}
+
+
+class OccupancyStore:
+    # 列式占用记录：每个 (阅览室, 日期) 一块 bytearray，第 0 行是当天观察到的座位位图，
+    # 第 1..31 行是各半小时格被占用的座位位图（多次快照按位或合并）；查询只做按位与和 popcount
+    def __init__(self, path=OCCUPANCY_DB_PATH, retention_days=OCCUPANCY_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._dirty = set()
+        self._dirty_rooms = set()
+        self.observations = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def _db(self):
+        db = sqlite3.connect(self.path)
+        db.executescript(SCHEMA)
+        return db
+
+    def _load(self):
+        db = self._db()
+        try:
+            for room, seats in db.execute('SELECT room, seats FROM occ_rooms'):
+                self._rooms[room] = _Room(json.loads(seats))
+            for room, day, stride, bits in db.execute('SELECT room, day, stride, bits FROM occ_days'):
+                r = self._rooms.get(room)
+                if r is not None:
+                    r.days[day] = (stride, bytearray(bits))
+        finally:
+            db.close()
+
+    def _day(self, r, day):
+        need = (len(r.seats) + 7) // 8
+        ent = r.days.get(day)
+        if ent is not None and ent[0] >= need:
+            return ent
+        # 座位数增加时按新的行宽重排
+        stride = max(need, 1)
+        buf = bytearray(stride * (SLOT_COUNT + 1))
+        if ent is not None:
+            old_stride, old = ent
+            for row in range(SLOT_COUNT + 1):
+                buf[row * stride:row * stride + old_stride] = old[row * old_stride:(row + 1) * old_stride]
+        ent = r.days[day] = (stride, buf)
+        return ent
+
+    def observe(self, room, seatdate, seats):
+        # seats: [{'Code': ..., 'ShowDataTime': ...}, ...]
+        try:
+            day = datetime.date.fromisoformat(seatdate).toordinal()
+        except (TypeError, ValueError):
+            return 0
+        n = 0
+        with self._lock:
+            r = self._rooms.get(room)
+            if r is None:
+                r = self._rooms[room] = _Room()
+            marks = []
+            for it in seats or []:
+                code = (it.get('Code') or '').strip().upper() if isinstance(it, dict) else ''
+                mask = busy_mask(it.get('ShowDataTime', '')) if code else None
+                if mask is None:
+                    continue
+                i = r.index.get(code)
+                if i is None:
+                    i = r.index[code] = len(r.seats)
+                    r.seats.append(code)
+                    self._dirty_rooms.add(room)
+                marks.append((i, mask))
+            if not marks:
+                return 0
+            stride, buf = self._day(r, day)
+            for i, mask in marks:
+                byte, bit = i >> 3, 1 << (i & 7)
+                buf[byte] |= bit
+                row = 1
+                while mask:
+                    if mask & 1:
+                        buf[row * stride + byte] |= bit
+                    mask >>= 1
+                    row += 1
+                n += 1
+            self._dirty.add((room, day))
+            self.observations += 1
+        return n
+
+    def free_fraction(self, room, slot, weekday=None, since=None, until=None):
+        # 该阅览室在 slot 时间格的空闲比例（按天平均）；weekday 为 0-6（周一为 0）
+        free = 0.0
+        samples = 0
+        with self._lock:
+            r = self._rooms.get(room)
+            if r is None:
+                return {'samples': 0, 'free_fraction': None}
+            for day, (stride, buf) in r.days.items():
+                if since is not None and day < since or until is not None and day > until:
+                    continue
+                if weekday is not None and datetime.date.fromordinal(day).weekday() != weekday:
+                    continue
+                seen = _popcount(buf, 0, stride)
+                if not seen:
+                    continue
+                free += 1 - _popcount(buf, (slot + 1) * stride, stride) / seen
+                samples += 1
+        return {'samples': samples, 'free_fraction': round(free / samples, 4) if samples else None}
+
+    def seat_busy_rate(self, room, code, slots, since=None):
+        # 某座位在 slots（时间格位图）内被占用的天数比例，以观察到该座位的天数为分母
+        with self._lock:
+            r = self._rooms.get(room)
+            i = r.index.get(code) if r is not None else None
+            if i is None:
+                return None
+            byte, bit = i >> 3, 1 << (i & 7)
+            rows = [row + 1 for row in range(SLOT_COUNT) if slots >> row & 1]
+            seen = busy = 0
+            for day, (stride, buf) in r.days.items():
+                if since is not None and day < since or byte >= stride or not buf[byte] & bit:
+                    continue
+                seen += 1
+                for row in rows:
+                    if buf[row * stride + byte] & bit:
+                        busy += 1
+                        break
+            return busy / seen if seen else None
+
+    def save(self):
+        with self._lock:
+            rooms = [(room, json.dumps(self._rooms[room].seats)) for room in self._dirty_rooms]
+            days = [(room, day, self._rooms[room].days[day][0], bytes(self._rooms[room].days[day][1]))
+                    for room, day in self._dirty]
+            self._dirty_rooms.clear()
+            self._dirty.clear()
+            cutoff = datetime.date.today().toordinal() - self.retention_days
+            for r in self._rooms.values():
+                for day in [d for d in r.days if d < cutoff]:
+                    del r.days[day]
+        if not (rooms or days) or not self.path:
+            return 0
+        db = self._db()
+        try:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO occ_rooms(room, seats) VALUES (?,?)', rooms)
+                db.executemany('INSERT OR REPLACE INTO occ_days(room, day, stride, bits) VALUES (?,?,?,?)', days)
+                db.execute('DELETE FROM occ_days WHERE day < ?', (cutoff,))
+        finally:
+            db.close()
+        return len(days)
+
+    def stats(self):
+        with self._lock:
+            ndays = sum(len(r.days) for r in self._rooms.values())
+            nbytes = sum(len(buf) for r in self._rooms.values() for _, buf in r.days.values())
+            return {'rooms': len(self._rooms), 'room_days': ndays, 'bytes': nbytes, 'observations': self.observations}
+
+
+class OccupancyCollector:
+    # 低频采集各阅览室当天的占用快照：每轮之间带抖动，轮内按 rate（次/秒）限速，只在 07:00-22:30 之间采集
+    def __init__(self, store, fetch, rooms, interval=COLLECT_SECONDS, rate=COLLECT_RATE, now=datetime.datetime.now):
+        self.store = store
+        self.fetch = fetch
+        self.rooms = rooms
+        self.interval = interval
+        self.rate = rate
+        self.now = now
+        self._thread = None
+        self._lock = threading.Lock()
+        self.rounds = 0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def ensure_running(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='occupancy-collector', daemon=True)
+                self._thread.start()
+
+    def collect_once(self):
+        now = self.now()
+        minutes = now.hour * 60 + now.minute
+        if not SLOT_START <= minutes < SLOT_START + SLOT_COUNT * SLOT_MINUTES:
+            return 0
+        seatdate = now.date().isoformat()
+        n = 0
+        for room in self.rooms():
+            try:
+                seats = self.fetch(room, seatdate)
+                self.requests += 1
+            except Exception:
+                self.errors += 1
+                seats = None
+            if seats:
+                n += self.store.observe(room, seatdate, seats)
+            if self.rate > 0:
+                time.sleep(1.0 / self.rate)
+        self.store.save()
+        self.rounds += 1
+        return n
+
+    def _loop(self):
+        while True:
+            try:
+                self.collect_once()
+            except Exception:
+                self.errors += 1
+            time.sleep(self.interval * random.uniform(0.9, 1.1))
+
+    def stats(self):
+        return {'enabled': self.enabled, 'interval_seconds': self.interval, 'rate_per_second': self.rate,
+                'rounds': self.rounds, 'requests': self.requests, 'errors': self.errors}
@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from metrics import METRICS
+
+# 本进程发往上游的总速率（次/秒）与突发量；<= 0 表示不限
+OUTBOUND_RATE = float(os.environ.get('HUNNU_OUTBOUND_RATE', '50'))
+OUTBOUND_BURST = float(os.environ.get('HUNNU_OUTBOUND_BURST', '100'))
+# 每个 clientId 的速率与突发量；<= 0 表示不限
+CLIENT_RATE = float(os.environ.get('HUNNU_CLIENT_RATE', '5'))
+CLIENT_BURST = float(os.environ.get('HUNNU_CLIENT_BURST', '20'))
+# 总令牌桶中只留给预约请求的令牌数，界面读取与后台任务不能用掉
+OUTBOUND_RESERVE = float(os.environ.get('HUNNU_OUTBOUND_RESERVE', '10'))
+# 非预约请求排队等待的上限（秒），超过后放弃；预约请求等待不超过剩余的预约时间预算
+OUTBOUND_MAX_WAIT = float(os.environ.get('HUNNU_OUTBOUND_MAX_WAIT', '10'))
+
+# 优先级从高到低：预约请求、后台任务（预热、保活探测、占用采集、对时）、界面读取（阅览室、座位图、用户信息等）
+BOOKING = 'booking'
+BACKGROUND = 'background'
+UI = 'ui'
+PRIORITIES = (BOOKING, BACKGROUND, UI)
+_BACKGROUND_RANK = PRIORITIES.index(BACKGROUND)
+
+_outbound = contextvars.ContextVar('hunnu_outbound', default=(None, UI))
+
+
+class RateLimited(Exception):
+    pass
+
+
+def current():
+    # 预约引擎中当前协程的 (clientId, 优先级)
+    return _outbound.get()
+
+
+async def run_as(client_id, priority, coro):
+    # 在事件循环中以指定用户与优先级执行 coro，其中的上游请求按此排队
+    _outbound.set((client_id, priority))
+    return await coro
+
+
+class _Waiter:
+    __slots__ = ('client', 'rank', 'wake', 't0', 'granted', 'cancelled')
+
+    def __init__(self, client, rank, wake):
+        self.client = client
+        self.rank = rank
+        self.wake = wake
+        self.t0 = time.perf_counter()
+        self.granted = False
+        self.cancelled = False
+
+
+class OutboundLimiter:
+    # 上游请求的令牌桶调度：总桶限制本进程的总速率，每个 clientId 一个桶保证用户之间公平，后台任务只受总桶限制。
+    # 令牌不够时按优先级排队（同级先到先得），由调度线程在令牌补充后依次放行；等不到自己用户桶令牌的请求不挡住别人。
+    # acquire 用于线程（Flask 接口），acquire_async 用于预约引擎的事件循环
+    def __init__(self, rate=OUTBOUND_RATE, burst=OUTBOUND_BURST, client_rate=CLIENT_RATE, client_burst=CLIENT_BURST,
+                 reserve=OUTBOUND_RESERVE, max_wait=OUTBOUND_MAX_WAIT, max_clients=4096):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.client_rate = client_rate
+        self.client_burst = max(client_burst, 1.0)
+        self.reserve = min(max(reserve, 0.0), self.burst - 1)
+        self.max_wait = max_wait
+        self.max_clients = max_clients
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._clients = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._thread = None
+        self.granted = dict.fromkeys(PRIORITIES, 0)
+        self.queued = dict.fromkeys(PRIORITIES, 0)
+        self.rejected = dict.fromkeys(PRIORITIES, 0)
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or self.client_rate > 0
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _bucket(self, client, now):
+        b = self._clients.get(client)
+        if b is None:
+            if len(self._clients) >= self.max_clients:
+                # 丢掉已经回满的桶，它们与新建的桶没有区别
+                full = self.client_burst - 1e-9
+                self._clients = {k: v for k, v in self._clients.items()
+                                 if v[0] + (now - v[1]) * self.client_rate < full}
+            b = self._clients[client] = [self.client_burst, now]
+        else:
+            b[0] = min(self.client_burst, b[0] + (now - b[1]) * self.client_rate)
+            b[1] = now
+        return b
+
+    def _per_client(self, client, rank):
+        # 后台任务由服务端发起且自带限速，只受总桶限制
+        return client is not None and self.client_rate > 0 and rank != _BACKGROUND_RANK
+
+    def _client_blocked(self, w, now):
+        return self._per_client(w.client, w.rank) and self._bucket(w.client, now)[0] < 1
+
+    def _deficit(self, client, rank, now):
+        # 距离可以放行还要等的秒数；0 表示现在就可以
+        wait = 0.0
+        if self.rate > 0:
+            need = 1 + (self.reserve if rank else 0)
+            if self._tokens < need:
+                wait = (need - self._tokens) / self.rate
+        if self._per_client(client, rank):
+            b = self._bucket(client, now)
+            if b[0] < 1:
+                wait = max(wait, (1 - b[0]) / self.client_rate)
+        return wait
+
+    def _take(self, client, rank, now):
+        if self._deficit(client, rank, now) > 0:
+            return False
+        if self.rate > 0:
+            self._tokens -= 1
+        if self._per_client(client, rank):
+            self._clients[client][0] -= 1
+        return True
+
+    def _pump(self):
+        # 在锁内调用：按优先级放行能放行的等待者，返回下次需要检查的时间（秒）
+        now = time.monotonic()
+        self._refill(now)
+        wait = None
+        keep = []
+        for entry in sorted(self._waiters):
+            w = entry[2]
+            if w.cancelled:
+                continue
+            if self._take(w.client, w.rank, now):
+                self._grant(w)
+                continue
+            keep.append(entry)
+            d = self._deficit(w.client, w.rank, now)
+            wait = d if wait is None else min(wait, d)
+        heapq.heapify(keep)
+        self._waiters = keep
+        return wait
+
+    def _grant(self, w):
+        w.granted = True
+        name = PRIORITIES[w.rank]
+        self.granted[name] += 1
+        METRICS.observe('hunnu_outbound_wait_ms', (time.perf_counter() - w.t0) * 1000, (('priority', name),))
+        w.wake()
+
+    def _loop(self):
+        with self._cond:
+            while True:
+                wait = self._pump()
+                self._cond.wait(None if wait is None else max(wait, 0.001))
+
+    def _enqueue(self, client, priority, wake):
+        # 在锁内调用：能直接放行时返回 None，否则排队并返回等待者
+        rank = PRIORITIES.index(priority)
+        now = time.monotonic()
+        self._refill(now)
+        # 同级或更高优先级的请求在等总桶令牌时不插队；只在等自己用户桶的请求不算
+        ahead = any(e[0] <= rank and not e[2].cancelled and not self._client_blocked(e[2], now) for e in self._waiters)
+        if not ahead and self._take(client, rank, now):
+            self.granted[priority] += 1
+            METRICS.observe('hunnu_outbound_wait_ms', 0.0, (('priority', priority),))
+            return None
+        w = _Waiter(client, rank, wake)
+        heapq.heappush(self._waiters, (rank, next(self._seq), w))
+        self.queued[priority] += 1
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='outbound-limiter', daemon=True)
+            self._thread.start()
+        self._cond.notify()
+        return w
+
+    def _give_up(self, w, priority):
+        # 等待超时：已被放行则照常发送，否则撤出队列
+        with self._cond:
+            if w.granted:
+                return True
+            w.cancelled = True
+            self.rejected[priority] += 1
+        METRICS.inc('hunnu_outbound_rejected_total', labels=(('priority', priority),))
+        return False
+
+    def acquire(self, client_id=None, priority=UI, timeout=None):
+        if not self.enabled:
+            return
+        event = threading.Event()
+        with self._cond:
+            w = self._enqueue(client_id, priority, event.set)
+        if w is None:
+            return
+        event.wait(self.max_wait if timeout is None else timeout)
+        if not self._give_up(w, priority):
+            raise RateLimited('上游请求排队超时')
+
+    async def acquire_async(self, client_id=None, priority=UI, timeout=None):
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+
+        with self._cond:
+            w = self._enqueue(client_id, priority, wake)
+        if w is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.max_wait if timeout is None else max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            self._give_up(w, priority)
+            raise
+        if not self._give_up(w, priority):
+            raise RateLimited('上游请求排队超时')
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            waiting = dict.fromkeys(PRIORITIES, 0)
+            for rank, _, w in self._waiters:
+                if not w.cancelled:
+                    waiting[PRIORITIES[rank]] += 1
+            return {
+                'enabled': self.enabled,
+                'rate': self.rate,
+                'client_rate': self.client_rate,
+                'tokens': round(self._tokens, 1) if self.rate > 0 else None,
+                'clients': len(self._clients),
+                'waiting': waiting,
+                'queued': dict(self.queued),
+                'granted': dict(self.granted),
+                'rejected': dict(self.rejected),
+            }
+
+
+OUTBOUND = OutboundLimiter()
@@ -0,0 +1,44 @@
+import datetime
+import random
+
+# 周一为 0；重复计划按“预约当天”的星期几匹配，当天 07:00（或 7 点过几秒）触发
+DAY_PRESETS = {
+    'daily': (0, 1, 2, 3, 4, 5, 6),
+    'weekdays': (0, 1, 2, 3, 4),
+    'weekends': (5, 6),
+}
+RECURRING_MODES = ('next7', 'next7_normal')
+
+
+def parse_days(value):
+    # 返回排好序的星期列表；无法识别时返回 None
+    if isinstance(value, str):
+        return DAY_PRESETS.get(value.strip().lower())
+    if not isinstance(value, (list, tuple)):
+        return None
+    days = set()
+    for d in value:
+        try:
+            d = int(d)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= d <= 6:
+            return None
+        days.add(d)
+    return tuple(sorted(days)) or None
+
+
+def next_fire(days, mode, now, after=None):
+    # 严格晚于 now 的下一次触发时间（服务器时钟）；after 为上一次触发的时刻，同一天不再触发
+    # （next7_normal 每次随机抽取时刻，提前结束后按 now 重新抽取可能仍落在当天稍后）
+    for i in range(8):
+        day = now.date() + datetime.timedelta(days=i)
+        if day.weekday() not in days or (after is not None and day <= after.date()):
+            continue
+        if mode == 'next7_normal':
+            target = datetime.datetime.combine(day, datetime.time(7, 0, 5)) + datetime.timedelta(seconds=random.gauss(0, 1))
+        else:
+            target = datetime.datetime.combine(day, datetime.time(7, 0, 0))
+        if target > now:
+            return target
+    return None
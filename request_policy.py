@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+
+from metrics import METRICS
+
+# 每次预约（含回退）的总时间预算，秒
+BOOKING_BUDGET_SECONDS = float(os.environ.get('HUNNU_BOOKING_BUDGET_SECONDS', '20'))
+# 各上游接口的请求策略，按接口文件名配置，'*' 为默认值：
+#   单次超时 = p99 × timeout_factor，限制在 [min_timeout, max_timeout] 秒内，且不超过剩余预算；
+#   样本少于 min_samples 或接口非幂等时用 max_timeout
+#   hedge：超过 p95（不低于 hedge_min_ms 毫秒）仍未返回时再发一份相同请求，先到的结果为准
+#   idempotent 为 False（预约接口）时，先到的若是失败而另一份仍在途则等另一份：自己的两份请求会互相被判“已被预约”，
+#   只有成功才能提前结束。预约接口默认不对冲：原请求在客户端超时而服务器已经订上时，对冲那份会拿到“已被预约”，
+#   无法与真正被别人抢走区分
+DEFAULT_POLICIES = {
+    '*': {'min_timeout': 2.0, 'max_timeout': 10.0, 'timeout_factor': 4.0, 'min_samples': 20,
+          'hedge': False, 'hedge_min_ms': 100.0, 'idempotent': True},
+    'SeatDateHandler.ashx': {'min_timeout': 1.0, 'max_timeout': 5.0, 'hedge': False, 'idempotent': False},
+    'SeatInfoHandler.ashx': {'min_timeout': 1.0, 'max_timeout': 8.0, 'hedge': True},
+}
+
+_deadline = contextvars.ContextVar('hunnu_deadline', default=None)
+
+
+class BudgetExceeded(asyncio.TimeoutError):
+    pass
+
+
+def start_budget(seconds=BOOKING_BUDGET_SECONDS):
+    # 在当前协程（及其创建的子任务）内设置截止时间；已有更早的截止时间时保留
+    deadline = time.monotonic() + seconds
+    cur = _deadline.get()
+    return _deadline.set(deadline if cur is None else min(cur, deadline))
+
+
+def suspend_budget():
+    # 预算之外必须完成的请求（如释放多抢到的座位）
+    return _deadline.set(None)
+
+
+def end_budget(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    # 剩余预算秒数；不在预算内时返回 None
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def exhausted():
+    rem = remaining()
+    return rem is not None and rem <= 0
+
+
+def load_overrides():
+    # HUNNU_REQUEST_POLICY 为 JSON，如 {"SeatDateHandler.ashx": {"hedge": false}}
+    raw = os.environ.get('HUNNU_REQUEST_POLICY', '')
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class RequestPolicy:
+    def __init__(self, policies=None, registry=METRICS):
+        self.registry = registry
+        self.policies = {}
+        for src in (DEFAULT_POLICIES, policies if policies is not None else load_overrides()):
+            for name, pol in src.items():
+                if isinstance(pol, dict):
+                    self.policies.setdefault(name, {}).update(pol)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exceeded = 0
+
+    def get(self, endpoint):
+        pol = dict(self.policies['*'])
+        pol.update(self.policies.get(endpoint, {}))
+        return pol
+
+    def _quantile(self, endpoint, q):
+        return self.registry.quantile('hunnu_upstream_ms', q, (('endpoint', endpoint),))
+
+    def timeout(self, endpoint, pol=None):
+        # 非幂等接口超时后结果未知（上游可能已处理），不按分位数提前放弃，只靠对冲降低长尾
+        pol = pol or self.get(endpoint)
+        if not pol['idempotent']:
+            return pol['max_timeout']
+        p99, n = self._quantile(endpoint, 0.99)
+        if n < pol['min_samples']:
+            return pol['max_timeout']
+        return min(pol['max_timeout'], max(pol['min_timeout'], p99 / 1000 * pol['timeout_factor']))
+
+    def hedge_delay(self, endpoint, pol=None):
+        # 样本不足时不对冲
+        pol = pol or self.get(endpoint)
+        if not pol['hedge']:
+            return None
+        p95, n = self._quantile(endpoint, 0.95)
+        if n < pol['min_samples']:
+            return None
+        return max(p95, pol['hedge_min_ms']) / 1000
+
+    def stats(self):
+        out = {'hedges': self.hedges, 'hedge_wins': self.hedge_wins, 'budget_exceeded': self.budget_exceeded,
+               'endpoints': {}}
+        for name in self.policies:
+            if name == '*':
+                continue
+            pol = self.get(name)
+            delay = self.hedge_delay(name, pol)
+            out['endpoints'][name] = {'timeout_s': round(self.timeout(name, pol), 3),
+                                      'hedge_after_ms': round(delay * 1000, 1) if delay is not None else None,
+                                      'idempotent': pol['idempotent']}
+        return out
+
+
+POLICY = RequestPolicy()
@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEDULER_WORKERS = int(os.environ.get('HUNNU_SCHEDULER_WORKERS', '8'))
+# 预热、重新展开等后台条目用单独的线程池，慢的预热占不住预约触发的线程
+BACKGROUND_WORKERS = int(os.environ.get('HUNNU_SCHEDULER_BACKGROUND_WORKERS', '4'))
+SPIN_SECONDS = float(os.environ.get('HUNNU_SCHEDULER_SPIN_SECONDS', '0.3'))
+REANCHOR_SECONDS = 60.0
+
+
+class _Entry:
+    __slots__ = ('key', 'delay_fn', 'fn', 'deadline', 'background', 'reanchored', 'cancelled')
+
+    def __init__(self, key, delay_fn, fn, deadline, background=False):
+        self.key = key
+        self.delay_fn = delay_fn
+        self.fn = fn
+        self.deadline = deadline
+        self.background = background
+        self.reanchored = False
+        self.cancelled = False
+
+
+class Scheduler:
+    # 单线程 + 最小堆的定时器：按 monotonic 时间等待，不受系统时间调整影响。
+    # 距触发不足 REANCHOR_SECONDS 时用 delay_fn 重新对准一次（吸收长时间等待中的时钟漂移与校时结果），
+    # 先粗粒度 wait，最后 SPIN_SECONDS 内短睡眠 + 自旋，触发后交给固定大小的线程池执行；
+    # 触发延迟在任务真正开始执行时计算，包含线程池排队的时间。
+    def __init__(self, workers=SCHEDULER_WORKERS, spin_seconds=SPIN_SECONDS, reanchor_seconds=REANCHOR_SECONDS,
+                 background_workers=BACKGROUND_WORKERS):
+        self.spin_seconds = spin_seconds
+        self.reanchor_seconds = reanchor_seconds
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._background = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix='job-bg')
+        self._thread = None
+
+    def add(self, key, delay_fn, fn, background=False):
+        # delay_fn() 返回距目标时刻的秒数；fn(latency_ms) 在触发时执行；background 的条目在后台线程池执行
+        deadline = time.monotonic() + max(0.0, delay_fn())
+        ent = _Entry(key, delay_fn, fn, deadline, background)
+        with self._cond:
+            old = self._entries.get(key)
+            if old is not None:
+                old.cancelled = True
+            self._entries[key] = ent
+            heapq.heappush(self._heap, (deadline, next(self._seq), ent))
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+                self._thread.start()
+        return ent
+
+    def cancel(self, key):
+        with self._cond:
+            ent = self._entries.pop(key, None)
+            if ent is None:
+                return False
+            ent.cancelled = True
+            self._cond.notify()
+            return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._entries)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, ent = self._heap[0]
+                if ent.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                remain = deadline - time.monotonic()
+                if not ent.reanchored and remain <= self.reanchor_seconds:
+                    ent.reanchored = True
+                    try:
+                        deadline = time.monotonic() + max(0.0, ent.delay_fn())
+                    except Exception:
+                        pass
+                    if deadline != ent.deadline:
+                        ent.deadline = deadline
+                        heapq.heapreplace(self._heap, (deadline, next(self._seq), ent))
+                    continue
+                if remain > self.spin_seconds:
+                    self._cond.wait(remain - self.spin_seconds)
+                    continue
+                heapq.heappop(self._heap)
+                if self._entries.get(ent.key) is ent:
+                    del self._entries[ent.key]
+            while True:
+                r = deadline - time.monotonic()
+                if r <= 0:
+                    break
+                if r > 0.002:
+                    time.sleep(r / 2)
+            try:
+                (self._background if ent.background else self._pool).submit(self._run, ent, deadline)
+            except Exception:
+                pass
+
+    @staticmethod
+    def _run(ent, deadline):
+        ent.fn((time.monotonic() - deadline) * 1000)
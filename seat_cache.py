@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_TTL_SECONDS = float(os.environ.get('HUNNU_CACHE_TTL_SECONDS', '3600'))
+CACHE_STALE_SECONDS = float(os.environ.get('HUNNU_CACHE_STALE_SECONDS', str(7 * 86400)))
+CACHE_MAX_ENTRIES = int(os.environ.get('HUNNU_CACHE_MAX_ENTRIES', '512'))
+CACHE_SNAPSHOT_PATH = os.environ.get('HUNNU_CACHE_SNAPSHOT', 'seat_cache.json')
+
+
+def read_snapshot(path=CACHE_SNAPSHOT_PATH):
+    # 只读取快照中的 (键, 值)，不启动刷新与落盘线程（命令行批量预约用）
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [(key, value) for key, _, value in json.load(f).get('entries', [])]
+    except Exception:
+        return []
+
+
+class SeatCache:
+    # 阅览室列表与座位图缓存：TTL 内直接命中；过期但未超过 stale 窗口时先返回旧值并在后台刷新；
+    # 超过容量按 LRU 淘汰；内容落盘为快照，冷启动时直接可用
+    def __init__(self, ttl=CACHE_TTL_SECONDS, stale=CACHE_STALE_SECONDS, max_entries=CACHE_MAX_ENTRIES,
+                 snapshot_path=CACHE_SNAPSHOT_PATH, on_put=None):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self.snapshot_path = snapshot_path
+        self.on_put = on_put
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._refreshing = set()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+        self._dirty = threading.Event()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self._load_snapshot()
+        if self.on_put is not None:
+            for key, value in self.items():
+                self.on_put(key, value)
+        if self.snapshot_path:
+            threading.Thread(target=self._snapshot_loop, name='cache-snapshot', daemon=True).start()
+
+    def get(self, key, loader):
+        # loader() 返回 None 表示上游失败，不缓存
+        now = time.time()
+        with self._lock:
+            ent = self._data.get(key)
+            if ent is not None:
+                age = now - ent[0]
+                if age < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return ent[1]
+                if age < self.stale:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._pool.submit(self._refresh, key, loader)
+                    return ent[1]
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def items(self, prefix=None):
+        with self._lock:
+            return [(k, v[1]) for k, v in self._data.items() if prefix is None or k.startswith(prefix)]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        self._dirty.set()
+        if self.on_put is not None:
+            try:
+                self.on_put(key, value)
+            except Exception:
+                pass
+
+    def _refresh(self, key, loader):
+        try:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+                self.refreshes += 1
+            else:
+                self.refresh_errors += 1
+        except Exception:
+            self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _load_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snap = json.load(f)
+        except Exception:
+            return
+        for key, ts, value in snap.get('entries', [])[-self.max_entries:]:
+            self._data[key] = (ts, value)
+
+    def save_snapshot(self):
+        with self._lock:
+            entries = [[k, ts, v] for k, (ts, v) in self._data.items()]
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': time.time(), 'entries': entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.snapshot_path)
+
+    def _snapshot_loop(self):
+        # 合并频繁的写入，最多每 5 秒落盘一次
+        while True:
+            self._dirty.wait()
+            time.sleep(5)
+            self._dirty.clear()
+            try:
+                self.save_snapshot()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'stale_seconds': self.stale,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.stale_hits) / total, 4) if total else 0.0,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'evictions': self.evictions,
+        }
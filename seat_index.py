@@ -0,0 +1,140 @@
+import re
+import threading
+
+# 校区前缀 -> 区域代码，顺序即匹配优先级
+AREA_PREFIXES = [('NY01', 'HUNNU_NY'), ('THP', 'HUNNU_THP'), ('X', 'HUNNU_XYH'), ('Z', 'HUNNU_ELB')]
+# 带分区的特殊房间代码，房间号后不是三位数字
+SUB_AREA_ROOMS = ['Z41N', 'Z41Z', 'Z41B', 'X602Z', 'X602D', 'NY01']
+SEAT_RE = re.compile(r'^(NY01|THP|X|Z)[0-9A-Z]*\d{3}$')
+ROOM_KEYS = ('AddressCode', 'RoomCode', 'Code', 'MapId', 'mapid', 'Id')
+AREA_KEYS = ('AreaCode', 'areacode')
+
+
+def normalize_seatno(seatno):
+    return re.sub(r'\s+', '', seatno or '').upper()
+
+
+def area_of(code):
+    for prefix, area in AREA_PREFIXES:
+        if code.startswith(prefix):
+            return prefix, area
+    return '', ''
+
+
+def _first(d, keys):
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return str(v)
+    return ''
+
+
+class SeatIndex:
+    # 座位号 -> (阅览室, 区域) 的内存索引，阅览室代码用前缀树做最长前缀匹配（如 Z41N、X602Z 分区）
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trie = {}
+        self._rooms = {}
+        self._seats = {}
+        self._seat_sets = {}
+        self._memo = {}
+        for room in SUB_AREA_ROOMS:
+            self._add_room(room, '')
+
+    def _add_room(self, room, area):
+        room = normalize_seatno(room)
+        if not room:
+            return
+        node = self._trie
+        for ch in room:
+            node = node.setdefault(ch, {})
+        node[''] = room
+        self._rooms[room] = area or area_of(room)[1]
+
+    def add_rooms(self, rooms):
+        with self._lock:
+            for it in rooms or []:
+                if isinstance(it, dict):
+                    self._add_room(_first(it, ROOM_KEYS), _first(it, AREA_KEYS))
+            self._memo.clear()
+
+    def add_seats(self, room, points):
+        room = normalize_seatno(room)
+        with self._lock:
+            if room not in self._rooms:
+                self._add_room(room, '')
+            seats = set()
+            for it in points or []:
+                no = normalize_seatno(str(it.get('SeatNo', ''))) if isinstance(it, dict) else ''
+                if not no:
+                    continue
+                code = no if no.startswith(room) else room + no
+                seats.add(code)
+                self._seats[code] = room
+            self._seat_sets[room] = seats
+            self._memo.clear()
+
+    def on_cache_put(self, key, value):
+        if key == 'rooms':
+            self.add_rooms(value)
+        elif key.startswith('seats:'):
+            self.add_seats(key[len('seats:'):], value)
+
+    def _match_room(self, code):
+        node = self._trie
+        best = ''
+        for ch in code:
+            node = node.get(ch)
+            if node is None:
+                break
+            if '' in node:
+                best = node['']
+        return best
+
+    def lookup(self, seatno):
+        code = normalize_seatno(seatno)
+        hit = self._memo.get(code)
+        if hit is not None:
+            return hit
+        with self._lock:
+            room = self._seats.get(code) or self._match_room(code)
+            if not room:
+                # 索引里没有的房间按原规则推断：校区前缀 + 三位房间号
+                prefix, _ = area_of(code)
+                m = re.match(re.escape(prefix) + r'(\d{3})', code) if prefix else None
+                room = prefix + m.group(1) if m else prefix
+            area = self._rooms.get(room) or area_of(code)[1] or 'HUNNU_ELB'
+            seat_set = self._seat_sets.get(room)
+            info = {
+                'seatno': code,
+                'room': room,
+                'area': area,
+                'room_known': seat_set is not None,
+                'exists': (code in seat_set) if seat_set is not None else None,
+            }
+            if len(self._memo) < 10000:
+                self._memo[code] = info
+            return info
+
+    def validate(self, seatno, strict=False):
+        # 返回 (规范化后的座位号, 错误信息)；座位图未缓存时只做格式检查，strict 时视为阅览室不存在
+        code = normalize_seatno(seatno)
+        if not SEAT_RE.match(code):
+            return code, '座位号格式错误'
+        info = self.lookup(code)
+        if info['exists'] is False:
+            return code, '座位不存在'
+        if strict and info['exists'] is None:
+            return code, f"阅览室 {info['room']} 不存在或无法获取座位图"
+        return code, ''
+
+    def rooms(self):
+        with self._lock:
+            return sorted(self._rooms)
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'seats': len(self._seats), 'memo': len(self._memo)}
+
+
+SEAT_INDEX = SeatIndex()
@@ -0,0 +1,188 @@
+import math
+import threading
+
+from seat_index import normalize_seatno
+
+X_KEYS = ('X', 'PointX', 'x', 'Left', 'left', 'PosX')
+Y_KEYS = ('Y', 'PointY', 'y', 'Top', 'top', 'PosY')
+
+
+def _coord(d, keys):
+    for k in keys:
+        v = d.get(k)
+        if v not in (None, ''):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class RoomMap:
+    # 一间阅览室的座位坐标网格索引：每格约容纳几个座位，近邻查询按环逐层向外扩展，找够 k 个且下一环不可能更近时停止
+    def __init__(self, points):
+        self.points = dict(points)
+        xs = [p[0] for p in self.points.values()]
+        ys = [p[1] for p in self.points.values()]
+        self.x0 = min(xs)
+        self.y0 = min(ys)
+        area = max((max(xs) - self.x0) * (max(ys) - self.y0), 1.0)
+        self.cell = max(math.sqrt(area / len(self.points)) * 2, 1e-6)
+        self._grid = {}
+        for code, (x, y) in self.points.items():
+            self._grid.setdefault(self._cell_of(x, y), []).append(code)
+        self._span = max(max(i for i, _ in self._grid), max(j for _, j in self._grid)) + 1
+        # 座位间距：各座位到最近座位距离的中位数，用于判断“相邻”
+        gaps = sorted(d for d in (self._nearest_gap(c) for c in self.points) if d > 0)
+        self.pitch = gaps[len(gaps) // 2] if gaps else self.cell / 2
+
+    def _cell_of(self, x, y):
+        return int((x - self.x0) // self.cell), int((y - self.y0) // self.cell)
+
+    def _nearest_gap(self, code):
+        near = self.nearest(code, 1, exclude=(code,))
+        return near[0][1] if near else 0.0
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for i in range(cx - r, cx + r + 1):
+            yield i, cy - r
+            yield i, cy + r
+        for j in range(cy - r + 1, cy + r):
+            yield cx - r, j
+            yield cx + r, j
+
+    def distance(self, a, b):
+        (x1, y1), (x2, y2) = self.points[a], self.points[b]
+        return math.hypot(x1 - x2, y1 - y2)
+
+    def nearest(self, code, k, allowed=None, exclude=()):
+        # 返回距 code 最近的 k 个座位 [(座位号, 距离)]；allowed 为候选集合（如当前空闲的座位）
+        if code not in self.points or k <= 0:
+            return []
+        x, y = self.points[code]
+        cx, cy = self._cell_of(x, y)
+        out = []
+        for r in range(self._span + 1):
+            for cell in self._ring(cx, cy, r):
+                for c in self._grid.get(cell, ()):
+                    if c in exclude or (allowed is not None and c not in allowed):
+                        continue
+                    px, py = self.points[c]
+                    out.append((c, math.hypot(px - x, py - y)))
+            # 第 r+1 环里的座位距离至少为 r 个格宽
+            if len(out) >= k:
+                out.sort(key=lambda t: t[1])
+                if out[k - 1][1] <= r * self.cell:
+                    break
+        out.sort(key=lambda t: t[1])
+        return out[:k]
+
+    def adjacent(self, free, n, near=None, limit=5):
+        # 在空闲座位中找 n 个相邻的座位：以每个空闲座位为起点取最近的 n-1 个空闲座位，
+        # 组内按 1.5 倍座位间距连边须连成一片；按离 near 的距离（指定时）与组内跨度排序，组间不重叠
+        free = {c for c in free if c in self.points}
+        if n <= 0 or len(free) < n:
+            return []
+        if near in self.points:
+            anchors = [c for c, _ in self.nearest(near, 64, allowed=free)]
+        else:
+            anchors = sorted(free)
+        step = self.pitch * 1.5 + 1e-9
+        groups = []
+        seen = set()
+        for a in anchors:
+            members = [a] + [c for c, _ in self.nearest(a, n - 1, allowed=free, exclude=(a,))]
+            if len(members) < n:
+                continue
+            key = frozenset(members)
+            if key in seen:
+                continue
+            seen.add(key)
+            if not self._connected(members, step):
+                continue
+            spread = max((self.distance(p, q) for i, p in enumerate(members) for q in members[i + 1:]), default=0.0)
+            dist = min(self.distance(near, c) for c in members) if near in self.points else 0.0
+            groups.append((dist, spread, sorted(members)))
+        groups.sort(key=lambda g: (g[0], g[1]))
+        out = []
+        used = set()
+        for dist, spread, members in groups:
+            if used.intersection(members):
+                continue
+            used.update(members)
+            out.append({'seats': members, 'spread': round(spread, 1), 'distance': round(dist, 1)})
+            if len(out) >= limit:
+                break
+        return out
+
+    def _connected(self, members, step):
+        reached = {members[0]}
+        todo = [members[0]]
+        while todo:
+            a = todo.pop()
+            for b in members:
+                if b not in reached and self.distance(a, b) <= step:
+                    reached.add(b)
+                    todo.append(b)
+        return len(reached) == len(members)
+
+
+class SeatMaps:
+    # 各阅览室的坐标索引，随座位图缓存更新一次性建立；座位图中没有坐标的阅览室不建立索引
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._seat_room = {}
+        self.builds = 0
+
+    def add_seats(self, room, points):
+        room = normalize_seatno(room)
+        coords = {}
+        for it in points or []:
+            if not isinstance(it, dict):
+                continue
+            no = normalize_seatno(str(it.get('SeatNo', '')))
+            x, y = _coord(it, X_KEYS), _coord(it, Y_KEYS)
+            if not no or x is None or y is None:
+                continue
+            coords[no if no.startswith(room) else room + no] = (x, y)
+        m = RoomMap(coords) if len(coords) >= 2 else None
+        with self._lock:
+            old = self._rooms.pop(room, None)
+            if old is not None:
+                for code in old.points:
+                    self._seat_room.pop(code, None)
+            if m is not None:
+                self._rooms[room] = m
+                for code in m.points:
+                    self._seat_room[code] = room
+                self.builds += 1
+
+    def on_cache_put(self, key, value):
+        if key.startswith('seats:'):
+            self.add_seats(key[len('seats:'):], value)
+
+    def room(self, room):
+        return self._rooms.get(normalize_seatno(room))
+
+    def of_seat(self, seatno):
+        room = self._seat_room.get(normalize_seatno(seatno))
+        return self._rooms.get(room) if room else None
+
+    def nearest(self, seatno, candidates, k):
+        # candidates 中离 seatno 最近的 k 个 [(座位号, 距离)]；没有坐标时返回 None
+        m = self.of_seat(seatno)
+        if m is None:
+            return None
+        code = normalize_seatno(seatno)
+        return m.nearest(code, k, allowed=set(candidates), exclude=(code,))
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'seats': len(self._seat_room), 'builds': self.builds}
+
+
+SEAT_MAPS = SeatMaps()
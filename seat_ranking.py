@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+from booking import is_occupied_msg
+
+RANK_HALF_LIFE_DAYS = float(os.environ.get('HUNNU_RANK_HALF_LIFE_DAYS', '14'))
+RANK_PRIOR_WEIGHT = float(os.environ.get('HUNNU_RANK_PRIOR_WEIGHT', '2'))
+# 候选排序默认关闭；开启后座位自身的（衰减后）观测次数不少于该值才参与重排
+RANK_ENABLED = int(os.environ.get('HUNNU_RANK_SEATS', '0')) > 0
+RANK_MIN_OBSERVATIONS = float(os.environ.get('HUNNU_RANK_MIN_OBSERVATIONS', '3'))
+# 推荐列表里显示时间冲突的座位，记作半次“被抢”
+CONFLICT_WEIGHT = 0.5
+
+
+class SeatRanker:
+    # 估计候选座位在触发时仍空闲的概率：每个座位一个 Beta 分布，成功计入 a、被抢计入 b，
+    # 按半衰期衰减旧结果；历史占用率（prior(code, dt) 返回空闲概率）作为先验，权重 prior_weight
+    def __init__(self, prior=None, half_life_days=RANK_HALF_LIFE_DAYS, prior_weight=RANK_PRIOR_WEIGHT,
+                 min_observations=RANK_MIN_OBSERVATIONS):
+        self.prior = prior
+        self.half_life = half_life_days * 86400
+        self.prior_weight = prior_weight
+        self.min_observations = min_observations
+        self._lock = threading.Lock()
+        self._seats = {}
+        self.learned = 0
+        self.reordered = 0
+
+    def _decayed(self, code, now):
+        ent = self._seats.get(code)
+        if ent is None:
+            return 0.0, 0.0, []
+        wins, losses, at, lost_ms = ent
+        f = 0.5 ** (max(0.0, now - at) / self.half_life) if self.half_life > 0 else 1.0
+        return wins * f, losses * f, lost_ms
+
+    def _add(self, code, win=0.0, loss=0.0, ms=None, now=None):
+        now = now or time.time()
+        with self._lock:
+            wins, losses, lost_ms = self._decayed(code, now)
+            if ms is not None:
+                lost_ms = (lost_ms + [ms])[-8:]
+            self._seats[code] = (wins + win, losses + loss, now, lost_ms)
+
+    def _posterior(self, code, dt):
+        wins, losses, lost_ms = self._decayed(code, time.time())
+        p0 = None
+        if self.prior is not None:
+            try:
+                p0 = self.prior(code, dt)
+            except Exception:
+                p0 = None
+        if p0 is None:
+            p0 = 0.5
+        a = 1 + wins + self.prior_weight * p0
+        b = 1 + losses + self.prior_weight * (1 - p0)
+        # 以前在很短时间内就被抢走的座位竞争激烈，额外降权
+        fast = sum(1 for ms in lost_ms if ms < 500) / len(lost_ms) if lost_ms else 0.0
+        return a, b, 1 - 0.2 * fast
+
+    def score(self, code, dt=None):
+        a, b, penalty = self._posterior(code, dt)
+        return a / (a + b) * penalty
+
+    def observations(self, code):
+        wins, losses, _ = self._decayed(code, time.time())
+        return wins + losses
+
+    def rank(self, codes, dt=None):
+        # 按后验均值稳定排序：观测不足的座位记为中性的 0.5，得分相同时保持输入顺序
+        # （偏好文件顺序、连续空闲时长顺序、距离顺序），没有历史时顺序不变
+        scores = {}
+        for c in codes:
+            scores[c] = self.score(c, dt) if self.observations(c) >= self.min_observations else 0.5
+        order = sorted(codes, key=lambda c: -scores[c])
+        if order != list(codes):
+            self.reordered += 1
+        return order, scores
+
+    def note_conflicts(self, codes):
+        for code in codes:
+            self._add(code, loss=CONFLICT_WEIGHT)
+
+    def learn(self, seatno, result, at=None):
+        # seatno 为首选座位；result 为预约结果（含候选尝试明细 attempts）
+        if not isinstance(result, dict):
+            return
+        fell_back = bool(result.get('seatno'))
+        if seatno:
+            if result.get('code') == 0 and not fell_back:
+                self._add(seatno, win=1.0, now=at)
+            elif fell_back or is_occupied_msg(result.get('msg')):
+                self._add(seatno, loss=1.0, now=at)
+        for a in result.get('attempts') or []:
+            code = a.get('seatno')
+            if not code:
+                continue
+            if a.get('code') == 0:
+                self._add(code, win=1.0, now=at)
+            elif is_occupied_msg(a.get('msg')):
+                self._add(code, loss=1.0, ms=a.get('ms'), now=at)
+        self.learned += 1
+
+    def stats(self):
+        with self._lock:
+            return {'seats': len(self._seats), 'learned': self.learned, 'reordered': self.reordered}
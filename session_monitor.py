@@ -0,0 +1,159 @@
+import datetime
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+KEEPALIVE_SECONDS = float(os.environ.get('HUNNU_KEEPALIVE_SECONDS', '300'))
+KEEPALIVE_JITTER = float(os.environ.get('HUNNU_KEEPALIVE_JITTER', '0.2'))
+KEEPALIVE_RATE = float(os.environ.get('HUNNU_KEEPALIVE_RATE', '2'))
+KEEPALIVE_RETRY_SECONDS = float(os.environ.get('HUNNU_KEEPALIVE_RETRY_SECONDS', '60'))
+# 连续这么多次非“会话过期”的失败（网络异常等）才判定为有风险
+KEEPALIVE_MAX_FAILURES = int(os.environ.get('HUNNU_KEEPALIVE_MAX_FAILURES', '2'))
+REFRESH_CLIENTS_SECONDS = 30.0
+
+
+class SessionMonitor:
+    # 为有待执行任务的用户定期探测登录态并保持会话活跃：每个用户的探测时间随机错开并带抖动，
+    # 全局按 rate（次/秒）限速；会话过期时立即回调 on_change(client_id, status)，让对应任务标记为有风险
+    def __init__(self, probe, clients, on_change=None, interval=KEEPALIVE_SECONDS, jitter=KEEPALIVE_JITTER,
+                 rate=KEEPALIVE_RATE, retry_seconds=KEEPALIVE_RETRY_SECONDS, max_failures=KEEPALIVE_MAX_FAILURES):
+        self.probe = probe
+        self.clients = clients
+        self.on_change = on_change
+        self.interval = interval
+        self.jitter = jitter
+        self.rate = rate
+        self.retry_seconds = retry_seconds
+        self.max_failures = max_failures
+        self._cond = threading.Condition()
+        self._heap = []
+        self._due = {}
+        self._status = {}
+        self._seq = itertools.count()
+        self._thread = None
+        self._refresh_at = 0.0
+        self.probes = 0
+
+    def ensure_running(self):
+        if self.interval <= 0:
+            return
+        with self._cond:
+            self._refresh_at = 0.0
+            self._cond.notify()
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name='session-monitor', daemon=True)
+            self._thread.start()
+
+    def touch(self, client_id):
+        # Cookie 更新后尽快重新探测
+        with self._cond:
+            self._schedule(client_id, time.monotonic() + random.uniform(0, 2))
+            self._cond.notify()
+
+    def status(self, client_id):
+        with self._cond:
+            st = self._status.get(client_id)
+            return dict(st) if st else None
+
+    def _schedule(self, client_id, due):
+        self._due[client_id] = due
+        heapq.heappush(self._heap, (due, next(self._seq), client_id))
+
+    def _next_delay(self, ok):
+        if not ok:
+            return self.retry_seconds
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _sync_clients(self, now):
+        wanted = set(self.clients())
+        with self._cond:
+            for cid in wanted:
+                if cid not in self._due:
+                    # 首次探测在一个周期内均匀错开，避免所有用户同时探测
+                    self._schedule(cid, now + random.uniform(0, min(self.interval, 60.0)))
+            for cid in list(self._due):
+                if cid not in wanted:
+                    del self._due[cid]
+                    self._status.pop(cid, None)
+            self._refresh_at = now + REFRESH_CLIENTS_SECONDS
+
+    def _loop(self):
+        last = float('-inf')
+        while True:
+            now = time.monotonic()
+            if now >= self._refresh_at:
+                try:
+                    self._sync_clients(now)
+                except Exception:
+                    pass
+            cid = self._take(now, last)
+            if cid is None:
+                continue
+            last = time.monotonic()
+            self._check(cid)
+
+    def _take(self, now, last):
+        # 取出下一个到期的用户；都未到期时等待，直到到期、被唤醒或需要刷新用户列表
+        with self._cond:
+            wait = self._refresh_at - now
+            while self._heap:
+                due, _, cid = self._heap[0]
+                if self._due.get(cid) != due:
+                    heapq.heappop(self._heap)
+                    continue
+                # 全局限速：两次探测之间至少间隔 1/rate 秒
+                start = max(due, last + 1.0 / self.rate) if self.rate > 0 else due
+                if start <= now:
+                    heapq.heappop(self._heap)
+                    del self._due[cid]
+                    return cid
+                wait = min(wait, start - now)
+                break
+            self._cond.wait(max(0.0, wait) + 0.001)
+            return None
+
+    def _check(self, client_id):
+        try:
+            res = self.probe(client_id)
+        except Exception as e:
+            res = {'ok': False, 'reason': 'error', 'error': str(e)}
+        self.probes += 1
+        ok = bool(res.get('ok'))
+        with self._cond:
+            prev = self._status.get(client_id) or {'at_risk': False, 'failures': 0}
+            failures = 0 if ok else prev['failures'] + 1
+            expired = res.get('reason') == 'session_expired'
+            at_risk = not ok and (expired or failures >= self.max_failures)
+            st = {
+                'ok': ok,
+                'at_risk': at_risk,
+                'reason': res.get('via') if ok else (res.get('reason') or res.get('error') or 'unknown'),
+                'failures': failures,
+                'checked_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'probe_ms': res.get('probe_ms'),
+            }
+            if at_risk:
+                st['stale_since'] = prev.get('stale_since') or st['checked_at']
+            self._status[client_id] = st
+            if client_id not in self._due:
+                self._schedule(client_id, time.monotonic() + self._next_delay(ok))
+            changed = at_risk != prev['at_risk']
+        if changed and self.on_change is not None:
+            try:
+                self.on_change(client_id, dict(st))
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                'clients': len(self._due),
+                'at_risk': sum(1 for st in self._status.values() if st.get('at_risk')),
+                'probes': self.probes,
+                'interval_seconds': self.interval,
+                'rate_per_second': self.rate,
+            }
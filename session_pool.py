@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_MAX_CLIENTS = int(os.environ.get('HUNNU_POOL_MAX_CLIENTS', '256'))
+POOL_MAXSIZE = int(os.environ.get('HUNNU_POOL_MAXSIZE', '4'))
+POOL_IDLE_SECONDS = float(os.environ.get('HUNNU_POOL_IDLE_SECONDS', '600'))
+
+
+def new_session(pool_maxsize=POOL_MAXSIZE):
+    s = requests.Session()
+    s.verify = False
+    s.trust_env = False
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+
+def _conn_counts(session):
+    # urllib3 的连接池自带计数：num_connections 为新建连接数，num_requests 为请求数
+    connects = 0
+    reqs = 0
+    for adapter in {id(a): a for a in session.adapters.values()}.values():
+        pools = getattr(adapter.poolmanager, 'pools', None)
+        if pools is None:
+            continue
+        for key in list(pools.keys()):
+            p = pools.get(key)
+            if p is None:
+                continue
+            connects += getattr(p, 'num_connections', 0)
+            reqs += getattr(p, 'num_requests', 0)
+    return connects, reqs
+
+
+class SessionPool:
+    def __init__(self, max_clients=POOL_MAX_CLIENTS, pool_maxsize=POOL_MAXSIZE, idle_seconds=POOL_IDLE_SECONDS):
+        self.max_clients = max_clients
+        self.pool_maxsize = pool_maxsize
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self._closed_connects = 0
+        self._closed_requests = 0
+        self.sessions_created = 0
+        self.sessions_reused = 0
+        self.sessions_evicted = 0
+
+    def get(self, client_id=None):
+        key = client_id or ''
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > min(60.0, self.idle_seconds):
+                self._sweep(now)
+            ent = self._sessions.get(key)
+            if ent is not None:
+                ent[1] = now
+                self._sessions.move_to_end(key)
+                self.sessions_reused += 1
+                return ent[0]
+            s = new_session(self.pool_maxsize)
+            self._sessions[key] = [s, now]
+            self.sessions_created += 1
+            while len(self._sessions) > self.max_clients:
+                _, old = self._sessions.popitem(last=False)
+                self._close(old[0])
+            return s
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for key in [k for k, (_, ts) in self._sessions.items() if now - ts > self.idle_seconds]:
+            s, _ = self._sessions.pop(key)
+            self._close(s)
+
+    def _close(self, s):
+        c, r = _conn_counts(s)
+        self._closed_connects += c
+        self._closed_requests += r
+        self.sessions_evicted += 1
+        try:
+            s.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            connects = self._closed_connects
+            reqs = self._closed_requests
+            for s, _ in self._sessions.values():
+                c, r = _conn_counts(s)
+                connects += c
+                reqs += r
+            return {
+                'clients': len(self._sessions),
+                'max_clients': self.max_clients,
+                'pool_maxsize': self.pool_maxsize,
+                'idle_seconds': self.idle_seconds,
+                'sessions_created': self.sessions_created,
+                'sessions_reused': self.sessions_reused,
+                'sessions_evicted': self.sessions_evicted,
+                'requests': reqs,
+                'new_connections': connects,
+                'reused_connections': max(0, reqs - connects),
+            }
@@ -0,0 +1,89 @@
+import atexit
+import os
+import socket
+import threading
+import time
+
+WORKER_ID = os.environ.get('HUNNU_WORKER_ID') or f'{socket.gethostname()}:{os.getpid()}'
+LEASE_SECONDS = float(os.environ.get('HUNNU_LEASE_SECONDS', '15'))
+SYNC_SECONDS = float(os.environ.get('HUNNU_SYNC_SECONDS', '1'))
+
+
+class SharedState:
+    # 多个 worker 进程共用同一个 JobStore（SQLite 文件）：任务、Cookie 与重复计划都经由它共享。
+    # 只有持有调度租约的进程（leader）给任务排定时器、做保活探测与占用采集，每个任务只触发一次；
+    # 其他进程只接收请求并写入存储，每 sync_seconds 秒读取其他进程的写入更新本地视图（on_sync）。
+    # leader 退出或卡住超过 lease_seconds 后由其他进程接管（on_leader），失去租约时 on_follower 撤下定时器。
+    def __init__(self, store, on_leader=None, on_follower=None, on_sync=None, owner=WORKER_ID,
+                 lease_seconds=LEASE_SECONDS, sync_seconds=SYNC_SECONDS, name='scheduler'):
+        self.store = store
+        self.on_leader = on_leader
+        self.on_follower = on_follower
+        self.on_sync = on_sync
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.sync_seconds = sync_seconds
+        self.name = name
+        self.leader = False
+        self.since = None
+        self.changes = 0
+        self.syncs = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def acquire(self):
+        # 抢一次租约并返回是否成为 leader；状态变化时调用回调
+        try:
+            held = self.store.acquire_lease(self.name, self.owner, self.lease_seconds)
+        except Exception:
+            held = False
+        with self._lock:
+            changed = held != self.leader
+            self.leader = held
+        if changed:
+            self.changes += 1
+            cb = self.on_leader if held else self.on_follower
+            if cb is not None:
+                try:
+                    cb()
+                except Exception:
+                    pass
+        return held
+
+    def start(self):
+        self.since = time.time()
+        self.acquire()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='shared-state', daemon=True)
+            self._thread.start()
+            atexit.register(self.release)
+        return self.leader
+
+    def release(self):
+        if self.leader:
+            try:
+                self.store.release_lease(self.name, self.owner)
+            except Exception:
+                pass
+            self.leader = False
+
+    def _loop(self):
+        renew_at = time.monotonic() + self.lease_seconds / 3
+        while True:
+            time.sleep(self.sync_seconds)
+            if time.monotonic() >= renew_at:
+                renew_at = time.monotonic() + self.lease_seconds / 3
+                self.acquire()
+            if self.on_sync is None:
+                continue
+            # 与上次同步有重叠窗口，写入线程延迟提交的数据不会漏掉；回调需可重复应用
+            since = self.since - 10
+            self.since = time.time()
+            try:
+                self.on_sync(since)
+            except Exception:
+                pass
+            self.syncs += 1
+
+    def stats(self):
+        return {'worker': self.owner, 'leader': self.leader, 'leader_changes': self.changes, 'syncs': self.syncs}
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+from metrics import METRICS
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    # 相同的上游请求（key 相同）同时只发一次：第一个调用者执行，其余调用者等待并共享解析后的结果（或异常）。
+    # key 的第一项为请求类别，用于分类计数；与用户无关的数据不要把 clientId/Cookie 放进 key。
+    # do 用于线程（Flask 接口），do_async 用于预约引擎的事件循环
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = {}
+        self._counts = {}
+
+    def _count(self, kind, field):
+        with self._lock:
+            c = self._counts.setdefault(kind, {'executed': 0, 'collapsed': 0, 'errors': 0})
+            c[field] += 1
+        if field == 'collapsed':
+            METRICS.inc('hunnu_singleflight_collapsed_total', labels=(('kind', kind),))
+
+    def do(self, key, fn, accept=None):
+        # 共享到的结果不满足 accept 时（如发起者登录态失效）自己再执行一次 fn
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self._count(key[0], 'collapsed')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            if accept is None or accept(call.value):
+                return call.value
+            return fn()
+        self._count(key[0], 'executed')
+        try:
+            call.value = fn()
+            return call.value
+        except Exception as e:
+            call.error = e
+            self._count(key[0], 'errors')
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def do_async(self, key, fn, accept=None):
+        # fn 为返回协程的函数；共享到的结果不满足 accept 时（如发起者登录态失效）自己再请求一次
+        fut = self._futures.get(key)
+        if fut is not None:
+            self._count(key[0], 'collapsed')
+            value = await asyncio.shield(fut)
+            if accept is None or accept(value):
+                return value
+            return await fn()
+        fut = self._futures[key] = asyncio.get_running_loop().create_future()
+        self._count(key[0], 'executed')
+        try:
+            value = await fn()
+        except BaseException as e:
+            self._count(key[0], 'errors')
+            if isinstance(e, asyncio.CancelledError):
+                fut.cancel()
+            else:
+                fut.set_exception(e)
+                # 没有等待者时也标记为已读取，避免事件循环告警
+                fut.exception()
+            raise
+        else:
+            fut.set_result(value)
+            return value
+        finally:
+            if self._futures.get(key) is fut:
+                del self._futures[key]
+
+    def stats(self):
+        with self._lock:
+            by_kind = {k: dict(v) for k, v in self._counts.items()}
+            inflight = len(self._calls) + len(self._futures)
+        return {
+            'executed': sum(v['executed'] for v in by_kind.values()),
+            'collapsed': sum(v['collapsed'] for v in by_kind.values()),
+            'inflight': inflight,
+            'by_kind': by_kind,
+        }
+
+
+SINGLE_FLIGHT = SingleFlight()
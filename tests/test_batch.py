@@ -0,0 +1,18 @@
+import datetime
+
+import pytest
+
+from batch import parse_target
+
+NOW = datetime.datetime(2026, 10, 18, 7, 0, 30)
+
+
+def test_time_of_day_started_late_fires_now():
+    assert parse_target('07:00', NOW) == datetime.datetime(2026, 10, 18, 7, 0)
+    assert parse_target('06:00', NOW) == datetime.datetime(2026, 10, 19, 6, 0)
+
+
+def test_absolute_datetime_in_the_past_is_rejected():
+    assert parse_target('2026-10-18 07:00', NOW) == datetime.datetime(2026, 10, 18, 7, 0)
+    with pytest.raises(ValueError):
+        parse_target('2020-01-01 07:00', NOW)
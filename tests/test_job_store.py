@@ -0,0 +1,36 @@
+from job_store import JobStore
+
+
+def test_claim_requires_lease_and_pending_status(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), worker='a')
+    job = {'job_id': 'j1', 'client_id': 'c', 'status': 'pending'}
+    store.record(job, 'created')
+    assert store.flush()
+    # 没有租约（或租约已被别人拿走）时不能认领
+    assert not store.claim_job(job, 'scheduler', 'a')
+    assert store.acquire_lease('scheduler', 'a', 15)
+    assert store.claim_job(job, 'scheduler', 'a')
+    # 已是 running，第二次认领失败
+    assert not store.claim_job(job, 'scheduler', 'a')
+    assert [j['status'] for j, _ in store.load_jobs()] == ['running']
+
+
+def test_stalled_leader_cannot_claim_after_takeover(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    old, new = JobStore(path, worker='old'), JobStore(path, worker='new')
+    job = {'job_id': 'j1', 'client_id': 'c', 'status': 'pending'}
+    old.record(job, 'created')
+    assert old.flush()
+    assert old.acquire_lease('scheduler', 'old', -1)
+    assert new.acquire_lease('scheduler', 'new', 15)
+    assert not old.claim_job(job, 'scheduler', 'old')
+    assert new.claim_job(job, 'scheduler', 'new')
+
+
+def test_flush_waits_for_every_queued_write(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    for round_ in range(20):
+        for i in range(10):
+            store.record({'job_id': f'{round_}-{i}', 'status': 'pending'})
+        assert store.flush()
+        assert len(store.load_jobs()) == (round_ + 1) * 10
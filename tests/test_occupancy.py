@@ -0,0 +1,87 @@
+import random
+
+from occupancy import SLOT_COUNT, SLOT_MINUTES, SLOT_START, busy_mask, free_windows
+
+
+def _fmt(m):
+    return f'{m // 60:02d}:{m % 60:02d}'
+
+
+def _brute(seats, start, end):
+    # 逐格判断的参考实现
+    def overlaps(a, b, s, e):
+        return a < e and b > s
+
+    slots = [(SLOT_START + i * SLOT_MINUTES, SLOT_START + (i + 1) * SLOT_MINUTES) for i in range(SLOT_COUNT)]
+    req = [i for i, (s, e) in enumerate(slots) if overlaps(start, end, s, e)]
+    if not req:
+        # 所选时段不在开放时间内：没有冲突，按原顺序全部记 0
+        return [(seat['Code'], 0) for seat in seats], []
+    free, busy, unknown = [], [], []
+    for seat in seats:
+        code, ranges = seat['Code'], seat['ranges']
+        if ranges is None:
+            unknown.append((code, 0))
+            continue
+        taken = [any(overlaps(a, b, s, e) for a, b in ranges) for s, e in slots]
+        if any(taken[i] for i in req):
+            busy.append(code)
+            continue
+        n = len(req)
+        j = req[0] - 1
+        while j >= 0 and not taken[j]:
+            n += 1
+            j -= 1
+        j = req[-1] + 1
+        while j < SLOT_COUNT and not taken[j]:
+            n += 1
+            j += 1
+        free.append((code, n))
+    free.sort(key=lambda x: -x[1])
+    return free + unknown, busy
+
+
+def _random_seat(rng, i):
+    code = f'Z201{i:03d}'
+    r = rng.random()
+    if r < 0.1:
+        return {'Code': code, 'ShowDataTime': rng.choice(['', '暂无预约']), 'ranges': []}
+    if r < 0.2:
+        return {'Code': code, 'ShowDataTime': '时间待定', 'ranges': None}
+    ranges = []
+    for _ in range(rng.randint(1, 3)):
+        a = rng.randrange(6 * 60, 23 * 60, 5)
+        b = min(a + rng.randrange(5, 6 * 60, 5), 23 * 60 + 30)
+        ranges.append((a, b))
+    return {'Code': code, 'ShowDataTime': ' '.join(f'{_fmt(a)}-{_fmt(b)}' for a, b in ranges), 'ranges': ranges}
+
+
+def test_free_windows_matches_brute_force():
+    rng = random.Random(1)
+    for _ in range(300):
+        seats = [_random_seat(rng, i) for i in range(rng.randint(0, 40))]
+        start = rng.randrange(6 * 60, 23 * 60, 5)
+        end = start + rng.randrange(5, 5 * 60, 5)
+        assert free_windows(seats, start, end) == _brute(seats, start, end)
+
+
+def test_free_windows_examples():
+    seats = [
+        {'Code': 'Z201001', 'ShowDataTime': '08:00-10:00'},
+        {'Code': 'Z201002', 'ShowDataTime': '暂无预约'},
+        {'Code': 'Z201003', 'ShowDataTime': '不明'},
+        {'Code': 'Z201004', 'ShowDataTime': '10:00-12:00 14:00-15:00'},
+        {'ShowDataTime': ''},
+    ]
+    free, busy = free_windows(seats, 10 * 60, 11 * 60)
+    # 08:00-10:00 之后连续空闲到闭馆；无法解析的座位不算冲突，排在最后
+    assert free == [('Z201002', SLOT_COUNT), ('Z201001', 25), ('Z201003', 0)]
+    assert busy == ['Z201004']
+
+
+def test_busy_mask():
+    assert busy_mask('') == 0
+    assert busy_mask('暂无预约') == 0
+    assert busy_mask('明天') is None
+    # 07:00-08:00 占前两格，08:15-08:20 落在第三格
+    assert busy_mask('07:00-08:00,08:15-08:20') == 0b111
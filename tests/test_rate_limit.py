@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from rate_limit import BACKGROUND, BOOKING, UI, OutboundLimiter, RateLimited
+
+
+def test_queued_requests_granted_by_priority():
+    lim = OutboundLimiter(rate=50, burst=1, client_rate=0, reserve=0, max_wait=5)
+    lim.acquire(None, UI)
+    order = []
+    done = threading.Event()
+
+    def wake(name):
+        order.append(name)
+        if len(order) == 5:
+            done.set()
+
+    # 总桶已空；在同一把锁内排队，调度线程开始放行前所有请求都已入队
+    with lim._cond:
+        for name, priority in (('ui1', UI), ('bg1', BACKGROUND), ('ui2', UI), ('book1', BOOKING), ('book2', BOOKING)):
+            assert lim._enqueue(None, priority, lambda n=name: wake(n)) is not None
+    assert done.wait(5)
+    # 同级先到先得
+    assert order == ['book1', 'book2', 'bg1', 'ui1', 'ui2']
+    stats = lim.stats()
+    assert stats['granted'] == {BOOKING: 2, BACKGROUND: 1, UI: 3}
+    assert stats['queued'] == {BOOKING: 2, BACKGROUND: 1, UI: 2}
+
+
+def test_reserve_is_kept_for_bookings():
+    lim = OutboundLimiter(rate=0.001, burst=3, client_rate=0, reserve=2, max_wait=5)
+    lim.acquire(None, UI)
+    with pytest.raises(RateLimited):
+        lim.acquire(None, UI, timeout=0.05)
+    lim.acquire(None, BOOKING, timeout=0.05)
+    lim.acquire(None, BOOKING, timeout=0.05)
+    with pytest.raises(RateLimited):
+        lim.acquire(None, BOOKING, timeout=0.05)
+    assert lim.stats()['rejected'] == {BOOKING: 1, BACKGROUND: 0, UI: 1}
+
+
+def test_exhausted_client_does_not_block_others():
+    lim = OutboundLimiter(rate=1000, burst=100, client_rate=2, client_burst=1, reserve=0, max_wait=5)
+    lim.acquire('a', UI)
+    a_done = threading.Event()
+    t = threading.Thread(target=lambda: (lim.acquire('a', UI, timeout=3), a_done.set()))
+    t.start()
+    deadline = time.monotonic() + 5
+    while lim.stats()['waiting'][UI] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    # a 在等自己的用户桶，同级的 b 不用排在它后面
+    t0 = time.monotonic()
+    lim.acquire('b', UI, timeout=0.2)
+    assert time.monotonic() - t0 < 0.1
+    # 后台任务只受总桶限制
+    lim.acquire('a', BACKGROUND, timeout=0.2)
+    assert not a_done.is_set()
+    t.join(5)
+    assert a_done.is_set()
+
+
+def test_client_bucket_timeout():
+    lim = OutboundLimiter(rate=1000, burst=100, client_rate=0.5, client_burst=1, reserve=0, max_wait=5)
+    lim.acquire('a', UI)
+    with pytest.raises(RateLimited):
+        lim.acquire('a', UI, timeout=0.05)
+    stats = lim.stats()
+    assert stats['rejected'][UI] == 1
+    assert stats['waiting'][UI] == 0
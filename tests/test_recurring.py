@@ -0,0 +1,31 @@
+import datetime
+import random
+
+from recurring import next_fire
+
+
+def test_rearm_after_early_finish_skips_same_day():
+    # next7_normal 的任务在 07:00:03 完成，重新展开时不能再抽到当天稍晚的时刻
+    random.seed(0)
+    days = (0, 1, 2, 3, 4, 5, 6)
+    for _ in range(200):
+        fired = datetime.datetime(2025, 1, 6, 7, 0, 4)
+        now = datetime.datetime(2025, 1, 6, 7, 0, 4, 500000)
+        target = next_fire(days, 'next7_normal', now, after=fired)
+        assert target.date() == datetime.date(2025, 1, 7)
+
+
+def test_rearm_lands_on_next_eligible_day():
+    # 周一触发后，工作日计划的下一次是周二；周五触发后是下周一
+    mon = datetime.datetime(2025, 1, 6, 7, 0, 0)
+    weekdays = (0, 1, 2, 3, 4)
+    assert next_fire(weekdays, 'next7', mon + datetime.timedelta(seconds=1), after=mon) == \
+        datetime.datetime(2025, 1, 7, 7, 0, 0)
+    fri = datetime.datetime(2025, 1, 10, 7, 0, 0)
+    assert next_fire(weekdays, 'next7', fri + datetime.timedelta(seconds=1), after=fri) == \
+        datetime.datetime(2025, 1, 13, 7, 0, 0)
+
+
+def test_first_arm_without_last_fire():
+    now = datetime.datetime(2025, 1, 6, 6, 0, 0)
+    assert next_fire((0,), 'next7', now) == datetime.datetime(2025, 1, 6, 7, 0, 0)
@@ -0,0 +1,48 @@
+from seat_index import SeatIndex
+
+
+def test_longest_prefix_match_for_sub_area_rooms():
+    idx = SeatIndex()
+    idx.add_rooms([{'AddressCode': 'X602', 'AreaCode': 'HUNNU_XYH'}])
+    assert idx.lookup('X602Z012')['room'] == 'X602Z'
+    assert idx.lookup('X602012')['room'] == 'X602'
+    info = idx.lookup(' z41n001 ')
+    assert info['seatno'] == 'Z41N001'
+    assert info['room'] == 'Z41N'
+    assert info['area'] == 'HUNNU_ELB'
+
+
+def test_unknown_room_inferred_from_prefix():
+    # 索引里没有的房间按校区前缀 + 三位房间号推断
+    idx = SeatIndex()
+    info = idx.lookup('Z201005')
+    assert info['room'] == 'Z201'
+    assert info['area'] == 'HUNNU_ELB'
+    assert info['room_known'] is False
+    assert info['exists'] is None
+    assert idx.lookup('THP301010')['room'] == 'THP301'
+    assert idx.lookup('THP301010')['area'] == 'HUNNU_THP'
+
+
+def test_add_seats_marks_existence():
+    idx = SeatIndex()
+    assert idx.lookup('Z201005')['exists'] is None
+    # SeatNo 可以是完整座位号，也可以只是房间内编号
+    idx.on_cache_put('seats:Z201', [{'SeatNo': '005'}, {'SeatNo': 'Z201006'}, {'SeatNo': ''}, 'junk'])
+    assert idx.lookup('Z201005')['exists'] is True
+    assert idx.lookup('Z201006')['exists'] is True
+    info = idx.lookup('Z201007')
+    assert info['room_known'] is True
+    assert info['exists'] is False
+
+
+def test_validate():
+    idx = SeatIndex()
+    idx.add_seats('Z201', [{'SeatNo': '005'}])
+    assert idx.validate('z201 005') == ('Z201005', '')
+    assert idx.validate('A201005')[1] == '座位号格式错误'
+    assert idx.validate('Z12')[1] == '座位号格式错误'
+    assert idx.validate('Z201009')[1] == '座位不存在'
+    # 座位图未缓存：默认只检查格式，strict 时视为阅览室不存在
+    assert idx.validate('Z301001') == ('Z301001', '')
+    assert idx.validate('Z301001', strict=True)[1] == '阅览室 Z301 不存在或无法获取座位图'
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from seat_ranking import SeatRanker
+
+OCCUPIED = {'code': 1, 'msg': '该座位已被预约'}
+
+
+def test_no_history_keeps_input_order():
+    r = SeatRanker()
+    order, scores = r.rank(['Z101003', 'Z101001', 'Z101002'])
+    assert order == ['Z101003', 'Z101001', 'Z101002']
+    assert set(scores.values()) == {0.5}
+    assert r.reordered == 0
+
+
+def test_learn_counts_primary_and_attempts():
+    r = SeatRanker(min_observations=0)
+    r.learn('Z101001', {'code': 0, 'msg': '已使用推荐座位预约成功', 'seatno': 'Z101005', 'attempts': [
+        dict(OCCUPIED, seatno='Z101004', ms=1200.0),
+        {'seatno': 'Z101005', 'code': 0, 'msg': '预约成功', 'ms': 30.0},
+    ]})
+    # 首选座位回退了算被抢一次，尝试成功的算成功一次
+    assert r.observations('Z101001') == pytest.approx(1.0, rel=1e-3)
+    assert r.observations('Z101004') == pytest.approx(1.0, rel=1e-3)
+    assert r.score('Z101005') > 0.5 > r.score('Z101004')
+    assert r.learned == 1
+
+
+def test_posterior_mean_without_prior():
+    r = SeatRanker(prior_weight=0)
+    for _ in range(3):
+        r.learn('Z101001', {'code': 0, 'msg': '预约成功'})
+    r.learn('Z101001', dict(OCCUPIED))
+    # Beta(1 + 3, 1 + 1) 的均值
+    assert r.score('Z101001') == pytest.approx(4 / 6, rel=1e-3)
+
+
+def test_prior_and_decay():
+    r = SeatRanker(prior=lambda code, dt: 0.9, prior_weight=2, half_life_days=1)
+    assert r.score('Z101001') == pytest.approx((1 + 1.8) / (2 + 2), rel=1e-6)
+    r.learn('Z101002', dict(OCCUPIED), at=time.time() - 86400)
+    # 一天前的一次被抢按半衰期只剩一半
+    assert r.observations('Z101002') == pytest.approx(0.5, rel=1e-3)
+
+
+def test_rank_is_stable_and_needs_enough_observations():
+    # 观测按衰减后计，刚记下的 3 次略少于 3
+    r = SeatRanker(prior_weight=0, min_observations=2.5)
+    for _ in range(3):
+        r.learn('', {'code': 1, 'msg': '', 'attempts': [dict(OCCUPIED, seatno='Z101001', ms=2000.0)]})
+        r.learn('', {'code': 0, 'msg': '', 'attempts': [{'seatno': 'Z101003', 'code': 0, 'msg': '预约成功'}]})
+    r.learn('', {'code': 0, 'msg': '', 'attempts': [{'seatno': 'Z101004', 'code': 0, 'msg': '预约成功'}]})
+    order, scores = r.rank(['Z101001', 'Z101002', 'Z101004', 'Z101003'])
+    # Z101004 只有一次观测，按中性处理，与没有历史的 Z101002 保持原来的相对顺序
+    assert order == ['Z101003', 'Z101002', 'Z101004', 'Z101001']
+    assert scores['Z101004'] == 0.5
+    assert r.reordered == 1
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _wait_collapsed(sf, n):
+    deadline = time.monotonic() + 5
+    while sf.stats()['collapsed'] < n:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _callers(sf, key, fn, n, accept=None):
+    # 每个线程调用一次 do；测试里先启动第一个，等它进入 fn 后再启动其余线程
+    results = [None] * n
+    errors = [None] * n
+
+    def call(i):
+        try:
+            results[i] = sf.do(key, fn, accept)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    return threads, results, errors
+
+
+def test_concurrent_calls_collapse():
+    sf = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'ok': True}
+
+    threads, results, errors = _callers(sf, ('seats', 'Z201'), fn, 5)
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    _wait_collapsed(sf, 4)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert errors == [None] * 5
+    # 所有调用者拿到的是同一个对象
+    assert all(r is results[0] for r in results)
+    stats = sf.stats()
+    assert stats['executed'] == 1 and stats['collapsed'] == 4 and stats['inflight'] == 0
+    # 调用结束后同一个 key 重新执行
+    assert sf.do(('seats', 'Z201'), lambda: 2) == 2
+
+
+def test_error_propagates_to_waiters():
+    sf = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        raise ValueError('upstream down')
+
+    threads, results, errors = _callers(sf, ('rooms',), fn, 3)
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    _wait_collapsed(sf, 2)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert sf.stats()['by_kind']['rooms']['errors'] == 1
+    assert sf.stats()['inflight'] == 0
+
+
+def test_rejected_shared_value_is_refetched():
+    # 发起者拿到 None（如登录态失效），等待者自己再请求一次
+    sf = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    values = iter([None, 'mine'])
+
+    def fn():
+        started.set()
+        release.wait(5)
+        return next(values)
+
+    threads, results, errors = _callers(sf, ('user',), fn, 2, accept=lambda v: v is not None)
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+    _wait_collapsed(sf, 1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert results == [None, 'mine']
+
+
+def test_do_async_collapses_and_propagates_errors():
+    sf = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ['seat']
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    async def main():
+        got = await asyncio.gather(*[sf.do_async(('seats', 'Z201'), fetch) for _ in range(4)])
+        assert all(g is got[0] for g in got)
+        errs = await asyncio.gather(*[sf.do_async(('seats', 'Z202'), fail) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(e, ValueError) for e in errs)
+        with pytest.raises(ValueError):
+            await sf.do_async(('seats', 'Z202'), fail)
+
+    asyncio.run(main())
+    assert len(calls) == 3
+    assert sf.stats()['collapsed'] == 5
+    assert sf.stats()['inflight'] == 0
@@ -1,214 +1,187 @@
+import atexit
 import json
 import random
 import datetime
-import threading
+import functools
 import time
-import requests
 import urllib3
-import re
+import os
+import queue
 import uuid
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, jsonify, render_template_string
+from session_pool import SessionPool
+from clock_sync import ClockSync
+from scheduler import Scheduler
+from job_store import JobStore
+from seat_cache import SeatCache
+from cookie_store import CookieStore
+from job_events import SSE_HEARTBEAT_SECONDS, JobEvents
+from session_monitor import SessionMonitor
+from shared_state import WORKER_ID, SharedState
+from recurring import RECURRING_MODES, next_fire, parse_days
+from occupancy import (COLLECT_ROOMS, SLOT_COUNT, SLOT_MINUTES, SLOT_START, OccupancyCollector, OccupancyStore,
+                       free_windows, slot_mask, slot_of)
+from seat_ranking import RANK_ENABLED, SeatRanker
+from seat_index import SEAT_INDEX
+from seat_map import SEAT_MAPS
+from single_flight import SINGLE_FLIGHT
+from request_policy import POLICY
+from rate_limit import BACKGROUND, BOOKING, OUTBOUND, UI, RateLimited, run_as
+from metrics import METRICS, Trace
+from booking import (BASE, HEADERS, RACE_ENABLED, BookingEngine, book, compile_plan, describe_plan,
+                     infer_recommend_params, run_plan, validate_booking, verify_login)
 
 app = Flask(__name__)
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-COOKIES_BY_CLIENT = {}
+COOKIE_STORE = CookieStore()
 SCHEDULED_JOBS = {}
 SCHEDULED_RESULTS = {}
+PLANS = {}
+JOB_EVENTS = JobEvents()
+SCHEDULES = {}
+SESSION_POOL = SessionPool()
+def on_seat_data(key, value):
+    SEAT_INDEX.on_cache_put(key, value)
+    SEAT_MAPS.on_cache_put(key, value)
 
-def cookie_header_from_list(arr):
-    best_idx = {}
-    for i, c in enumerate(arr or []):
-        name = (c.get('name') or '').strip()
-        value = (c.get('value') or '').strip()
-        if not name or not value:
-            continue
-        domain = (c.get('domain') or '').strip().lower()
-        score = 0
-        if domain == 'libwx.hunnu.edu.cn':
-            score = 2
-        elif domain == '.libwx.hunnu.edu.cn':
-            score = 1
-        prev = best_idx.get(name)
-        if prev is None or score > prev[0] or (score == prev[0] and i > prev[1]):
-            best_idx[name] = (score, i, value)
-    out = []
-    seen = set()
-    for i, c in enumerate(arr or []):
-        name = (c.get('name') or '').strip()
-        if not name or name in seen:
-            continue
-        chosen = best_idx.get(name)
-        if chosen and chosen[1] == i:
-            out.append(f"{name}={chosen[2]}")
-            seen.add(name)
-    for name, (_, i, value) in best_idx.items():
-        if name not in seen:
-            out.append(f"{name}={value}")
-            seen.add(name)
-    return '; '.join(out)
+SEAT_CACHE = SeatCache(on_put=on_seat_data)
+PREWARM_SECONDS = float(os.environ.get('HUNNU_PREWARM_SECONDS', '30'))
+
+def fetch_server_date():
+    OUTBOUND.acquire(None, BACKGROUND)
+    r = make_session(None).get(f'{BASE}/apim/basic/BasicHandler.ashx', headers=HEADERS, timeout=5)
+    return r.headers.get('Date')
+
+CLOCK = ClockSync(fetch_server_date)
+ENGINE = BookingEngine(CLOCK)
+SCHEDULER = Scheduler()
+STORE = JobStore(worker=WORKER_ID)
+# 正常退出前把队列中尚未写入的任务状态落盘
+atexit.register(STORE.flush)
+# 本进程排了定时器的任务（只有 leader 会有）
+ARMED = set()
+MISSED_GRACE_SECONDS = float(os.environ.get('HUNNU_MISSED_GRACE_SECONDS', '3600'))
 
 def load_cookie_header(client_id=None):
-    if client_id and client_id in COOKIES_BY_CLIENT:
-        arr = COOKIES_BY_CLIENT[client_id]
-        return cookie_header_from_list(arr)
+    # Cookie 头在保存时已拼好，这里只查表
+    return COOKIE_STORE.header(client_id)
+
+def booking_headers(client_id):
+    headers = dict(HEADERS)
+    headers['Cookie'] = load_cookie_header(client_id)
+    return headers
+
+def do_booking(seatno, seatdate, dt, content, client_id, strategy='sequential', prefs=None):
+    return ENGINE.run(run_as(client_id, BOOKING, book(ENGINE, booking_headers(client_id), seatno, seatdate, dt, content,
+                                                     strategy, prefs)))
+
+def compile_job_plan(job):
+    p = job['payload']
+    plan = compile_plan(booking_headers(job.get('client_id')), p.get('seatno', ''), p.get('seatdate_run', ''),
+                        p.get('datetime', [0, 0]), p.get('content', 'current'), p.get('strategy', 'sequential'),
+                        p.get('prefs'))
+    job['plan'] = describe_plan(plan)
+    PLANS[job['job_id']] = plan
+    return plan
+
+def prepare_booking(payload):
+    return validate_booking(payload.get('seatno',''), payload.get('content','current'))
+
+def ensure_seat_map(seatno, client_id=None):
+    # 推荐回退按距离排序需要该阅览室的座位坐标；缓存里没有时取一次
+    if not seatno:
+        return
     try:
-        cookies = json.load(open('cookies.json','r',encoding='utf-8'))
-        return cookie_header_from_list(cookies)
+        get_seat_map(SEAT_INDEX.lookup(seatno)['room'], client_id, BACKGROUND)
     except Exception:
-        return ''
-
-def is_occupied_msg(msg):
-    m = (msg or '')
-    return ('被预约' in m) or ('已有预约' in m) or ('已被预约' in m)
-
-def infer_recommend_params(seatno, seatdate):
-    sn = (seatno or '').upper()
-    areacode = 'HUNNU_ELB'
-    prefix = ''
-    if sn.startswith('NY01'):
-        areacode = 'HUNNU_NY'
-        prefix = 'NY01'
-    elif sn.startswith('THP'):
-        areacode = 'HUNNU_THP'
-        prefix = 'THP'
-    elif sn.startswith('X'):
-        areacode = 'HUNNU_XYH'
-        prefix = 'X'
-    elif sn.startswith('Z'):
-        areacode = 'HUNNU_ELB'
-        prefix = 'Z'
-    addresscode = ''
-    if prefix:
-        m = re.match(prefix + r"(\d{3})", sn)
-        addresscode = prefix + (m.group(1) if m else '')
-    return {'data_type':'GetTuiJianSeat','areacode':areacode,'addresscode':addresscode,'seatdate':seatdate}
-
-def read_seat_preferences():
-    prefs = []
-    with open('seat_preferences.txt','r',encoding='utf-8') as f:
-        txt = f.read()
-        for token in txt.replace(',', ' ').split():
-            t = token.strip()
-            if t:
-                prefs.append(t)
-    return prefs
-
-def conflict_with_range(show, dt):
-    t = (show or '').strip()
-    if not t or t == '暂无预约':
-        return False
+        pass
+
+def prewarm_client(client_id):
+    # 在定时任务触发前通过预约引擎做一次登录态探测：域名解析与建连都在引擎自己的连接池里完成，
+    # 让 7 点的第一条请求走热连接；dns_ms、connect_ms 为这次探测实际花在解析与建连上的时间
+    out = {'at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    t0 = time.perf_counter()
+    c0 = ENGINE.new_connections
+    trace = Trace()
     try:
-        parts = t.split('-')
-        if len(parts) != 2:
-            return False
-        def parse_one(x):
-            hm = x.strip().split(':')
-            return int(hm[0])*60+int(hm[1])
-        s1 = parse_one(parts[0])
-        e1 = parse_one(parts[1])
-        s2 = int(dt[0])
-        e2 = int(dt[1])
-        return not (e2 <= s1 or s2 >= e1)
-    except Exception:
-        return True
-
-def seat_date_request(session, headers, seatno, seatdate, dt):
-    url = f'{BASE}/apim/seat/SeatDateHandler.ashx'
-    params = {'data_type':'seatDate','seatno':seatno,'seatdate':seatdate,'datetime':f"{dt[0]},{dt[1]}"}
-    
-    # 增加自动重试机制：应对本地时间快于服务器时间导致"未到7点"被拒的情况
-    for i in range(6):
-        try:
-            r = session.get(url, headers=headers, params=params, timeout=10)
-            j = r.json()
-            msg = j.get('msg', '') or ''
-            # 如果是"时间未到"类错误，且不是最后一次尝试，则等待后重试
-            if j.get('code') != 0 and '07:00' in msg and i < 5:
-                time.sleep(0.5)
-                continue
-            return j
-        except Exception:
-            if i < 5:
-                time.sleep(0.5)
-                continue
-            return {'code':-1,'msg':'接口返回异常','status':r.status_code if 'r' in locals() else 0, 'raw': str(e) if 'e' in locals() else ''}
-    return {'code':-1,'msg':'重试多次失败'}
-
-def do_booking(seatno, seatdate, dt, content, client_id):
-    s = make_session()
-    headers = dict(HEADERS)
-    headers['Cookie'] = load_cookie_header(client_id)
-    if content == 'prefs' and not seatno:
-        try:
-            prefs = read_seat_preferences()
-            if not prefs:
-                return {'code':-1,'msg':'偏好文件为空'}
-            for code in prefs:
-                j2 = seat_date_request(s, headers, code, seatdate, dt)
-                if j2.get('code') == 0:
-                    return {'code':0,'msg':'已使用偏好座位预约成功','seatno':code,'data':j2}
-                if not is_occupied_msg(j2.get('msg','')):
-                    return j2
-            return {'code':-1,'msg':'偏好座位均不可用'}
-        except Exception:
-            return {'code':-1,'msg':'读取偏好文件失败'}
-    j = seat_date_request(s, headers, seatno, seatdate, dt)
-    if content == 'current':
-        if j.get('code') == 0 or not is_occupied_msg(j.get('msg','')):
-            return j
-        try:
-            url_rec = f'{BASE}/apim/seat/SeatInfoHandler.ashx'
-            form = infer_recommend_params(seatno, seatdate)
-            rrec = s.post(url_rec, headers=headers, data=form, timeout=10)
-            jrec = rrec.json()
-            seats = []
-            if jrec.get('code') == 0:
-                seats = json.loads(jrec.get('data','[]'))
-            for it in seats:
-                code = it.get('Code','')
-                show = it.get('ShowDataTime','')
-                if not code:
-                    continue
-                if conflict_with_range(show, dt):
-                    continue
-                j2 = seat_date_request(s, headers, code, seatdate, dt)
-                if j2.get('code') == 0:
-                    return {'code':0,'msg':'已使用推荐座位预约成功','seatno':code,'data':j2}
-            return {'code':-1,'msg':'推荐座位尝试失败'}
-        except Exception:
-            return j
-    if content == 'prefs':
-        if j.get('code') == 0 or not is_occupied_msg(j.get('msg','')):
-            return j
-        try:
-            prefs = read_seat_preferences()
-            if not prefs:
-                return {'code':-1,'msg':'偏好文件为空'}
-            seen = {seatno} if seatno else set()
-            for code in prefs:
-                if code in seen:
-                    continue
-                seen.add(code)
-                j2 = seat_date_request(s, headers, code, seatdate, dt)
-                if j2.get('code') == 0:
-                    return {'code':0,'msg':'已使用偏好座位预约成功','seatno':code,'data':j2}
-                if not is_occupied_msg(j2.get('msg','')):
-                    return j2
-            return {'code':-1,'msg':'偏好座位均不可用'}
-        except Exception:
-            return {'code':-1,'msg':'读取偏好文件失败'}
-    return j
-
-def schedule_booking(job_id, target, payload, client_id):
-    delay = (target - datetime.datetime.now()).total_seconds()
+        probe = verify_login(ENGINE, booking_headers(client_id), trace)
+        v = ENGINE.run(run_as(client_id, BACKGROUND, probe), timeout=30)
+        out['ok'] = v.get('ok', False)
+        out['via'] = v.get('via', v.get('reason', ''))
+    except Exception as e:
+        out['ok'] = False
+        out['error'] = str(e)
+    phases = trace.export()['by_phase']
+    out['dns_ms'] = round(phases.get('dns', 0.0), 1)
+    out['connect_ms'] = round(phases.get('connect', 0.0), 1)
+    out['probe_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    out['new_connections'] = ENGINE.new_connections - c0
+    METRICS.observe('hunnu_phase_ms', out['probe_ms'], (('phase', 'prewarm_probe'),))
+    return out
+
+def probe_session(client_id):
+    # 保活探测：与 /api/verify 相同的基础接口请求，顺带保持会话与长连接活跃
+    t0 = time.perf_counter()
+    v = ENGINE.run(run_as(client_id, BACKGROUND, verify_login(ENGINE, booking_headers(client_id))), timeout=30)
+    v['probe_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    METRICS.observe('hunnu_phase_ms', v['probe_ms'], (('phase', 'keepalive_probe'),))
+    METRICS.inc('hunnu_keepalive_probes_total', labels=(('ok', str(v.get('ok', False)).lower()),))
+    return v
+
+def pending_clients():
+    return {job.get('client_id') for job in list(SCHEDULED_JOBS.values()) if job.get('status') == 'pending'}
+
+def on_session_change(client_id, st):
+    # 会话失效或恢复时更新该用户所有待执行任务的 at_risk 标记并推送
+    for job_id in JOB_EVENTS.job_ids(client_id):
+        job = SCHEDULED_JOBS.get(job_id)
+        if job is None or job.get('client_id') != client_id or job.get('status') != 'pending':
+            continue
+        job['at_risk'] = st['at_risk']
+        record_job(job, 'at_risk' if st['at_risk'] else 'session_ok')
+
+SESSION_MONITOR = SessionMonitor(probe_session, pending_clients, on_session_change)
+
+def register_job(job):
+    SCHEDULED_JOBS[job['job_id']] = job
+    JOB_EVENTS.add(job.get('client_id'), job['job_id'], job.get('scheduled_for', ''))
+
+def job_item(job_id):
+    job = SCHEDULED_JOBS[job_id]
+    item = {
+        'job_id': job_id,
+        'scheduled_for': job.get('scheduled_for', ''),
+        'created_at': job.get('created_at', ''),
+        'status': job.get('status', ''),
+        'payload': job.get('payload', {}),
+    }
+    for k in ('plan', 'fire', 'prewarm', 'booking_ms', 'booking_new_connections', 'at_risk', 'schedule_id', 'warning'):
+        if k in job:
+            item[k] = job[k]
+    if job.get('status') == 'pending':
+        session = SESSION_MONITOR.status(job.get('client_id'))
+        if session is not None:
+            item['session'] = session
+    if job_id in SCHEDULED_RESULTS:
+        item['result'] = SCHEDULED_RESULTS[job_id]
+    return item
+
+def record_job(job, event, result=None):
+    # 持久化状态变化并推送给该用户的 SSE 订阅者
+    STORE.record(job, event, result)
+    JOB_EVENTS.publish(job.get('client_id'), event, job_item(job['job_id']))
+
+def schedule_booking(job_id, target, payload, client_id, created_at=None, schedule_id=None):
+    # target 为服务器时间，按时钟偏差换算成本地等待时长
     run_seatdate = target.date().strftime('%Y-%m-%d')
     job = {
         'job_id': job_id,
         'client_id': client_id,
-        'created_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'created_at': created_at or datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'scheduled_for': target.strftime('%Y-%m-%d %H:%M:%S'),
+        'target': target.isoformat(),
         'status': 'pending',
         'payload': {
             'seatno': payload.get('seatno', ''),
@@ -216,52 +189,442 @@ def schedule_booking(job_id, target, payload, client_id):
             'seatdate_run': run_seatdate,
             'datetime': payload.get('datetime', [0, 0]),
             'content': payload.get('content', 'current'),
+            'strategy': payload.get('strategy', 'sequential'),
             'mode': payload.get('mode', ''),
         }
     }
-    SCHEDULED_JOBS[job_id] = job
+    if payload.get('prefs') is not None:
+        job['payload']['prefs'] = list(payload['prefs'])
+    if payload.get('invalid_prefs'):
+        job['payload']['invalid_prefs'] = payload['invalid_prefs']
+    if created_at:
+        job['restored'] = True
+    if schedule_id:
+        job['schedule_id'] = schedule_id
+    session = SESSION_MONITOR.status(client_id)
+    if session is not None and session['at_risk']:
+        job['at_risk'] = True
+    # 先编译计划再登记：编译失败时任务不会留在列表与 SSE 索引中
+    compile_job_plan(job)
+    register_job(job)
+    record_job(job, 'restored' if created_at else 'created')
+    if SHARED.leader:
+        arm_job(job)
+    return job
 
-    def run_later():
-        job['status'] = 'running'
-        job['started_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def arm_job(job):
+    # 只有持有调度租约的进程排定时器；其他 worker 创建的任务由 leader 同步到后再排
+    job_id = job['job_id']
+    client_id = job.get('client_id')
+    target = datetime.datetime.fromisoformat(job['target'])
+    delay = CLOCK.seconds_until(target)
+    SESSION_MONITOR.ensure_running()
+
+    def run_later(latency_ms=0.0):
+        if job['status'] != 'pending' or not SHARED.leader:
+            return
+        # 本地的 leader 标记最多每几秒刷新一次：发送前在数据库里原子地确认仍持有租约并认领任务，
+        # 卡住后被接管的旧 leader 在这里放弃，每个任务只会被一个进程触发
         try:
-            seatno = job['payload'].get('seatno', '')
-            dt = job['payload'].get('datetime', [0, 0])
-            content = job['payload'].get('content', 'current')
-            seatdate = job['payload'].get('seatdate_run', run_seatdate)
-            res = do_booking(seatno, seatdate, dt, content, client_id)
-            job['status'] = 'done'
+            claimed = STORE.claim_job(job, SHARED.name, SHARED.owner)
+        except Exception as e:
+            job['status'] = 'failed'
             job['finished_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            SCHEDULED_RESULTS[job_id] = res
+            SCHEDULED_RESULTS[job_id] = {'code': -1, 'msg': '无法确认调度租约，未执行', 'error': str(e)}
+            record_job(job, 'failed', SCHEDULED_RESULTS[job_id])
+            job_finished(job)
+            return
+        if not claimed:
+            ARMED.discard(job_id)
+            return
+        job['status'] = 'running'
+        c0 = ENGINE.new_connections
+        t0 = time.perf_counter()
+        try:
+            # 触发时只发送预先编译好的请求，交给预约引擎的事件循环并发执行，不占用调度线程池
+            plan = PLANS.get(job_id) or compile_job_plan(job)
+            trace = Trace()
+            trace.add('fire_lateness', latency_ms)
+            fut = ENGINE.submit(run_as(client_id, BOOKING, run_plan(ENGINE, plan, trace)))
         except Exception as e:
             job['status'] = 'failed'
             job['finished_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             SCHEDULED_RESULTS[job_id] = {'code': -1, 'msg': '定时任务执行异常', 'error': str(e)}
+            record_job(job, 'failed', SCHEDULED_RESULTS[job_id])
+            job_finished(job)
+            return
+        job['started_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        job['fire'] = {
+            'planned': target.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            'actual': CLOCK.server_now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            'latency_ms': round(latency_ms, 3),
+        }
+        record_job(job, 'running')
 
-    timer = threading.Timer(max(0, delay), run_later)
-    timer.daemon = False
-    timer.start()
-    SCHEDULED_JOBS[job_id]['timer_started'] = True
-    return job
+        def finish(fut):
+            ARMED.discard(job_id)
+            job['booking_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+            # 预热生效时，执行阶段不应再新建连接
+            job['booking_new_connections'] = ENGINE.new_connections - c0
+            job['finished_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            PLANS.pop(job_id, None)
+            try:
+                SCHEDULED_RESULTS[job_id] = fut.result()
+                job['status'] = 'done'
+                if SCHEDULED_RESULTS[job_id].get('warning'):
+                    job['warning'] = SCHEDULED_RESULTS[job_id]['warning']
+            except Exception as e:
+                job['status'] = 'failed'
+                SCHEDULED_RESULTS[job_id] = {'code': -1, 'msg': '定时任务执行异常', 'error': str(e)}
+            record_job(job, job['status'], SCHEDULED_RESULTS.get(job_id))
+            job_finished(job)
 
-def make_session():
-    s = requests.Session()
-    s.verify = False
-    s.trust_env = False
-    return s
-
-BASE = 'https://libwx.hunnu.edu.cn'
-HEADERS = {
-    'Host': 'libwx.hunnu.edu.cn',
-    'Origin': 'https://libwx.hunnu.edu.cn',
-    'Referer': 'https://libwx.hunnu.edu.cn/mobile/wxindex.aspx',
-    'User-Agent': '7.0.5 WindowsWechat',
-    'Accept': 'application/json, text/javascript, */*; q=0.01',
-    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-    'Accept-Encoding': 'gzip, deflate, br',
-    'Connection': 'keep-alive',
-    'X-Requested-With': 'XMLHttpRequest'
-}
+        fut.add_done_callback(finish)
+
+    def warm_up(latency_ms=0.0):
+        if job['status'] != 'pending':
+            return
+        try:
+            job['prewarm'] = prewarm_client(client_id)
+        except Exception as e:
+            job['prewarm'] = {'ok': False, 'error': str(e)}
+        if job['payload'].get('content') == 'current':
+            ensure_seat_map(job['payload'].get('seatno'), client_id)
+        # 预热时按最新 Cookie 重新编译一次预约计划
+        compile_job_plan(job)
+        record_job(job, 'prewarm')
+
+    if job_id not in PLANS:
+        compile_job_plan(job)
+    if PREWARM_SECONDS > 0 and delay > PREWARM_SECONDS:
+        SCHEDULER.add(job_id + ':prewarm', lambda: CLOCK.seconds_until(target) - PREWARM_SECONDS, warm_up,
+                      background=True)
+    SCHEDULER.add(job_id, lambda: CLOCK.seconds_until(target), run_later)
+    ARMED.add(job_id)
+    job['timer_started'] = True
+
+def fetch_upstream_data(client_id, url, params, priority=UI, acquired=False):
+    # 上游接口的 data 字段是再次编码的 JSON 字符串；acquired 表示调用者已经拿到限流令牌
+    if not acquired:
+        OUTBOUND.acquire(client_id, priority)
+    s = make_session(client_id)
+    headers = dict(HEADERS)
+    headers['Cookie'] = load_cookie_header(client_id)
+    r = s.get(url, headers=headers, params=params, timeout=10)
+    j = r.json()
+    if j.get('code') == 0:
+        return json.loads(j['data'])
+    return None
+
+def fetch_shared(client_id, key, url, params, priority=UI):
+    # 每个调用者按自己的 clientId 排队拿一个令牌；合并后的那次请求由发起者用自己的 Cookie 发出，不再重复排队。
+    # 发起者登录态失效（返回 None）时，等待者各自用自己的 Cookie 和已拿到的令牌再取一次
+    OUTBOUND.acquire(client_id, priority)
+    return SINGLE_FLIGHT.do(key, lambda: fetch_upstream_data(client_id, url, params, priority, acquired=True),
+                            accept=lambda data: data is not None)
+
+def get_rooms(client_id=None, priority=UI):
+    # 阅览室列表与座位图几乎不变，与用户无关，所有客户端共用缓存
+    # 缓存未命中时同时到达的请求只向上游发一次
+    return SEAT_CACHE.get('rooms', lambda: fetch_shared(
+        client_id, ('rooms',), f'{BASE}/apim/seat/SeatAddressHandler.ashx', {'data_type':'list'}, priority))
+
+def get_seat_map(room_id, client_id=None, priority=UI):
+    return SEAT_CACHE.get('seats:' + room_id, lambda: fetch_shared(
+        client_id, ('seats', room_id), f'{BASE}/apim/seat/SeatInfoHandler.ashx',
+        {'data_type':'getMapPointInit','mapid':room_id}, priority))
+
+def cancel_job(job_id):
+    job = SCHEDULED_JOBS.get(job_id)
+    if job is None or job.get('status') != 'pending':
+        return False
+    SCHEDULER.cancel(job_id)
+    SCHEDULER.cancel(job_id + ':prewarm')
+    ARMED.discard(job_id)
+    PLANS.pop(job_id, None)
+    job['status'] = 'cancelled'
+    record_job(job, 'cancelled')
+    return True
+
+def arm_schedule(sched):
+    # 重复计划只展开下一次执行：同一时刻每个计划最多一个待执行任务（一个调度条目）
+    sched['next_job_id'] = None
+    sched['next_fire'] = None
+    # 只有 leader 展开任务；其他 worker 保存后由 leader 同步到再展开
+    if sched.get('enabled', True) and SHARED.leader:
+        payload = dict(sched['payload'], mode=sched['mode'])
+        if payload.get('content') == 'prefs':
+            # 每次展开时重新读取偏好文件，读取失败则沿用上次的列表
+            checked, err = prepare_booking(payload)
+            if not err:
+                payload.update(checked)
+                sched['payload'].update(checked)
+        CLOCK.ensure_running()
+        last = sched.get('last_fire')
+        target = next_fire(sched['days'], sched['mode'], CLOCK.server_now(),
+                           datetime.datetime.fromisoformat(last) if last else None)
+        if target is not None:
+            job = schedule_booking(uuid.uuid4().hex, target, payload, sched.get('client_id'),
+                                   schedule_id=sched['schedule_id'])
+            sched['next_job_id'] = job['job_id']
+            sched['next_fire'] = job['scheduled_for']
+    STORE.save_schedule(sched)
+    return sched
+
+def recompile_client(client_id):
+    # Cookie 变更后重新编译该用户待执行任务的预约计划
+    for job in list(SCHEDULED_JOBS.values()):
+        if (job.get('client_id') or None) == (client_id or None) and job.get('status') == 'pending':
+            compile_job_plan(job)
+
+def job_finished(job):
+    # 重复计划的任务结束后展开下一次；交给调度线程池执行，不占用预约引擎的事件循环
+    sched = SCHEDULES.get(job.get('schedule_id'))
+    if sched is None or sched.get('next_job_id') != job['job_id']:
+        return
+
+    def rearm(latency_ms=0.0):
+        if sched.get('next_job_id') != job['job_id'] or SCHEDULES.get(sched['schedule_id']) is not sched:
+            return
+        sched['runs'] = sched.get('runs', 0) + 1
+        sched['last_job_id'] = job['job_id']
+        sched['last_status'] = job['status']
+        sched['last_fire'] = job['target']
+        arm_schedule(sched)
+
+    SCHEDULER.add(job['job_id'] + ':rearm', lambda: 0, rearm, background=True)
+
+def build_schedule(body, base=None):
+    # 校验重复计划参数，返回 (计划, 错误)；base 为修改前的计划
+    merged = dict(base.get('payload', {}), days=base.get('days'), mode=base.get('mode'),
+                  enabled=base.get('enabled', True)) if base else {}
+    merged.update(body or {})
+    days = parse_days(merged.get('days'))
+    if days is None:
+        return None, {'code':-1,'msg':'重复日期无效'}
+    mode = merged.get('mode') or 'next7'
+    if mode not in RECURRING_MODES:
+        return None, {'code':-1,'msg':'未知执行方式'}
+    dt = merged.get('datetime') or [0, 0]
+    try:
+        dt = [int(dt[0]), int(dt[1])]
+    except (TypeError, ValueError, IndexError):
+        return None, {'code':-1,'msg':'时间段无效'}
+    if dt[1] <= dt[0]:
+        return None, {'code':-1,'msg':'结束时间必须大于开始时间'}
+    content = merged.get('content', 'current')
+    if content == 'current' and not merged.get('seatno'):
+        return None, {'code':-1,'msg':'座位号为空'}
+    checked, err = prepare_booking(dict(merged, content=content))
+    if err:
+        return None, err
+    payload = {
+        'seatno': checked['seatno'],
+        'datetime': dt,
+        'content': content,
+        'strategy': merged.get('strategy', 'sequential'),
+    }
+    for k in ('prefs', 'invalid_prefs'):
+        if k in checked:
+            payload[k] = checked[k]
+    sched = dict(base) if base else {
+        'schedule_id': uuid.uuid4().hex,
+        'created_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'runs': 0,
+    }
+    # rev 递增，多个 worker 同时修改时以新版本为准
+    sched.update({'days': list(days), 'mode': mode, 'enabled': bool(merged.get('enabled', True)), 'payload': payload,
+                  'rev': sched.get('rev', 0) + 1})
+    return sched, None
+
+def owned_schedule(schedule_id, client_id):
+    sched = SCHEDULES.get(schedule_id)
+    if sched is None or (client_id and sched.get('client_id') != client_id):
+        return None
+    return sched
+
+def fetch_availability(room, seatdate, client_id=None, priority=UI):
+    # 推荐座位接口返回整间阅览室各座位的 ShowDataTime
+    data = infer_recommend_params(room, seatdate)
+    # 用调用者自己的 Cookie；未保存 Cookie 的用户与后台采集（client_id 为 None）共用全局 Cookie，合并为同一次请求
+    owner = client_id if client_id in COOKIE_STORE else None
+    headers = dict(HEADERS)
+    headers['Cookie'] = load_cookie_header(owner)
+
+    def load():
+        OUTBOUND.acquire(client_id, priority)
+        r = make_session(owner).post(f'{BASE}/apim/seat/SeatInfoHandler.ashx', headers=headers, data=data, timeout=10)
+        j = r.json()
+        if j.get('code') == 0:
+            return json.loads(j['data'])
+        return None
+
+    return SINGLE_FLIGHT.do(('availability', owner, data['addresscode'], data['areacode'], seatdate), load)
+
+def collect_rooms():
+    if COLLECT_ROOMS:
+        return COLLECT_ROOMS
+    get_rooms(None, BACKGROUND)
+    return SEAT_INDEX.rooms()
+
+def observe_recommend(params, seats):
+    # 预约时拿到的推荐结果顺带计入占用记录
+    if COLLECTOR.enabled and SHARED.leader:
+        OCCUPANCY.observe(params.get('addresscode', ''), params.get('seatdate', ''), seats)
+
+OCCUPANCY = OccupancyStore()
+COLLECTOR = OccupancyCollector(OCCUPANCY, lambda room, seatdate: fetch_availability(room, seatdate, priority=BACKGROUND),
+                               collect_rooms, now=lambda: CLOCK.server_now())
+ENGINE.on_seats = observe_recommend
+# 推荐回退时并发取到的座位图进入共用缓存
+ENGINE.on_seat_map = lambda room, seats: SEAT_CACHE.put('seats:' + room, seats)
+
+@functools.lru_cache(maxsize=4096)
+def _occupancy_free(code, start, end, day):
+    rate = OCCUPANCY.seat_busy_rate(SEAT_INDEX.lookup(code)['room'], code, slot_mask(start, end), since=day - 90)
+    return None if rate is None else 1 - rate
+
+def occupancy_prior(code, dt):
+    # 近 90 天该座位在所选时段的空闲比例，作为排序先验；按天缓存，触发时不重复统计
+    if dt is None:
+        return None
+    return _occupancy_free(code, int(dt[0]), int(dt[1]), datetime.date.today().toordinal())
+
+RANKER = SeatRanker(prior=occupancy_prior)
+# 候选排序默认关闭（HUNNU_RANK_SEATS=1 开启）；关闭时候选按偏好文件 / 空闲时长 / 距离的原顺序尝试
+ENGINE.ranker = RANKER if RANK_ENABLED else None
+
+def restore_jobs():
+    # 服务启动时从持久化存储载入 Cookie、重复计划与任务；成为 leader 时（adopt_jobs）再排定时器
+    COOKIE_STORE.update(STORE.load_cookies())
+    for sched in STORE.load_schedules():
+        SCHEDULES[sched['schedule_id']] = sched
+    for job, result in STORE.load_jobs():
+        job_id = job.get('job_id')
+        if not job_id or job_id in SCHEDULED_JOBS:
+            continue
+        register_job(job)
+        if result is not None:
+            SCHEDULED_RESULTS[job_id] = result
+            if job.get('status') in ('done', 'failed', 'cancelled'):
+                learn_result(job, result)
+    SHARED.start()
+
+def learn_result(job, result):
+    # 用任务结果更新候选座位的成功率估计
+    try:
+        at = datetime.datetime.strptime(job.get('finished_at', ''), '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        at = None
+    RANKER.learn(job.get('payload', {}).get('seatno', ''), result, at=at)
+
+def adopt_jobs():
+    # 成为 leader（启动或接管）时：未执行的任务重新排入调度器，错过太久的标记失败，重复计划补展开
+    now = datetime.datetime.now()
+    for job in list(SCHEDULED_JOBS.values()):
+        job_id = job['job_id']
+        if job.get('status') not in ('pending', 'running') or job_id in ARMED:
+            continue
+        if job['status'] == 'running':
+            # 进程在执行中退出（或卡住后被接管）：预约请求可能已经到达服务器，重放会重复预约或误报“已被预约”
+            job['status'] = 'failed'
+            job['finished_at'] = now.strftime('%Y-%m-%d %H:%M:%S')
+            SCHEDULED_RESULTS[job_id] = {'code': -1, 'msg': '执行中断，结果未知，请在图书馆系统中确认是否已预约',
+                                         'unknown': True}
+            record_job(job, 'failed', SCHEDULED_RESULTS[job_id])
+            continue
+        try:
+            target = datetime.datetime.fromisoformat(job.get('target') or job.get('scheduled_for', ''))
+        except ValueError:
+            continue
+        if (now - target).total_seconds() > MISSED_GRACE_SECONDS:
+            job['status'] = 'failed'
+            SCHEDULED_RESULTS[job_id] = {'code': -1, 'msg': '服务重启错过执行时间'}
+            record_job(job, 'failed', SCHEDULED_RESULTS[job_id])
+            continue
+        CLOCK.ensure_running()
+        schedule_booking(job_id, target, job.get('payload', {}), job.get('client_id'),
+                         created_at=job.get('created_at') or now.strftime('%Y-%m-%d %H:%M:%S'),
+                         schedule_id=job.get('schedule_id'))
+    # 下一次任务已结束或丢失的重复计划重新展开
+    for sched in list(SCHEDULES.values()):
+        job = SCHEDULED_JOBS.get(sched.get('next_job_id'))
+        if job is None or job.get('status') != 'pending':
+            arm_schedule(sched)
+    COLLECTOR.ensure_running()
+
+def release_jobs():
+    # 失去租约时撤下本进程的定时器，避免与新 leader 重复触发；已在执行的任务照常完成
+    for job_id in list(ARMED):
+        if SCHEDULED_JOBS.get(job_id, {}).get('status') == 'running':
+            continue
+        SCHEDULER.cancel(job_id)
+        SCHEDULER.cancel(job_id + ':prewarm')
+        ARMED.discard(job_id)
+
+def apply_remote_job(event, job, result):
+    job_id = job.get('job_id')
+    if not job_id:
+        return
+    local = SCHEDULED_JOBS.get(job_id)
+    if job_id in ARMED:
+        # 本进程负责触发的任务只接受其他 worker 的取消
+        if job.get('status') == 'cancelled' and local is not None and local.get('status') == 'pending':
+            cancel_job(job_id)
+        return
+    if local is None:
+        register_job(job)
+    else:
+        local.clear()
+        local.update(job)
+    if result is not None:
+        SCHEDULED_RESULTS[job_id] = result
+        if job.get('status') in ('done', 'failed'):
+            learn_result(job, result)
+    JOB_EVENTS.publish(job.get('client_id'), event, job_item(job_id))
+    if SHARED.leader and job.get('status') == 'pending' and event in ('created', 'restored'):
+        arm_job(SCHEDULED_JOBS[job_id])
+
+def apply_remote_schedule(sched):
+    schedule_id = sched.get('schedule_id')
+    local = SCHEDULES.get(schedule_id)
+    if sched.get('deleted'):
+        if local is not None and local.get('rev', 0) < sched.get('rev', 0):
+            SCHEDULES.pop(schedule_id, None)
+            if SHARED.leader:
+                cancel_job(local.get('next_job_id'))
+        return
+    if local is not None and local.get('rev', 0) > sched.get('rev', 0):
+        return
+    if SHARED.leader:
+        if local is not None and local.get('rev', 0) == sched.get('rev', 0):
+            return
+        # 其他 worker 新建或修改的计划由 leader 展开
+        if local is not None and local.get('next_job_id') != sched.get('next_job_id'):
+            cancel_job(local.get('next_job_id'))
+        SCHEDULES[schedule_id] = sched
+        arm_schedule(sched)
+    else:
+        SCHEDULES[schedule_id] = sched
+
+def sync_shared(since):
+    # 读取其他 worker 写入的任务事件、Cookie 与重复计划，更新本进程视图（可重复应用）
+    for event, job, result in STORE.changes():
+        apply_remote_job(event, job, result)
+    for cid, arr in STORE.load_cookies(since).items():
+        if COOKIE_STORE.cookies(cid) != arr:
+            COOKIE_STORE.set(cid, arr)
+            if SHARED.leader:
+                SESSION_MONITOR.touch(cid)
+                recompile_client(cid)
+    for sched in STORE.load_schedules(since, others=True):
+        apply_remote_schedule(sched)
+
+SHARED = SharedState(STORE, on_leader=adopt_jobs, on_follower=release_jobs, on_sync=sync_shared)
+
+def make_session(client_id=None):
+    # 按 clientId 复用长连接会话，避免每次请求重新 TCP/TLS 握手
+    return SESSION_POOL.get(client_id)
 
 PAGE = r"""
 <!doctype html>
@@ -332,9 +695,27 @@ pre{margin:20px 0 0;padding:12px;border:1px solid var(--line);border-radius:6px;
         <option value="prefs">已储存的座位偏好</option>
       </select>
     </div>
+    <div class="col">
+      <label>备选尝试</label>
+      <select id="strategy">
+        <option value="sequential">逐个尝试</option>
+        {% if race_enabled %}<option value="race">并发抢座</option>{% endif %}
+      </select>
+    </div>
+    <div class="col">
+      <label>重复</label>
+      <select id="repeat">
+        <option value="">不重复</option>
+        <option value="weekdays">工作日</option>
+        <option value="daily">每天</option>
+        <option value="weekends">周末</option>
+      </select>
+    </div>
   </div>
   <div style="margin-top:16px">
     <button onclick="book()">预约</button>
+    <button style="margin-left:8px" onclick="listSchedules()">重复计划</button>
+    <button style="margin-left:8px" onclick="deleteSchedule()">删除重复计划</button>
   </div>
   <pre id="out"></pre>
   <div style="margin-top:24px">
@@ -400,8 +781,10 @@ document.getElementById('roomInput').addEventListener('change',noop);
 function toMinutes(t){const [h,m]=t.split(':');return parseInt(h)*60+parseInt(m)}
 
 let pollTimer=null;
+let jobStream=null;
 async function book(){
   if(pollTimer){clearTimeout(pollTimer);pollTimer=null}
+  if(jobStream){jobStream.close();jobStream=null}
   const seatTyped=document.getElementById('seatInput').value.trim();
   const room=document.getElementById('roomInput').value.trim();
   let seat=seatTyped;
@@ -413,9 +796,17 @@ async function book(){
   const end=parseInt(document.getElementById('endHour').value)*60+parseInt(document.getElementById('endMin').value);
   const mode=document.getElementById('mode').value;
   const content=document.getElementById('content').value;
+  const strategy=document.getElementById('strategy').value;
   if (content==='current' && !seat) { document.getElementById('out').textContent=JSON.stringify({code:-1,msg:'座位号为空'},null,2); return }
   if (end<=start) { document.getElementById('out').textContent=JSON.stringify({code:-1,msg:'结束时间必须大于开始时间'},null,2); return }
-  const r=await fetch('/api/book',{method:'POST',headers:{'Content-Type':'application/json','X-Client-Id':clientId},body:JSON.stringify({seatno:seat,seatdate:date,datetime:[start,end],mode,content})});
+  const repeat=document.getElementById('repeat').value;
+  if (repeat) {
+    if (mode==='now') { document.getElementById('out').textContent=JSON.stringify({code:-1,msg:'重复计划需选择 7 点执行方式'},null,2); return }
+    const r=await fetch('/api/schedules',{method:'POST',headers:{'Content-Type':'application/json','X-Client-Id':clientId},body:JSON.stringify({seatno:seat,datetime:[start,end],mode,content,strategy,days:repeat})});
+    document.getElementById('out').textContent=JSON.stringify(await r.json(),null,2);
+    return;
+  }
+  const r=await fetch('/api/book',{method:'POST',headers:{'Content-Type':'application/json','X-Client-Id':clientId},body:JSON.stringify({seatno:seat,seatdate:date,datetime:[start,end],mode,content,strategy})});
   const j=await r.json();
   document.getElementById('out').textContent=JSON.stringify(j,null,2);
   if(j.code===0 && j.job_id && j.scheduled_for){
@@ -426,21 +817,51 @@ async function book(){
       const out=document.getElementById('out');
       out.textContent+='\n\n[系统] 定时任务已创建，请保持页面开启，将在执行后自动更新结果...';
       const waitMs=Math.max(0,delay-60000);
-      pollTimer=setTimeout(()=>startPolling(j.job_id),waitMs);
+      pollTimer=setTimeout(()=>watchJob(j.job_id),waitMs);
     }else{
-      startPolling(j.job_id);
+      watchJob(j.job_id);
     }
   }
 }
+function showJobResult(job){
+  if(job && (job.status==='done'||job.status==='failed')){
+    document.getElementById('out').textContent=`[系统] 任务已执行 (状态: ${job.status})\n执行结果:\n`+JSON.stringify(job.result,null,2);
+    return true;
+  }
+  return false;
+}
+function watchJob(jobId){
+  // 优先用 SSE 接收服务端推送，浏览器不支持或连接失败时退回轮询
+  pollTimer=null;
+  if(typeof EventSource==='undefined'){startPolling(jobId);return}
+  const es=new EventSource('/api/scheduled/stream?client_id='+encodeURIComponent(clientId));
+  jobStream=es;
+  const onJob=(ev)=>{
+    let job=null;
+    try{job=JSON.parse(ev.data)}catch(e){return}
+    if(job.job_id!==jobId) return;
+    if(showJobResult(job)){es.close();jobStream=null;return}
+    if(job.at_risk) document.getElementById('out').textContent+='\n[系统] 登录态已失效，请尽快更新 Cookie';
+  };
+  ['snapshot','done','failed','at_risk'].forEach(t=>es.addEventListener(t,onJob));
+  es.onerror=()=>{if(es.readyState===EventSource.CLOSED && jobStream===es){jobStream=null;startPolling(jobId)}};
+}
+async function listSchedules(){
+  const r=await fetch('/api/schedules',{headers:{'X-Client-Id':clientId}});
+  document.getElementById('out').textContent=JSON.stringify(await r.json(),null,2);
+}
+async function deleteSchedule(){
+  const id=(prompt('输入要删除的重复计划 schedule_id')||'').trim();
+  if(!id) return;
+  const r=await fetch('/api/schedules/'+encodeURIComponent(id),{method:'DELETE',headers:{'X-Client-Id':clientId}});
+  document.getElementById('out').textContent=JSON.stringify(await r.json(),null,2);
+}
 async function startPolling(jobId){
-  const out=document.getElementById('out');
   const check=async()=>{
     try{
       const r=await fetch('/api/scheduled',{headers:{'X-Client-Id':clientId}});
       const jobs=await r.json();
-      const job=jobs.find(x=>x.job_id===jobId);
-      if(job && (job.status==='done'||job.status==='failed')){
-        out.textContent=`[系统] 任务已执行 (状态: ${job.status})\n执行结果:\n`+JSON.stringify(job.result,null,2);
+      if(showJobResult(jobs.find(x=>x.job_id===jobId))){
         pollTimer=null;
         return;
       }
@@ -484,40 +905,45 @@ async function loadUser(){
 </html>
 """
 
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _record_timing(resp):
+    t0 = g.get('t0')
+    if t0 is not None and request.path.startswith('/api/'):
+        rule = request.url_rule.rule if request.url_rule else request.path
+        METRICS.observe('hunnu_http_request_ms', (time.perf_counter() - t0) * 1000,
+                        (('endpoint', rule), ('method', request.method)))
+    return resp
+
+@app.errorhandler(RateLimited)
+def _rate_limited(e):
+    return jsonify({'code':-1,'msg':'请求过于频繁，请稍后再试'}), 429
+
 @app.get('/')
 def index():
-    return render_template_string(PAGE)
+    return render_template_string(PAGE, race_enabled=RACE_ENABLED)
 
 @app.get('/api/rooms')
 def api_rooms():
-    s = make_session()
-    headers = dict(HEADERS)
-    headers['Cookie'] = load_cookie_header(request.headers.get('X-Client-Id'))
-    url = f'{BASE}/apim/seat/SeatAddressHandler.ashx'
-    params = {'data_type':'list'}
-    r = s.get(url, headers=headers, params=params, timeout=10)
-    j = r.json()
-    if j.get('code') == 0:
-        return jsonify(json.loads(j['data']))
-    return jsonify([])
+    return jsonify(get_rooms(request.headers.get('X-Client-Id')) or [])
 
 @app.get('/api/seats')
 def api_seats():
     room_id = request.args.get('room_id','')
-    date = request.args.get('date','')
-    s = make_session()
-    headers = dict(HEADERS)
-    headers['Cookie'] = load_cookie_header(request.headers.get('X-Client-Id'))
-    url = f'{BASE}/apim/seat/SeatInfoHandler.ashx'
-    params = {'data_type':'getMapPointInit','mapid':room_id}
-    r = s.get(url, headers=headers, params=params, timeout=10)
-    j = r.json()
-    seats = []
-    if j.get('code') == 0:
-        data = json.loads(j['data'])
-        seats = [x['SeatNo'] for x in data]
+    data = get_seat_map(room_id, request.headers.get('X-Client-Id')) or []
+    seats = [x['SeatNo'] for x in data]
     return jsonify(seats)
 
+@app.get('/api/cache')
+def api_cache():
+    out = SEAT_CACHE.stats()
+    out['index'] = SEAT_INDEX.stats()
+    out['maps'] = SEAT_MAPS.stats()
+    return jsonify(out)
+
 @app.post('/api/book')
 def api_book():
     payload = request.get_json(force=True)
@@ -526,76 +952,220 @@ def api_book():
     dt = payload.get('datetime',[0,0])
     mode = payload.get('mode','now')
     content = payload.get('content','current')
+    strategy = payload.get('strategy','sequential')
     client_id = request.headers.get('X-Client-Id')
+    checked, err = prepare_booking(payload)
+    if err:
+        return jsonify(err)
+    payload = dict(payload, **checked)
+    seatno = checked['seatno']
     if mode == 'now':
-        return jsonify(do_booking(seatno, seatdate, dt, content, client_id))
+        res = do_booking(seatno, seatdate, dt, content, client_id, strategy, checked.get('prefs'))
+        if checked.get('invalid_prefs'):
+            res['invalid_prefs'] = checked['invalid_prefs']
+        return jsonify(res)
     elif mode == 'next7':
-        now = datetime.datetime.now()
+        CLOCK.ensure_running()
+        now = CLOCK.server_now()
         target = (now + datetime.timedelta(days=1)).replace(hour=7, minute=0, second=0, microsecond=0)
         job_id = uuid.uuid4().hex
         job = schedule_booking(job_id, target, payload, client_id)
-        return jsonify({'code': 0, 'msg': '已安排在明日07:00执行', 'job_id': job_id, 'scheduled_for': job['scheduled_for'], 'seatdate_run': job['payload']['seatdate_run']})
+        return jsonify({'code': 0, 'msg': '已安排在明日07:00执行', 'job_id': job_id, 'scheduled_for': job['scheduled_for'], 'seatdate_run': job['payload']['seatdate_run'], 'invalid_prefs': checked.get('invalid_prefs', [])})
     elif mode == 'next7_normal':
-        now = datetime.datetime.now()
+        CLOCK.ensure_running()
+        now = CLOCK.server_now()
         base = (now + datetime.timedelta(days=1)).replace(hour=7, minute=0, second=5, microsecond=0)
         jitter = random.gauss(0, 1)
         target = base + datetime.timedelta(seconds=jitter)
         job_id = uuid.uuid4().hex
         job = schedule_booking(job_id, target, payload, client_id)
-        return jsonify({'code': 0, 'msg': '已安排在明日7点过几秒执行', 'job_id': job_id, 'scheduled_for': job['scheduled_for'], 'jitter_seconds': jitter, 'distribution': 'normal(base=07:00:05,sigma=1s)', 'seatdate_run': job['payload']['seatdate_run']})
+        return jsonify({'code': 0, 'msg': '已安排在明日7点过几秒执行', 'job_id': job_id, 'scheduled_for': job['scheduled_for'], 'jitter_seconds': jitter, 'distribution': 'normal(base=07:00:05,sigma=1s)', 'seatdate_run': job['payload']['seatdate_run'], 'invalid_prefs': checked.get('invalid_prefs', [])})
     else:
         return jsonify({'code':-1,'msg':'未知执行方式'})
 
 @app.get('/api/scheduled')
 def api_scheduled():
     cid = request.headers.get('X-Client-Id')
-    jobs = []
-    for job_id, job in SCHEDULED_JOBS.items():
-        if cid and job.get('client_id') != cid:
-            continue
-        item = {
-            'job_id': job_id,
-            'scheduled_for': job.get('scheduled_for', ''),
-            'created_at': job.get('created_at', ''),
-            'status': job.get('status', ''),
-            'payload': job.get('payload', {}),
-        }
-        if job_id in SCHEDULED_RESULTS:
-            item['result'] = SCHEDULED_RESULTS[job_id]
-        jobs.append(item)
-    jobs.sort(key=lambda x: x.get('scheduled_for', ''))
-    return jsonify(jobs)
+    return jsonify([job_item(job_id) for job_id in JOB_EVENTS.job_ids(cid)])
+
+@app.get('/api/scheduled/stream')
+def api_scheduled_stream():
+    # Server-Sent Events：推送该用户任务的状态变化；EventSource 不能带自定义请求头，clientId 走查询参数
+    cid = request.args.get('client_id') or request.headers.get('X-Client-Id')
+    q = JOB_EVENTS.subscribe(cid)
+
+    def sse(event, item):
+        return f'event: {event}\ndata: {json.dumps(item, ensure_ascii=False)}\n\n'
+
+    def stream():
+        try:
+            # 先订阅再发快照，连接建立前后发生的变化都不会丢
+            yield 'retry: 3000\n\n'
+            for job_id in JOB_EVENTS.job_ids(cid):
+                yield sse('snapshot', job_item(job_id))
+            while True:
+                try:
+                    event, item = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                yield sse(event, item)
+        finally:
+            JOB_EVENTS.unsubscribe(cid, q)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.get('/api/schedules')
+def api_schedules():
+    cid = request.headers.get('X-Client-Id')
+    items = [s for s in SCHEDULES.values() if not cid or s.get('client_id') == cid]
+    items.sort(key=lambda x: x.get('created_at', ''))
+    return jsonify(items)
+
+@app.post('/api/schedules')
+def api_schedules_create():
+    sched, err = build_schedule(request.get_json(force=True))
+    if err:
+        return jsonify(err)
+    sched['client_id'] = request.headers.get('X-Client-Id')
+    SCHEDULES[sched['schedule_id']] = sched
+    arm_schedule(sched)
+    return jsonify({'code': 0, 'msg': '已创建重复计划', 'schedule': sched})
+
+@app.get('/api/schedules/<schedule_id>')
+def api_schedules_get(schedule_id):
+    sched = owned_schedule(schedule_id, request.headers.get('X-Client-Id'))
+    if sched is None:
+        return jsonify({'code':-1,'msg':'重复计划不存在'}), 404
+    return jsonify(sched)
+
+@app.route('/api/schedules/<schedule_id>', methods=['PUT', 'PATCH'])
+def api_schedules_update(schedule_id):
+    old = owned_schedule(schedule_id, request.headers.get('X-Client-Id'))
+    if old is None:
+        return jsonify({'code':-1,'msg':'重复计划不存在'}), 404
+    sched, err = build_schedule(request.get_json(force=True), old)
+    if err:
+        return jsonify(err)
+    cancel_job(old.get('next_job_id'))
+    SCHEDULES[schedule_id] = sched
+    arm_schedule(sched)
+    return jsonify({'code': 0, 'msg': '已更新重复计划', 'schedule': sched})
+
+@app.delete('/api/schedules/<schedule_id>')
+def api_schedules_delete(schedule_id):
+    sched = owned_schedule(schedule_id, request.headers.get('X-Client-Id'))
+    if sched is None:
+        return jsonify({'code':-1,'msg':'重复计划不存在'}), 404
+    SCHEDULES.pop(schedule_id, None)
+    cancel_job(sched.get('next_job_id'))
+    # 写删除标记而不是直接删行，其他 worker 同步时才能得知
+    STORE.save_schedule({'schedule_id': schedule_id, 'client_id': sched.get('client_id'), 'deleted': True,
+                         'rev': sched.get('rev', 0) + 1})
+    return jsonify({'code': 0, 'msg': '已删除重复计划'})
+
+@app.get('/api/occupancy')
+def api_occupancy():
+    # 历史占用查询：room 必填；time 为 HH:MM（不填返回全天各时间格）；weekday 0-6（周一为 0）；days 回看天数
+    room = (request.args.get('room') or '').strip().upper()
+    if not room:
+        out = OCCUPANCY.stats()
+        out['collector'] = COLLECTOR.stats()
+        out['ranking'] = RANKER.stats()
+        return jsonify(out)
+    try:
+        weekday = request.args.get('weekday')
+        weekday = int(weekday) if weekday not in (None, '') else None
+        days = int(request.args.get('days', '90'))
+        t = request.args.get('time')
+        slots = None
+        if t:
+            h, m = t.split(':')
+            slots = [slot_of(int(h) * 60 + int(m))]
+            if slots[0] is None:
+                return jsonify({'code':-1,'msg':'时间超出开放时段'})
+    except ValueError:
+        return jsonify({'code':-1,'msg':'参数错误'})
+    since = datetime.date.today().toordinal() - days
+    out = []
+    for i in slots if slots is not None else range(SLOT_COUNT):
+        m = SLOT_START + i * SLOT_MINUTES
+        item = {'time': f'{m // 60:02d}:{m % 60:02d}'}
+        item.update(OCCUPANCY.free_fraction(room, i, weekday, since))
+        out.append(item)
+    return jsonify({'code': 0, 'room': room, 'weekday': weekday, 'days': days, 'slots': out})
+
+@app.get('/api/free-seats')
+def api_free_seats():
+    # 所选时段完全空闲的座位，按包含该时段的连续空闲时长从大到小排列
+    room = (request.args.get('room') or '').strip().upper()
+    seatdate = request.args.get('seatdate') or datetime.date.today().strftime('%Y-%m-%d')
+    try:
+        dt = [int(x) for x in (request.args.get('datetime') or '').split(',')]
+        if len(dt) != 2 or dt[0] >= dt[1]:
+            raise ValueError
+    except ValueError:
+        return jsonify({'code':-1,'msg':'datetime 格式应为 开始分钟,结束分钟'})
+    if not room:
+        return jsonify({'code':-1,'msg':'缺少阅览室'})
+    try:
+        seats = fetch_availability(room, seatdate, request.headers.get('X-Client-Id'))
+    except Exception as e:
+        return jsonify({'code':-1,'msg':f'获取座位状态失败：{e}'})
+    if seats is None:
+        return jsonify({'code':-1,'msg':'获取座位状态失败'})
+    free, busy = free_windows(seats, dt[0], dt[1])
+    items = [{'seatno': code, 'free_minutes': n * SLOT_MINUTES} for code, n in free]
+    return jsonify({'code': 0, 'room': room, 'seatdate': seatdate, 'datetime': dt, 'seats': items, 'busy': len(busy)})
+
+@app.get('/api/adjacent')
+def api_adjacent():
+    # 找 n 个相邻且所选时段都空闲的座位（小组学习）；near 为希望靠近的座位
+    room = (request.args.get('room') or '').strip().upper()
+    near = (request.args.get('near') or '').strip().upper()
+    if not room and near:
+        room = SEAT_INDEX.lookup(near)['room']
+    seatdate = request.args.get('seatdate') or datetime.date.today().strftime('%Y-%m-%d')
+    try:
+        n = int(request.args.get('n', '2'))
+        limit = int(request.args.get('limit', '5'))
+        dt = [int(x) for x in (request.args.get('datetime') or '').split(',')]
+        if len(dt) != 2 or dt[0] >= dt[1] or not 1 <= n <= 20:
+            raise ValueError
+    except ValueError:
+        return jsonify({'code':-1,'msg':'参数错误：n 为 1-20，datetime 格式应为 开始分钟,结束分钟'})
+    if not room:
+        return jsonify({'code':-1,'msg':'缺少阅览室'})
+    get_seat_map(room, request.headers.get('X-Client-Id'))
+    m = SEAT_MAPS.room(room)
+    if m is None:
+        return jsonify({'code':-1,'msg':'该阅览室座位图没有坐标'})
+    try:
+        seats = fetch_availability(room, seatdate, request.headers.get('X-Client-Id'))
+    except Exception as e:
+        return jsonify({'code':-1,'msg':f'获取座位状态失败：{e}'})
+    if seats is None:
+        return jsonify({'code':-1,'msg':'获取座位状态失败'})
+    free, _ = free_windows(seats, dt[0], dt[1])
+    groups = m.adjacent([code for code, _ in free], n, near=near or None, limit=limit)
+    return jsonify({'code': 0, 'room': room, 'seatdate': seatdate, 'datetime': dt, 'n': n, 'groups': groups})
 
 @app.get('/api/verify')
 def api_verify():
-    s = make_session()
-    headers = dict(HEADERS)
-    headers['Cookie'] = load_cookie_header(request.headers.get('X-Client-Id'))
-    # 尝试基础接口以判断登录态
-    url1 = f'{BASE}/apim/basic/BasicHandler.ashx'
-    r1 = s.get(url1, headers=headers, timeout=10)
-    try:
-        _ = r1.json()
-        return jsonify({'ok': True, 'via': 'basic'})
-    except Exception:
-        url2 = f'{BASE}/apim/nav/NavHandler.ashx'
-        r2 = s.get(url2, headers=headers, timeout=10)
-        try:
-            _ = r2.json()
-            return jsonify({'ok': True, 'via': 'nav'})
-        except Exception:
-            raw1 = r1.text[:300]
-            reason = 'session_expired' if '页面停留时间过长' in (raw1 or '') else 'unknown'
-            return jsonify({'ok': False, 'status': r1.status_code, 'raw': raw1, 'reason': reason})
+    cid = request.headers.get('X-Client-Id')
+    return jsonify(ENGINE.run(run_as(cid, UI, verify_login(ENGINE, booking_headers(cid)))))
 
 @app.get('/api/user')
 def api_user():
-    s = make_session()
+    cid = request.headers.get('X-Client-Id')
+    s = make_session(cid)
     headers = dict(HEADERS)
-    headers['Cookie'] = load_cookie_header(request.headers.get('X-Client-Id'))
+    headers['Cookie'] = load_cookie_header(cid)
     try:
         # 尝试 apim
         url1 = f'{BASE}/apim/user/UserHandler.ashx'
+        OUTBOUND.acquire(cid, UI)
         r1 = s.get(url1, headers=headers, params={'data_type':'user_info'}, timeout=10)
         j1 = r1.json()
         if j1.get('code') == 0:
@@ -603,6 +1173,7 @@ def api_user():
             return jsonify({'user_name': data1.get('user_name',''), 'real_name': data1.get('real_name','')})
         # 回退到 mobile
         url2 = f'{BASE}/mobile/ajax/user/UserHandler.ashx'
+        OUTBOUND.acquire(cid, UI)
         r2 = s.post(url2, headers=headers, data={'data_type':'user_info'}, timeout=10)
         j2 = r2.json()
         if j2.get('code') == 0:
@@ -612,16 +1183,37 @@ def api_user():
         pass
     return jsonify({'user_name':'', 'real_name':''})
 
+@app.get('/api/metrics')
+def api_metrics():
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.get('/api/clock')
+def api_clock():
+    est = CLOCK.estimate()
+    if not est:
+        return jsonify({'synced': False})
+    est['synced'] = True
+    est['server_now'] = CLOCK.server_now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    return jsonify(est)
+
+@app.get('/api/pool')
+def api_pool():
+    out = SESSION_POOL.stats()
+    out['engine'] = ENGINE.stats()
+    out['cookies'] = COOKIE_STORE.stats()
+    out['events'] = JOB_EVENTS.stats()
+    out['keepalive'] = SESSION_MONITOR.stats()
+    out['shared'] = SHARED.stats()
+    out['singleflight'] = SINGLE_FLIGHT.stats()
+    out['requests'] = POLICY.stats()
+    out['outbound'] = OUTBOUND.stats()
+    return jsonify(out)
+
 @app.get('/api/cookies')
 def api_cookies_get():
     cid = request.headers.get('X-Client-Id')
-    if cid and cid in COOKIES_BY_CLIENT:
-        arr = COOKIES_BY_CLIENT[cid]
-        kv = {c['name']: c['value'] for c in arr}
-        return jsonify(kv)
     try:
-        arr = json.load(open('cookies.json','r',encoding='utf-8'))
-        kv = {c['name']: c['value'] for c in arr}
+        kv = {c['name']: c['value'] for c in COOKIE_STORE.cookies(cid)}
         return jsonify(kv)
     except Exception:
         return jsonify({})
@@ -660,23 +1252,23 @@ def api_cookies_post():
             'value': v
         })
     # 保留固定值的 cookie（不提供输入框）：cookie_unit_name、cookie_come_app
-    try:
-        arr_old = json.load(open('cookies.json','r',encoding='utf-8'))
-        fixed = {'cookie_unit_name', 'cookie_come_app'}
-        for c in arr_old:
-            if c.get('name') in fixed:
-                out.append(c)
-    except Exception:
-        pass
+    out.extend(COOKIE_STORE.fixed())
     if cid:
-        COOKIES_BY_CLIENT[cid] = out
+        COOKIE_STORE.set(cid, out)
+        SESSION_MONITOR.touch(cid)
+        STORE.save_cookies(cid, out)
+        recompile_client(cid)
         return jsonify({'code':0,'msg':'已保存','count':len(out)})
     try:
-        with open('cookies.json','w',encoding='utf-8') as f:
-            json.dump(out, f, ensure_ascii=False, indent=2)
+        COOKIE_STORE.save_file(out)
+        SESSION_MONITOR.touch(None)
+        recompile_client(None)
         return jsonify({'code':0,'msg':'已保存','count':len(out)})
     except Exception:
         return jsonify({'code':-1,'msg':'保存失败'})
 
+restore_jobs()
+
 if __name__ == '__main__':
+    # 开发用；生产部署见 wsgi.py
     app.run(host='127.0.0.1', port=5000)
@@ -0,0 +1,26 @@
+import os
+
+from web_app import app
+
+# 生产入口：
+#   多进程：gunicorn -c gunicorn.conf.py wsgi:app（Linux/macOS）
+#   单进程多线程：python wsgi.py（waitress，Windows 亦可）
+BIND = os.environ.get('HUNNU_BIND', '127.0.0.1:5000')
+THREADS = int(os.environ.get('HUNNU_THREADS', '16'))
+# 空闲连接超时；SSE 每 HUNNU_SSE_HEARTBEAT_SECONDS 秒有心跳，应大于它
+TIMEOUT = int(os.environ.get('HUNNU_TIMEOUT', '120'))
+CONNECTION_LIMIT = int(os.environ.get('HUNNU_CONNECTION_LIMIT', '1000'))
+
+
+def main():
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit('未安装 waitress：pip install waitress；多进程部署请使用 gunicorn -c gunicorn.conf.py wsgi:app')
+    host, port = BIND.rsplit(':', 1)
+    serve(app, host=host, port=int(port), threads=THREADS, channel_timeout=TIMEOUT,
+          connection_limit=CONNECTION_LIMIT, ident='hunnu')
+
+
+if __name__ == '__main__':
+    main()